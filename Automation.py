@@ -1,10 +1,20 @@
+import argparse
 import json
 import os
-import shutil
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 import logging
 
+import duplicates
+import journal
+import mover
+import retention
+import scanner
+import sweep
+import tiers
+import undo
+import watcher
+
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -42,9 +52,10 @@ today = datetime.today().weekday()  # Monday is 0, Sunday is 6
 
 def move_file(file_path, destination_dir):
     try:
-        if not os.path.exists(destination_dir):
-            os.makedirs(destination_dir)
-        shutil.move(file_path, destination_dir)
+        os.makedirs(destination_dir, exist_ok=True)
+        same_device = os.stat(os.path.dirname(file_path)).st_dev == os.stat(destination_dir).st_dev
+        mover.move(os.path.dirname(file_path), os.path.basename(file_path),
+                   os.path.join(destination_dir, os.path.basename(file_path)), same_device=same_device)
         logging.info(f"Moved file {file_path} to {destination_dir}")
     except Exception as e:
         logging.error(f"Error moving file {file_path} to {destination_dir}: {e}")
@@ -53,16 +64,115 @@ def organize_files(directory):
     logging.info(f"Organizing files in {directory}...")
     files_moved = 0
     try:
-        for file_name in os.listdir(directory):
-            file_path = os.path.join(directory, file_name)
-            if os.path.isfile(file_path):
+        for entry in scanner.scan_files(directory, skip_hidden=False):
+            if entry.is_file():
                 # Example logic: Move text files to a specific folder
-                if file_name.endswith('.txt'):
-                    move_file(file_path, os.path.join(directory, 'TextFiles'))
+                if entry.name.endswith('.txt'):
+                    move_file(entry.path, os.path.join(directory, 'TextFiles'))
                 files_moved += 1
         logging.info(f"Moved {files_moved} files in {directory}.")
     except Exception as e:
         logging.error(f"Error organizing files in {directory}: {e}")
 
-# Example usage
-organize_files(DESKTOP_DIR)
\ No newline at end of file
+# Organize, archive and file screenshots in one traversal of Desktop and Downloads
+def sweep_directories(recursive=None):
+    logging.info("Sweeping Desktop and Downloads...")
+    try:
+        depth = sweep.recursive_depth(config, recursive)
+        journal_dir = sweep.journal_dir(config)
+        if journal_dir:
+            recovered = journal.recover(journal_dir)
+            if any(recovered.values()):
+                logging.info(f"Finished {sum(recovered.values())} moves interrupted by an earlier crash.")
+        counts = sweep.run_sweep(sweep.default_roots(config, depth), sweep.Router(config),
+                                 snapshot_dir=sweep.snapshot_dir(config), journal_dir=journal_dir,
+                                 bundler=sweep.bundler(config), archive_catalog=sweep.archive_catalog(config))
+        logging.info(f"Sweep finished: {counts[sweep.ORGANIZE]} organized, "
+                     f"{counts[sweep.ARCHIVE]} archived, {counts[sweep.SCREENSHOT]} screenshots.")
+    except Exception as e:
+        logging.error(f"Error during sweep: {e}")
+
+# Print the moves a sweep would make, without making them
+def plan_directories(recursive=None):
+    depth = sweep.recursive_depth(config, recursive)
+    plan = sweep.plan_sweep(sweep.default_roots(config, depth), sweep.Router(config),
+                            snapshot_dir=sweep.snapshot_dir(config))
+    print(json.dumps(sweep.plan_summary(plan), indent=2))
+
+# Print groups of identical files in Desktop and Downloads (subfolders up to
+# recursive.max_depth, the archive folder included), largest waste first
+def find_duplicates():
+    report = duplicates.report(sweep.duplicate_finder(config), [DESKTOP_DIR, DOWNLOADS_DIR, ARCHIVE_DIR],
+                               sweep.recursive_depth(config, True))
+    print(json.dumps(report, indent=2))
+
+# Delete archived files past their category's retention (config['retention'])
+def expire_archive():
+    archive_catalog = sweep.archive_catalog(config)
+    if not archive_catalog:
+        logging.error("Expiry needs the archive catalog; set \"catalog\": true in config.json.")
+        return
+    days, default_days = retention.policies(config)
+    counts = retention.expire(archive_catalog, days, default_days, sweep.journal_dir(config))
+    logging.info(f"Expired {counts[retention.EXPIRE]} archived files ({counts['bytes']} bytes), "
+                 f"{counts['failed']} failed.")
+
+# Compact warm archive entries older than tiers.cold_after_days into cold storage
+def compact_archive():
+    archive_catalog = sweep.archive_catalog(config)
+    if not tiers.enabled(config) or not archive_catalog:
+        logging.error("Compaction needs tiers.enabled and the archive catalog in config.json.")
+        return
+    cold_after_days, cold_dir = tiers.cold_settings(config)
+    counts = tiers.compact(archive_catalog, sweep.cold_archiver(config), cold_after_days, cold_dir)
+    logging.info(f"Compacted {counts['compacted']} archived files ({counts['bytes']} bytes), "
+                 f"{counts['failed']} failed.")
+
+# Put back every file moved by a journaled run (the last one by default)
+def undo_sweep(run_id=None):
+    journal_dir = sweep.journal_dir(config)
+    if not journal_dir:
+        logging.error("Undo needs the move journal; set \"journal\": true in config.json.")
+        return
+    try:
+        result = undo.undo_run(journal_dir, run_id, sweep.archive_catalog(config))
+    except LookupError as e:
+        logging.error(f"Nothing undone: {e}")
+        return
+    logging.info(f"Undid run {result['run_id']}: {result['restored']} restored, "
+                 f"{len(result['skipped'])} skipped (changed or missing), {result['failed']} failed.")
+
+def main():
+    parser = argparse.ArgumentParser(description="Mac file automation")
+    parser.add_argument("action", nargs="?", default="organize", choices=["organize", "sweep", "plan", "watch", "undo",
+                                                                               "duplicates", "expire", "compact"],
+                        help="organize: example Desktop cleanup (default); sweep: organize, archive and file screenshots; "
+                             "plan: list what sweep would move; watch: keep organizing new files as they arrive; "
+                             "undo: put back the files moved by the last (or --run) sweep; "
+                             "duplicates: list groups of identical files; "
+                             "expire: delete archived files past their retention; "
+                             "compact: move old warm archive files into cold storage")
+    parser.add_argument("--recursive", action=argparse.BooleanOptionalAction, default=None,
+                        help="also sweep subfolders, up to recursive.max_depth in config.json")
+    parser.add_argument("--run", default=None, help="run ID to undo (see /runs); default: the last run")
+    args = parser.parse_args()
+
+    if args.action == "sweep":
+        sweep_directories(args.recursive)
+    elif args.action == "plan":
+        plan_directories(args.recursive)
+    elif args.action == "undo":
+        undo_sweep(args.run)
+    elif args.action == "compact":
+        compact_archive()
+    elif args.action == "expire":
+        expire_archive()
+    elif args.action == "duplicates":
+        find_duplicates()
+    elif args.action == "watch":
+        watcher.watch(config)
+    else:
+        organize_files(DESKTOP_DIR)
+
+if __name__ == "__main__":
+    main()
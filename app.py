@@ -1,8 +1,16 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, send_file
 import json
 import os
-import shutil
-from datetime import datetime, timedelta
+from datetime import datetime
+
+import catalog
+import duplicates
+import journal
+import retention
+import shards
+import thumbnails
+import sweep
+import undo
 
 app = Flask(__name__)
 
@@ -20,118 +28,91 @@ DOWNLOADS_DIR = os.path.expanduser(config['directories']['downloads'])
 SCREENSHOTS_DIR = os.path.expanduser(config['directories']['screenshots'])
 ARCHIVE_DIR = os.path.expanduser(config['directories']['archive'])
 
-# Global counters for tracking file movements
+# Move journal; runs interrupted by a crash are finished before anything else
+JOURNAL_DIR = sweep.journal_dir(config)
+if JOURNAL_DIR:
+    journal.recover(JOURNAL_DIR)
+
+# Global counters for tracking file movements, restored from the journal's totals
+journal_totals = journal.load_stats(JOURNAL_DIR) if JOURNAL_DIR else {}
 stats = {
-    "total_files_moved": 0,
-    "total_files_archived": 0,
-    "total_screenshots_organized": 0
+    "total_files_moved": journal_totals.get(sweep.ORGANIZE, 0),
+    "total_files_archived": journal_totals.get(sweep.ARCHIVE, 0),
+    "total_screenshots_organized": journal_totals.get(sweep.SCREENSHOT, 0)
 }
 
-# Helper function to categorize file types
-def get_file_category(file_extension):
-    for category, extensions in config['folders'].items():
-        if file_extension.lower() in extensions:
-            return category
-    return "Others"
-
-# Function to organize files
-def organize_files(directory):
-    files_moved = 0
-    for file_name in os.listdir(directory):
-        file_path = os.path.join(directory, file_name)
-
-        if os.path.isdir(file_path) or file_name.startswith('.'):
-            continue
-
-        file_extension = os.path.splitext(file_name)[1]
-        category = get_file_category(file_extension)
-        target_folder = os.path.join(directory, category)
-        os.makedirs(target_folder, exist_ok=True)
+# Routing tables (extension index, keyword automaton), compiled once from config
+ROUTER = sweep.Router(config)
 
-        target_path = os.path.join(target_folder, file_name)
+# Per-root snapshots that let repeated sweeps skip unchanged directories
+SNAPSHOT_DIR = sweep.snapshot_dir(config)
 
-        if os.path.exists(target_path):
-            base, ext = os.path.splitext(file_name)
-            timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-            target_path = os.path.join(target_folder, f"{base}_{timestamp}{ext}")
+# Packs archived files into monthly compressed bundles when config['bundles'] is
+# enabled; with config['chunks'], large files skip content-defined chunking so
+# requests are not held up by it
+BUNDLER = sweep.bundler(config, interactive=True)
 
-        shutil.move(file_path, target_path)
-        files_moved += 1
-        print(f"Moved: {file_name} -> {target_folder}")
+# Catalog of archived files behind /catalog/search and /catalog/restore
+CATALOG = sweep.archive_catalog(config)
 
-    stats["total_files_moved"] += files_moved
-    return files_moved
+# Duplicate finder for /duplicates, sharing the persistent hash cache with sweeps
+DUPLICATES = ROUTER.duplicates or sweep.duplicate_finder(config)
 
-# Function to archive old files
-def archive_old_files(directory, archive_dir, days_old=30):
-    files_archived = 0
-    now = datetime.now()
+# Rendered previews for /thumbnail and /previews, keyed by content hash
+THUMBNAILS = thumbnails.thumbnail_cache(config, DUPLICATES)
 
-    for file_name in os.listdir(directory):
-        file_path = os.path.join(directory, file_name)
+# Thumbnails are addressed by content hash, so browsers may keep them for good
+IMMUTABLE = "public, max-age=31536000, immutable"
 
-        if os.path.isdir(file_path) or file_name.startswith('.'):
-            continue
+# Helper function to categorize files by name (or bare extension such as ".pdf")
+def get_file_category(file_name):
+    return ROUTER.extensions.category_for(file_name)
 
-        file_access_time = datetime.fromtimestamp(os.path.getatime(file_path))
-        if now - file_access_time > timedelta(days=days_old):
-            os.makedirs(archive_dir, exist_ok=True)
-            target_path = os.path.join(archive_dir, file_name)
+# Add a sweep's move counts to the dashboard counters
+def record_sweep(counts):
+    stats["total_files_moved"] += counts[sweep.ORGANIZE]
+    stats["total_files_archived"] += counts[sweep.ARCHIVE]
+    stats["total_screenshots_organized"] += counts[sweep.SCREENSHOT]
 
-            if os.path.exists(target_path):
-                base, ext = os.path.splitext(file_name)
-                timestamp = file_access_time.strftime("%Y%m%d")
-                target_path = os.path.join(archive_dir, f"{base}_{timestamp}{ext}")
+# Recursive sweep depth for this request: ?recursive=1/0 overrides config['recursive']['enabled']
+def requested_depth():
+    requested = request.values.get('recursive')
+    if requested is None:
+        return sweep.recursive_depth(config)
+    return sweep.recursive_depth(config, requested.lower() in ('1', 'true', 'on', 'yes'))
 
-            shutil.move(file_path, target_path)
-            files_archived += 1
-            print(f"Archived: {file_name} -> {archive_dir}")
+# Function to organize files in directories (and, with recursive_depth, the files
+# in their subfolders) as one run; returns the sweep's counts
+def organize_files(directories, recursive_depth=0):
+    roots = [sweep.SweepRoot(directory, recursive_depth=recursive_depth) for directory in directories]
+    counts = sweep.run_sweep(roots, ROUTER, snapshot_dir=SNAPSHOT_DIR, journal_dir=JOURNAL_DIR,
+                             bundler=BUNDLER, archive_catalog=CATALOG)
+    record_sweep(counts)
+    return counts
 
-    stats["total_files_archived"] += files_archived
-    return files_archived
+# Function to archive old files; returns the sweep's counts
+def archive_old_files(directory, archive_dir, days_old=30):
+    root = sweep.SweepRoot(directory, organize=False, archive_dir=archive_dir, days_old=days_old)
+    counts = sweep.run_sweep([root], ROUTER, snapshot_dir=SNAPSHOT_DIR, journal_dir=JOURNAL_DIR,
+                             bundler=BUNDLER, archive_catalog=CATALOG)
+    record_sweep(counts)
+    return counts
 
-# Function to organize screenshots
+# Function to organize screenshots; returns the sweep's counts
 def organize_screenshots():
-    project_keywords = {
-        "Meeting": ["meeting", "call", "discussion"],
-        "Presentation": ["presentation", "slide", "ppt"],
-        "Design": ["design", "mockup", "sketch"]
-    }
-
-    month_folder = datetime.now().strftime("%B_%Y")
-    target_month_dir = os.path.join(SCREENSHOTS_DIR, month_folder)
-    os.makedirs(target_month_dir, exist_ok=True)
-
-    screenshots_moved = 0
-
-    for file_name in os.listdir(DESKTOP_DIR):
-        file_path = os.path.join(DESKTOP_DIR, file_name)
-
-        if os.path.isdir(file_path) or not file_name.lower().startswith("screenshot"):
-            continue
-
-        for project, keywords in project_keywords.items():
-            if any(keyword.lower() in file_name.lower() for keyword in keywords):
-                target_folder = os.path.join(SCREENSHOTS_DIR, project)
-                os.makedirs(target_folder, exist_ok=True)
-                target_path = target_folder
-                break
-        else:
-            target_path = target_month_dir
-
-        target_file_path = os.path.join(target_path, file_name)
-
-        if os.path.exists(target_file_path):
-            base, ext = os.path.splitext(file_name)
-            timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-            target_file_path = os.path.join(target_path, f"{base}_{timestamp}{ext}")
-
-        shutil.move(file_path, target_file_path)
-        screenshots_moved += 1
-        print(f"Moved Screenshot: {file_name} -> {target_path}")
-
-    stats["total_screenshots_organized"] += screenshots_moved
-    return screenshots_moved
+    root = sweep.SweepRoot(DESKTOP_DIR, organize=False, screenshots=True)
+    counts = sweep.run_sweep([root], ROUTER, snapshot_dir=SNAPSHOT_DIR, journal_dir=JOURNAL_DIR,
+                             bundler=BUNDLER, archive_catalog=CATALOG)
+    record_sweep(counts)
+    return counts
+
+# Function to organize, archive and file screenshots in one pass over Desktop and Downloads
+def sweep_all(recursive_depth=None):
+    counts = sweep.run_sweep(sweep.default_roots(config, recursive_depth), ROUTER,
+                             snapshot_dir=SNAPSHOT_DIR, journal_dir=JOURNAL_DIR,
+                             bundler=BUNDLER, archive_catalog=CATALOG)
+    record_sweep(counts)
+    return counts
 
 # Flask routes
 @app.route('/')
@@ -140,20 +121,162 @@ def index():
 
 @app.route('/organize', methods=['POST'])
 def organize_route():
-    desktop_files_moved = organize_files(DESKTOP_DIR)
-    downloads_files_moved = organize_files(DOWNLOADS_DIR)
-    total_files_moved = desktop_files_moved + downloads_files_moved
-    return jsonify({'files_moved': total_files_moved})
+    # Desktop and Downloads in one run, so a single undo reverts both
+    counts = organize_files([DESKTOP_DIR, DOWNLOADS_DIR], requested_depth())
+    return jsonify({'files_moved': counts[sweep.ORGANIZE], 'run_id': counts.get('run_id')})
 
 @app.route('/archive', methods=['POST'])
 def archive_route():
-    files_archived = archive_old_files(DOWNLOADS_DIR, ARCHIVE_DIR, days_old=config['days_old_for_archive'])
-    return jsonify({'files_archived': files_archived})
+    counts = archive_old_files(DOWNLOADS_DIR, ARCHIVE_DIR, days_old=config['days_old_for_archive'])
+    return jsonify({'files_archived': counts[sweep.ARCHIVE], 'run_id': counts.get('run_id')})
 
 @app.route('/screenshots', methods=['POST'])
 def organize_screenshots_route():
-    screenshots_moved = organize_screenshots()
-    return jsonify({'screenshots_moved': screenshots_moved})
+    counts = organize_screenshots()
+    return jsonify({'screenshots_moved': counts[sweep.SCREENSHOT], 'run_id': counts.get('run_id')})
+
+@app.route('/sweep', methods=['POST'])
+def sweep_route():
+    counts = sweep_all(requested_depth())
+    return jsonify({
+        'files_moved': counts[sweep.ORGANIZE],
+        'files_archived': counts[sweep.ARCHIVE],
+        'screenshots_moved': counts[sweep.SCREENSHOT],
+        'engine': counts['engine'],
+        'timings': counts['timings'],
+        'run_id': counts.get('run_id')
+    })
+
+# Dry run of /sweep: every move it would make, with reasons and sizes
+@app.route('/plan', methods=['GET'])
+def plan_route():
+    plan = sweep.plan_sweep(sweep.default_roots(config, requested_depth()), ROUTER, snapshot_dir=SNAPSHOT_DIR)
+    return jsonify(sweep.plan_summary(plan))
+
+# Groups of identical files in Desktop, Downloads and the archive folder, down to
+# recursive.max_depth (or ?depth=N) levels of subfolders
+@app.route('/duplicates', methods=['GET'])
+def duplicates_route():
+    depth = request.args.get('depth', type=int)
+    if depth is None:
+        depth = sweep.recursive_depth(config, True)
+    directories = [DESKTOP_DIR, DOWNLOADS_DIR, ARCHIVE_DIR]
+    return jsonify(duplicates.report(DUPLICATES, directories, depth))
+
+# path resolved, or None unless it is in Desktop, Downloads or the archive folder
+def swept_path(path):
+    path = os.path.realpath(os.path.expanduser(path))
+    roots = [os.path.realpath(directory) for directory in (DESKTOP_DIR, DOWNLOADS_DIR, ARCHIVE_DIR)]
+    if any(path == root or path.startswith(root + os.sep) for root in roots):
+        return path
+    return None
+
+# One folder (or shard) of Desktop, Downloads or the archive folder: its
+# subfolders and a page of its files (?dir=, ?after=<last name>, ?limit=)
+@app.route('/browse', methods=['GET'])
+def browse_route():
+    folder = swept_path(request.args.get('dir', DOWNLOADS_DIR))
+    if folder is None:
+        return jsonify({'error': 'not a swept folder'}), 403
+    try:
+        return jsonify(shards.listing(folder, request.args.get('limit', 500, type=int), request.args.get('after')))
+    except (FileNotFoundError, NotADirectoryError):
+        return jsonify({'error': f'no folder {folder}'}), 404
+
+# Grid of a folder's files (Desktop by default, ?dir=) with image thumbnails,
+# rendered in one parallel batch before the page is served
+@app.route('/previews', methods=['GET'])
+def previews_route():
+    folder = swept_path(request.args.get('dir', DESKTOP_DIR))
+    if folder is None:
+        return jsonify({'error': 'not a swept folder'}), 403
+    size = thumbnails.thumbnail_size(request.args.get('size', thumbnails.DEFAULT_SIZE, type=int))
+    try:
+        page = shards.listing(folder, request.args.get('limit', 500, type=int), request.args.get('after'))
+    except (FileNotFoundError, NotADirectoryError):
+        return jsonify({'error': f'no folder {folder}'}), 404
+    files = []
+    for file in page['files']:
+        path = os.path.join(folder, file['name'])
+        try:
+            files.append((path, os.stat(path)))
+        except OSError:
+            continue
+    digests = THUMBNAILS.prepare(files, size)
+    for file in page['files']:
+        file['digest'] = digests.get(os.path.join(folder, file['name']))
+    return render_template('previews.html', page=page, size=size)
+
+# Thumbnail of an image (?path=, ?size=). ?v=<content hash>, as linked from
+# /previews, makes the response immutable: new contents get a new URL.
+@app.route('/thumbnail', methods=['GET'])
+def thumbnail_route():
+    path = swept_path(request.args.get('path', ''))
+    if path is None:
+        return jsonify({'error': 'not a swept file'}), 403
+    size = thumbnails.thumbnail_size(request.args.get('size', thumbnails.DEFAULT_SIZE, type=int))
+    try:
+        thumbnail_path, digest = THUMBNAILS.get(path, size)
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+    response = send_file(thumbnail_path, mimetype='image/jpeg', etag=digest)
+    if request.args.get('v') == digest:
+        response.headers['Cache-Control'] = IMMUTABLE
+    return response
+
+# Recent journaled runs, newest first, with their run IDs for /undo
+@app.route('/runs', methods=['GET'])
+def runs_route():
+    if not JOURNAL_DIR:
+        return jsonify({'error': 'journal is disabled'}), 404
+    return jsonify({'runs': undo.recent_runs(JOURNAL_DIR)})
+
+# Put back every file a run moved (the last run unless run_id is given)
+@app.route('/undo', methods=['POST'])
+@app.route('/undo/<run_id>', methods=['POST'])
+def undo_route(run_id=None):
+    if not JOURNAL_DIR:
+        return jsonify({'error': 'journal is disabled'}), 404
+    try:
+        return jsonify(undo.undo_run(JOURNAL_DIR, run_id, CATALOG))
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+
+# Delete archived files past their category's retention (config['retention'])
+@app.route('/expire', methods=['POST'])
+def expire_route():
+    if not CATALOG:
+        return jsonify({'error': 'catalog is disabled'}), 404
+    days, default_days = retention.policies(config)
+    return jsonify(retention.expire(CATALOG, days, default_days, JOURNAL_DIR))
+
+# Archived files by name prefix (?name=), original folder and its subfolders
+# (?dir=) and archive date (?since=/?until=, YYYY-MM-DD), newest first
+@app.route('/catalog/search', methods=['GET'])
+def catalog_search_route():
+    if not CATALOG:
+        return jsonify({'error': 'catalog is disabled'}), 404
+    try:
+        since, until = (datetime.strptime(request.args[key], "%Y-%m-%d").timestamp()
+                        if request.args.get(key) else None for key in ('since', 'until'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    directory = request.args.get('dir')
+    entries = CATALOG.search(request.args.get('name'), os.path.expanduser(directory) if directory else None,
+                             since, until, request.args.get('restored') == '1',
+                             request.args.get('limit', catalog.SEARCH_LIMIT, type=int))
+    return jsonify({'entries': entries})
+
+# Put an archived file back where it was archived from
+@app.route('/catalog/restore/<int:entry_id>', methods=['POST'])
+def catalog_restore_route(entry_id):
+    if not CATALOG:
+        return jsonify({'error': 'catalog is disabled'}), 404
+    try:
+        restored = CATALOG.restore(entry_id, JOURNAL_DIR)
+        return jsonify({'restored': restored.path, 'run_id': restored.run_id})
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
 
 if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1,365 @@
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+
+import chunks
+import mover
+import scanner
+import sweep
+from classifier import ExtensionIndex
+
+# Micro-benchmarks for the organizer hot paths.
+#
+#   python benchmarks.py scan --files 200000
+#   python benchmarks.py classify --extensions 1000 100000
+#   python benchmarks.py moves --files 2000 --size 65536 --target /Volumes/External/tmp
+#   python benchmarks.py sweep --files 50000 --repeat 5
+#   python benchmarks.py chunks --versions 20 --size 4194304 --edits 8
+
+
+# Run fn `repeat` times and return the best wall-clock time in seconds
+def best_of(fn, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+# Create `count` empty files (plus a few folders) in directory
+def populate(directory, count):
+    for i in range(count):
+        with open(os.path.join(directory, f"file_{i}.pdf"), "w"):
+            pass
+    for name in ("Documents", "Images", "Archive"):
+        os.makedirs(os.path.join(directory, name), exist_ok=True)
+
+
+# The pre-scandir sweep: listdir, then isdir, exists and getatime per name
+def legacy_scan(directory):
+    for file_name in os.listdir(directory):
+        file_path = os.path.join(directory, file_name)
+        if os.path.isdir(file_path) or file_name.startswith('.'):
+            continue
+        os.path.exists(file_path)
+        os.path.getatime(file_path)
+
+
+def scandir_scan(directory):
+    with scanner.open_dir(directory) as dir_fd:
+        for entry in scanner.scan_files(directory, dir_fd):
+            entry.stat().st_atime
+
+
+def bench_scan(args):
+    with tempfile.TemporaryDirectory() as directory:
+        populate(directory, args.files)
+        legacy = best_of(lambda: legacy_scan(directory))
+        scanned = best_of(lambda: scandir_scan(directory))
+    print(f"scan of {args.files} files")
+    print(f"  listdir + isdir/exists/getatime  {legacy * 1000:10.1f} ms  (3 stat() per file)")
+    print(f"  scanner.scan_files + entry.stat  {scanned * 1000:10.1f} ms  (1 stat() per file)")
+    print(f"  speedup                          {legacy / scanned:10.2f}x")
+
+
+# The pre-index lookup: scan every category's extension list for each file
+def legacy_category(folders, file_extension):
+    for category, extensions in folders.items():
+        if file_extension.lower() in extensions:
+            return category
+    return "Others"
+
+
+# A config['folders'] table with `count` extensions spread over 20 categories
+def synthetic_folders(count):
+    folders = {f"Category{i}": [] for i in range(20)}
+    for i in range(count):
+        folders[f"Category{i % 20}"].append(f".ext{i}")
+    return folders
+
+
+def bench_classify(args):
+    rng = random.Random(0)
+    for count in args.extensions:
+        folders = synthetic_folders(count)
+        # Mostly known extensions plus some misses, which are the worst case for the loop
+        names = [f"file_{i}.ext{rng.randrange(count)}" for i in range(args.lookups)]
+        names += [f"file_{i}.unknown" for i in range(args.lookups // 10)]
+        extensions = [os.path.splitext(name)[1] for name in names]
+
+        start = time.perf_counter()
+        index = ExtensionIndex(folders)
+        build = time.perf_counter() - start
+
+        legacy = best_of(lambda: [legacy_category(folders, ext) for ext in extensions], repeat=1)
+        indexed = best_of(lambda: [index.category_for(name) for name in names])
+        print(f"classify with {count} extensions ({len(names)} lookups, index built in {build * 1000:.1f} ms)")
+        print(f"  category loop   {legacy / len(names) * 1e9:12.0f} ns/lookup")
+        print(f"  ExtensionIndex  {indexed / len(names) * 1e9:12.0f} ns/lookup")
+        print(f"  speedup         {legacy / indexed:12.1f}x")
+
+
+# Write `count` files of `size` random bytes into directory
+def populate_sized(directory, count, size):
+    payload = os.urandom(size)
+    for i in range(count):
+        with open(os.path.join(directory, f"file_{i}.bin"), "wb") as file:
+            file.write(payload)
+
+
+def bench_moves(args):
+    with tempfile.TemporaryDirectory() as source, \
+            tempfile.TemporaryDirectory(dir=args.target) as target:
+        source_dev, target_dev = os.stat(source).st_dev, os.stat(target).st_dev
+        names = [f"file_{i}.bin" for i in range(args.files)]
+
+        def serial():
+            for name in names:
+                mover.move(source, name, os.path.join(target, name), same_device=source_dev == target_dev)
+
+        def engine_moves():
+            with mover.MoveEngine() as engine:
+                futures = [engine.submit(source, name, os.path.join(target, name), None, source_dev, target_dev)
+                           for name in names]
+                # Same-device moves ran inline and have no Future
+                for future in futures:
+                    if future is not None:
+                        future.result()
+            reports.append(engine.report()[0])
+
+        # Time one batch of moves, leaving the target empty again
+        def timed(fn):
+            populate_sized(source, args.files, args.size)
+            start = time.perf_counter()
+            fn()
+            elapsed = time.perf_counter() - start
+            for name in names:
+                os.unlink(os.path.join(target, name))
+            return elapsed
+
+        # The first batch into a fresh directory is slower whichever runs it, so
+        # one is thrown away and the two take turns after that
+        reports = []
+        timed(serial)
+        times = {serial: [], engine_moves: []}
+        for _ in range(args.repeat):
+            for fn in times:
+                times[fn].append(timed(fn))
+        serial_time, parallel = statistics.median(times[serial]), statistics.median(times[engine_moves])
+        report = reports[-1]
+
+    kind = "same device" if source_dev == target_dev else "cross device"
+    print(f"moves of {args.files} x {args.size} byte files ({kind}), median of {args.repeat}")
+    print(f"  serial       {serial_time * 1000:10.1f} ms")
+    print(f"  MoveEngine   {parallel * 1000:10.1f} ms  "
+          f"(concurrency {report['concurrency']}, peak {report['peak_concurrency']})")
+    print(f"  speedup      {serial_time / parallel:10.2f}x")
+
+
+# A Router over the default folders, for sweeps rooted in temporary directories.
+# Its caches live in state_dir, never in the user's own state directory, and
+# content sniffing and content rules are off, so sweeps only do the name-based
+# work they are meant to measure.
+def synthetic_router(directory, state_dir):
+    return sweep.Router({
+        "directories": {"screenshots": os.path.join(directory, "Screenshots")},
+        "folders": {"Documents": [".pdf", ".txt"], "Images": [".png", ".jpg"], "Archives": [".zip"]},
+        "sorting_rules": {"Finance": ["invoice"]},
+        "state_dir": state_dir,
+        "sniff": False,
+        "content_rules": {"enabled": False},
+    })
+
+
+# Create `count` empty files of mixed types, old enough to be moved, in directory
+def populate_mixed(directory, count):
+    extensions = [".pdf", ".png", ".zip", ".txt", ".jpg", ".bin"]
+    old = time.time() - 3600
+    for i in range(count):
+        path = os.path.join(directory, f"file_{i}{extensions[i % len(extensions)]}")
+        with open(path, "w"):
+            pass
+        os.utime(path, (old, old))
+
+
+# Remove everything in directory
+def clear(directory):
+    for entry in os.scandir(directory):
+        if entry.is_dir(follow_symlinks=False):
+            shutil.rmtree(entry.path)
+        else:
+            os.unlink(entry.path)
+
+
+def bench_sweep(args):
+    with tempfile.TemporaryDirectory() as directory, tempfile.TemporaryDirectory() as state:
+        populate_mixed(directory, args.files)
+        router = synthetic_router(directory, state)
+        roots = [sweep.SweepRoot(directory)]
+
+        # Planning touches nothing, so it can be repeated on the same files
+        planning = best_of(lambda: sweep.plan_sweep(roots, router))
+
+        # Execute a sweep of freshly populated files; the per-move messages go to
+        # /dev/null so the terminal's speed is not part of the time
+        def execution(journal_dir):
+            clear(directory)
+            populate_mixed(directory, args.files)
+            plan = sweep.plan_sweep(roots, router)
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                start = time.perf_counter()
+                counts = sweep.execute_plan(plan, journal_dir=journal_dir)
+                elapsed = time.perf_counter() - start
+            moved.append(counts[sweep.ORGANIZE])
+            return elapsed
+
+        # Plain and journaled sweeps take turns, so drift in the machine's load
+        # affects both alike
+        moved, plain, journaled = [], [], []
+        for _ in range(args.repeat):
+            plain.append(execution(None))
+            journaled.append(execution(os.path.join(state, "journal")))
+        execution_time, journaled_time = statistics.median(plain), statistics.median(journaled)
+
+    print(f"sweep of {args.files} files ({moved[0]} moved), median of {args.repeat}")
+    print(f"  plan               {planning * 1000:10.1f} ms  (list, decide, allocate names)")
+    print(f"  execute            {execution_time * 1000:10.1f} ms  (create folders, move)  "
+          f"range {min(plain) * 1000:.1f}-{max(plain) * 1000:.1f}")
+    overhead = (journaled_time / execution_time - 1) * 100
+    print(f"  execute, journaled {journaled_time * 1000:10.1f} ms  ({overhead:+.1f}%)  "
+          f"range {min(journaled) * 1000:.1f}-{max(journaled) * 1000:.1f}")
+
+
+# Text-like bytes: random words from a small vocabulary
+def random_text(rng, size):
+    words = [bytes(rng.choice(b"abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(2, 9))) for _ in range(2000)]
+    parts, length = [], 0
+    while length < size:
+        word = rng.choice(words) + b" "
+        parts.append(word)
+        length += len(word)
+    return b"".join(parts)[:size]
+
+
+# Write `versions` successive versions of one document to directory, each
+# derived from the previous by `edits` random insertions, deletions and
+# overwrites of up to 4 KiB
+def populate_versions(directory, versions, size, edits, seed=1):
+    rng = random.Random(seed)
+    data = random_text(rng, size)
+    paths = []
+    for version in range(versions):
+        if version:
+            for _ in range(edits):
+                at = rng.randrange(len(data))
+                span = rng.randint(1, 4096)
+                operation = rng.choice(("insert", "delete", "overwrite"))
+                if operation == "insert":
+                    data = data[:at] + random_text(rng, span) + data[at:]
+                elif operation == "delete":
+                    data = data[:at] + data[at + span:]
+                else:
+                    data = data[:at] + random_text(rng, span) + data[at + span:]
+        path = os.path.join(directory, f"report_v{version + 1}.pptx")
+        with open(path, "wb") as file:
+            file.write(data)
+        paths.append(path)
+    return paths
+
+
+# Unique bytes when files are cut into fixed-size blocks
+def fixed_block_bytes(paths, block=chunks.AVG_CHUNK):
+    seen = {}
+    for path in paths:
+        with open(path, "rb") as file:
+            while True:
+                data = file.read(block)
+                if not data:
+                    break
+                seen[hashlib.blake2b(data, digest_size=20).digest()] = len(data)
+    return sum(seen.values())
+
+
+def bench_chunks(args):
+    with tempfile.TemporaryDirectory() as directory, tempfile.TemporaryDirectory() as archive:
+        paths = populate_versions(directory, args.versions, args.size, args.edits)
+        total = sum(os.path.getsize(path) for path in paths)
+        fixed = fixed_block_bytes(paths)
+
+        store = chunks.store_dir(archive)
+        start = time.perf_counter()
+        manifests = [chunks.store_file(store, path, compress=False)[0] for path in paths]
+        chunking = time.perf_counter() - start
+        stored = chunks.store_bytes(archive)
+        chunk_count = sum(len(manifest) for manifest in manifests)
+
+        fixed_store = chunks.store_dir(os.path.join(archive, "fixed"))
+        start = time.perf_counter()
+        for path in paths:
+            chunks.store_file(fixed_store, path, compress=False, cdc_max_bytes=0)
+        fixed_chunking = time.perf_counter() - start
+
+        compressed_archive = os.path.join(archive, "compressed")
+        for path in paths:
+            chunks.store_file(chunks.store_dir(compressed_archive), path, compress=True)
+        compressed = chunks.store_bytes(compressed_archive)
+        manifest_bytes = sum(len(json.dumps(manifest)) for manifest in manifests)
+
+    print(f"{args.versions} versions of a {args.size // 1024} KiB document, {args.edits} edits each "
+          f"({total / 2 ** 20:.1f} MiB in total)")
+    print(f"  fixed {chunks.AVG_CHUNK // 1024} KiB blocks  {fixed / 2 ** 20:8.1f} MiB  ({fixed / total * 100:5.1f}%)")
+    print(f"  content-defined    {stored / 2 ** 20:8.1f} MiB  ({stored / total * 100:5.1f}%)  "
+          f"{chunk_count} chunks, avg {total // chunk_count} bytes")
+    print(f"  + zlib             {compressed / 2 ** 20:8.1f} MiB  ({compressed / total * 100:5.1f}%)")
+    print(f"  manifests          {manifest_bytes / 1024:8.1f} KiB")
+    print(f"  chunking           {total / chunking / 2 ** 20:8.1f} MiB/s per process")
+    print(f"  fixed blocks       {total / fixed_chunking / 2 ** 20:8.1f} MiB/s per process "
+          f"(files over cdc_max_bytes)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Organizer micro-benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    scan_parser = subparsers.add_parser("scan", help="listdir + stat vs os.scandir")
+    scan_parser.add_argument("--files", type=int, default=20000)
+    scan_parser.set_defaults(func=bench_scan)
+
+    classify_parser = subparsers.add_parser("classify", help="category loop vs ExtensionIndex")
+    classify_parser.add_argument("--extensions", type=int, nargs="+", default=[1000, 100000])
+    classify_parser.add_argument("--lookups", type=int, default=2000)
+    classify_parser.set_defaults(func=bench_classify)
+
+    moves_parser = subparsers.add_parser("moves", help="serial moves vs the adaptive MoveEngine")
+    moves_parser.add_argument("--files", type=int, default=2000)
+    moves_parser.add_argument("--size", type=int, default=64 * 1024)
+    moves_parser.add_argument("--target", default=None, help="directory on the target device (default: temp dir)")
+    moves_parser.add_argument("--repeat", type=int, default=5)
+    moves_parser.set_defaults(func=bench_moves)
+
+    sweep_parser = subparsers.add_parser("sweep", help="planning vs executing a sweep")
+    sweep_parser.add_argument("--files", type=int, default=50000)
+    sweep_parser.add_argument("--repeat", type=int, default=5)
+    sweep_parser.set_defaults(func=bench_sweep)
+
+    chunks_parser = subparsers.add_parser("chunks", help="space saved by the chunk store on versioned files")
+    chunks_parser.add_argument("--versions", type=int, default=20)
+    chunks_parser.add_argument("--size", type=int, default=4 * 1024 * 1024)
+    chunks_parser.add_argument("--edits", type=int, default=8)
+    chunks_parser.set_defaults(func=bench_chunks)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
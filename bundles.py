@@ -0,0 +1,248 @@
+import fcntl
+import json
+import os
+import shutil
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import journal
+
+# Compressed monthly archive bundles.
+#
+# With bundles enabled, files a sweep archives are packed into
+# <archive_dir>/<YYYY-MM>/ (month of the file's mtime) instead of being moved
+# there one by one. Each batch of a month is split into size-balanced shards
+# that worker processes write as zip segments in parallel; zip keeps a central
+# directory, so any one member can be read back without decompressing the
+# rest. Types that are already compressed (media, archives, OOXML documents)
+# are stored as-is rather than compressed again.
+#
+# <YYYY-MM>/index.json is the month's member index: member name -> segment,
+# original path, size and mtime. A source file is deleted only once its segment
+# has been fsync'ed and recorded in the index; a file found still in place
+# after a crash is recognised by path, size and mtime and simply removed.
+
+# zipfile compression methods by config name
+COMPRESSION = {
+    "deflate": zipfile.ZIP_DEFLATED,
+    "bzip2": zipfile.ZIP_BZIP2,
+    "lzma": zipfile.ZIP_LZMA,
+}
+
+# Extensions whose contents are already compressed
+STORED_EXTENSIONS = frozenset([
+    ".zip", ".gz", ".tgz", ".bz2", ".xz", ".zst", ".7z", ".rar", ".dmg", ".pkg", ".jar", ".apk",
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic", ".avif",
+    ".mp4", ".mov", ".mkv", ".avi", ".flv", ".webm", ".m4v",
+    ".mp3", ".aac", ".m4a", ".flac", ".ogg", ".opus",
+    ".docx", ".xlsx", ".pptx", ".odt", ".ods", ".odp", ".epub",
+])
+
+# Smallest shard worth a worker process of its own
+MIN_SHARD_BYTES = 16 * 1024 * 1024
+
+
+def is_stored(name):
+    return os.path.splitext(name)[1].lower() in STORED_EXTENSIONS
+
+
+def month_of(mtime_ns):
+    return datetime.fromtimestamp(mtime_ns / 1e9).strftime("%Y-%m")
+
+
+def _index_path(month_dir):
+    return os.path.join(month_dir, "index.json")
+
+
+def load_index(month_dir):
+    try:
+        with open(_index_path(month_dir), "r") as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return {"members": {}}
+
+
+def _save_index(month_dir, index):
+    path = _index_path(month_dir)
+    with open(f"{path}.tmp", "w") as file:
+        json.dump(index, file, separators=(",", ":"))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(f"{path}.tmp", path)
+
+
+# Split members into at most `count` shards of similar total size (largest first)
+def _shards(members, count):
+    shards = [[0, []] for _ in range(count)]
+    for member in sorted(members, key=lambda member: member[2], reverse=True):
+        lightest = min(shards, key=lambda shard: shard[0])
+        lightest[0] += member[2]
+        lightest[1].append(member)
+    return [shard[1] for shard in shards if shard[1]]
+
+
+# Worker process: write one zip segment of (source, member name, size) tuples.
+# Returns [(member name, source, compressed size)] for the members written and
+# [(source, error)] for sources that could not be read.
+def _write_segment(path, members, compression):
+    written, failed = [], []
+    temp_path = f"{path}.tmp"
+    with zipfile.ZipFile(temp_path, "w", allowZip64=True, strict_timestamps=False) as bundle:
+        for source, name, _ in members:
+            compress_type = zipfile.ZIP_STORED if is_stored(name) else compression
+            try:
+                bundle.write(source, name, compress_type=compress_type)
+            except OSError as e:
+                failed.append((source, str(e)))
+                continue
+            written.append((name, source, bundle.getinfo(name).compress_size))
+    with open(temp_path, "rb") as file:
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+    return written, failed
+
+
+# Packs archive moves (sweep.PlannedMove) into monthly bundles
+class Bundler:
+    # How catalog.py records what a bundler archived
+    backend = "bundle"
+
+    def __init__(self, compression="lzma", workers=None):
+        self.compression = COMPRESSION[compression]
+        self.workers = workers or os.cpu_count() or 1
+
+    # Bundle moves, yielding (move, error) for each like sweep.dispatch(); a
+    # bundled move's destination is <month dir>/<member name>
+    def archive(self, moves):
+        months = {}
+        for move in moves:
+            month_dir = os.path.join(os.path.dirname(move.destination), month_of(move.mtime_ns))
+            months.setdefault(month_dir, []).append(move)
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            for month_dir, month_moves in months.items():
+                yield from self._archive_month(pool, month_dir, month_moves)
+
+    def _archive_month(self, pool, month_dir, moves):
+        os.makedirs(month_dir, exist_ok=True)
+        lock_fd = os.open(os.path.join(month_dir, "index.lock"), os.O_WRONLY | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            index = load_index(month_dir)
+            bundled = {(member["source"], member["size"], member["mtime_ns"]): name
+                       for name, member in index["members"].items()}
+            taken = {name.casefold() for name in index["members"]}
+            by_source = {}
+            members = []
+            for move in moves:
+                leftover = bundled.get((move.source, move.size, move.mtime_ns))
+                if leftover:
+                    # Bundled by a run that crashed before removing the source
+                    yield self._remove_source(move._replace(destination=os.path.join(month_dir, leftover)))
+                    continue
+                name = _member_name(os.path.basename(move.source), taken)
+                by_source[move.source] = move
+                members.append((move.source, name, move.size))
+
+            total = sum(size for _, _, size in members)
+            count = max(1, min(self.workers, len(members), total // MIN_SHARD_BYTES or 1))
+            stamp = journal.new_run_id()
+            shards = _shards(members, count)
+            futures = [pool.submit(_write_segment, os.path.join(month_dir, f"{stamp}-{n}.zip"), shard, self.compression)
+                       for n, shard in enumerate(shards)]
+
+            done = []
+            for n, future in enumerate(futures):
+                segment = f"{stamp}-{n}.zip"
+                try:
+                    written, failed = future.result()
+                except Exception as e:
+                    for source, _, _ in shards[n]:
+                        yield by_source[source], e
+                    continue
+                for source, error in failed:
+                    yield by_source[source], OSError(error)
+                for name, source, compressed_size in written:
+                    move = by_source[source]
+                    index["members"][name] = {
+                        "segment": segment, "source": source, "size": move.size,
+                        "compressed_size": compressed_size, "mtime_ns": move.mtime_ns,
+                        "archived": datetime.now().isoformat(timespec="seconds"),
+                    }
+                    done.append(move._replace(destination=os.path.join(month_dir, name)))
+            _save_index(month_dir, index)
+            # Make the new segment and index names themselves durable
+            dir_fd = os.open(month_dir, os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+        finally:
+            os.close(lock_fd)
+
+        # Sources go only after the index naming their segments is on disk
+        for move in done:
+            yield self._remove_source(move)
+
+    @staticmethod
+    def _remove_source(move):
+        try:
+            current = os.lstat(move.source)
+            if (current.st_size, current.st_mtime_ns) != (move.size, move.mtime_ns):
+                return move, OSError(f"{move.source} changed while it was being bundled")
+            os.unlink(move.source)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            return move, e
+        print(f"Bundled: {os.path.basename(move.source)} -> {move.destination}")
+        return move, None
+
+
+# Drop members from a month's index, deleting segments no member is left in.
+# The bytes of a removed member stay in its segment until the rest of the
+# segment is removed too. Returns the names that were members.
+def remove_members(month_dir, names):
+    lock_fd = os.open(os.path.join(month_dir, "index.lock"), os.O_WRONLY | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        index = load_index(month_dir)
+        removed = [name for name in names if index["members"].pop(name, None) is not None]
+        if not removed:
+            return removed
+        _save_index(month_dir, index)
+        in_use = {member["segment"] for member in index["members"].values()}
+        for name in os.listdir(month_dir):
+            if name.endswith(".zip") and name not in in_use:
+                os.unlink(os.path.join(month_dir, name))
+    finally:
+        os.close(lock_fd)
+    return removed
+
+
+# name, or name_N.ext if a member of the month already uses it (casefolded)
+def _member_name(name, taken):
+    candidate = name
+    base, ext = os.path.splitext(name)
+    counter = 2
+    while candidate.casefold() in taken:
+        candidate = f"{base}_{counter}{ext}"
+        counter += 1
+    taken.add(candidate.casefold())
+    return candidate
+
+
+# Extract one member of a month bundle to target_path (default: its original
+# path, which must not exist). Only that member is read and decompressed. The
+# file gets its original mtime and is marked as just accessed, so it is not
+# archived again right away.
+def restore(month_dir, name, target_path=None):
+    member = load_index(month_dir)["members"][name]
+    target_path = target_path or member["source"]
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+    with zipfile.ZipFile(os.path.join(month_dir, member["segment"])) as bundle:
+        with bundle.open(name) as source, open(target_path, "xb") as target:
+            shutil.copyfileobj(source, target, 1024 * 1024)
+    os.utime(target_path, ns=(time.time_ns(), member["mtime_ns"]))
+    return target_path
@@ -0,0 +1,371 @@
+import os
+import sqlite3
+import time
+from collections import namedtuple
+
+import bundles
+import chunks
+import journal
+import mover
+from destinations import DestinationCache
+
+# SQLite catalog of archived files, <state_dir>/catalog.db.
+#
+# Every file a sweep archives gets a row: its original path, where it is now
+# (location), how it is stored there (backend), size, mtime, content hash, the
+# run that archived it and when, and its category. Name, original directory and
+# archive date are indexed, so /catalog/search answers from the indexes without
+# listing the archive, and /catalog/restore/<id> finds a file in one lookup.
+# Restored and expired files keep their row, with restored_at or expired_at set.
+# Files still in the archive are also indexed by (category, archive date), so
+# retention.py reaches the expired ones of a category without touching the rest,
+# and files stored as moved by archive date, for tiers.py to compact old ones.
+#
+# The database runs in WAL mode: a sweep's rows are written in one transaction
+# while the dashboard keeps reading. Names are matched by prefix, which the
+# NOCASE name index serves directly; original directories match a whole subtree
+# through a range scan of their index. A filter matching more than _SORT_LIMIT
+# rows (say, all of Downloads) is instead checked against the date index walked
+# newest first, which stops as soon as the page is full.
+#
+# A restore is journaled like a sweep (see journal.py). A moved file is moved
+# back; a bundled or chunked one is extracted into a hidden partial file that
+# only takes its name once complete, and only then dropped from the archive,
+# so a crash at any point leaves the file either in the archive or restored.
+
+# How an archived file is stored: moved as is, packed into a monthly bundle
+# (location is <month dir>/<member>), or chunked (location is the manifest)
+MOVED = "move"
+BUNDLED = "bundle"
+CHUNKED = "chunks"
+
+# Rows returned by a search unless asked otherwise
+SEARCH_LIMIT = 100
+
+# Matches a name or directory filter may have before a search walks the date
+# index newest first instead of sorting every match
+_SORT_LIMIT = 10000
+
+# Tag appended to a restored name whose original path is taken
+_RESTORED_TAG = "restored"
+
+# Journal kind of a file put back by Catalog.restore()
+RESTORE = "restore"
+
+# A restore as journal.Journal.intent() records it
+_Restore = namedtuple('_Restore', ['kind', 'source', 'destination', 'size', 'mtime_ns'])
+
+# Where Catalog.restore() put a file, and the id of the run journaling it (None
+# without a journal)
+Restored = namedtuple('Restored', ['path', 'run_id'])
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS archived (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL COLLATE NOCASE,
+    original_dir TEXT NOT NULL,
+    location TEXT NOT NULL,
+    backend TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    hash TEXT,
+    run_id TEXT,
+    archived_at REAL NOT NULL,
+    restored_at REAL,
+    category TEXT,
+    expired_at REAL
+);
+CREATE INDEX IF NOT EXISTS archived_name ON archived (name);
+CREATE INDEX IF NOT EXISTS archived_original_dir ON archived (original_dir);
+CREATE INDEX IF NOT EXISTS archived_archived_at ON archived (archived_at);
+CREATE INDEX IF NOT EXISTS archived_run_id ON archived (run_id);
+CREATE INDEX IF NOT EXISTS archived_expiry ON archived (category, archived_at)
+    WHERE restored_at IS NULL AND expired_at IS NULL;
+CREATE INDEX IF NOT EXISTS archived_warm ON archived (archived_at)
+    WHERE backend = 'move' AND restored_at IS NULL AND expired_at IS NULL;
+"""
+
+# Columns added after the first release, created on catalogs that lack them
+_ADDED_COLUMNS = (("category", "TEXT"), ("expired_at", "REAL"))
+
+# Files still in the archive; matches the archived_expiry index
+_ACTIVE = "restored_at IS NULL AND expired_at IS NULL"
+
+_COLUMNS = ("id", "name", "original_dir", "location", "backend", "size", "mtime_ns", "hash", "run_id",
+            "archived_at", "restored_at", "category", "expired_at")
+
+
+def _escape_like(text):
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+class Catalog:
+    def __init__(self, path, finder=None, extensions=None):
+        self.path = path
+        # Content hashes come from the duplicate finder's cache where it has them
+        self.finder = finder
+        # classifier.ExtensionIndex giving each archived file its category
+        self.extensions = extensions
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        connection = self._connect()
+        try:
+            connection.execute("PRAGMA journal_mode=WAL")
+            columns = {row["name"] for row in connection.execute("PRAGMA table_info(archived)")}
+            with connection:
+                if columns:
+                    for column, column_type in _ADDED_COLUMNS:
+                        if column not in columns:
+                            connection.execute(f"ALTER TABLE archived ADD COLUMN {column} {column_type}")
+                connection.executescript(_SCHEMA)
+                if extensions is not None and columns and "category" not in columns:
+                    connection.create_function("category_for", 1, extensions.category_for, deterministic=True)
+                    connection.execute("UPDATE archived SET category = category_for(name)")
+        finally:
+            connection.close()
+
+    # One connection per operation, so request threads never share one
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    # Content hashes of (path, stat) pairs about to be archived, read on the
+    # finder's thread pool; files that cannot be read get none
+    def hash_files(self, files):
+        if self.finder is None or not files:
+            return {}
+        return self.finder.full_hashes(files)
+
+    # Record archived files: (original path, location, backend, size, mtime_ns,
+    # hash) tuples from one run
+    def record(self, entries, run_id=None):
+        if not entries:
+            return
+        now = time.time()
+        category_for = self.extensions.category_for if self.extensions else lambda name: None
+        rows = []
+        for source, location, backend, size, mtime_ns, digest in entries:
+            name = os.path.basename(source)
+            rows.append((name, os.path.dirname(source), location, backend, size, mtime_ns, digest, run_id, now,
+                         category_for(name)))
+        with self._connect() as connection:
+            connection.executemany(
+                "INSERT INTO archived (name, original_dir, location, backend, size, mtime_ns, hash, run_id,"
+                " archived_at, category) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        connection.close()
+
+    # Archived files, newest first, whose name starts with name, that came from
+    # directory (or below it), archived between since and until (epoch seconds).
+    # include_restored also lists files restored or expired since.
+    def search(self, name=None, directory=None, since=None, until=None, include_restored=False,
+               limit=SEARCH_LIMIT):
+        clauses, parameters = [], []
+        if name:
+            clauses.append("name LIKE ? ESCAPE '\\'")
+            parameters.append(_escape_like(name) + "%")
+        if directory:
+            directory = os.path.normpath(directory)
+            # '0' sorts right after '/', so the range is exactly the subtree
+            clauses.append("(original_dir = ? OR (original_dir >= ? AND original_dir < ?))")
+            parameters += [directory, directory + "/", directory + "0"]
+        if since is not None:
+            clauses.append("archived_at >= ?")
+            parameters.append(since)
+        if until is not None:
+            clauses.append("archived_at < ?")
+            parameters.append(until)
+        if not include_restored:
+            clauses.append(_ACTIVE)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        connection = self._connect()
+        try:
+            table = "archived"
+            if name or directory:
+                matches = connection.execute(f"SELECT count(*) FROM (SELECT 1 FROM archived {where} LIMIT ?)",
+                                             parameters + [_SORT_LIMIT]).fetchone()[0]
+                if matches >= _SORT_LIMIT:
+                    table = "archived INDEXED BY archived_archived_at"
+            rows = connection.execute(f"SELECT {', '.join(_COLUMNS)} FROM {table} {where}"
+                                      f" ORDER BY archived_at DESC, id DESC LIMIT ?", parameters + [limit]).fetchall()
+        finally:
+            connection.close()
+        return [dict(row) for row in rows]
+
+    def get(self, entry_id):
+        connection = self._connect()
+        try:
+            row = connection.execute(f"SELECT {', '.join(_COLUMNS)} FROM archived WHERE id = ?",
+                                     (entry_id,)).fetchone()
+        finally:
+            connection.close()
+        return dict(row) if row else None
+
+    # Put an archived file back at its original path (or a tagged name next to
+    # it if that is taken), journaled in journal_dir, and return a Restored.
+    # Raises LookupError for an unknown or already restored entry.
+    def restore(self, entry_id, journal_dir=None):
+        entry = self.get(entry_id)
+        if entry is None:
+            raise LookupError(f"no archived file {entry_id}")
+        if entry["restored_at"] is not None:
+            raise LookupError(f"archived file {entry_id} was already restored")
+        if entry["expired_at"] is not None:
+            raise LookupError(f"archived file {entry_id} has expired")
+
+        folder = entry["original_dir"]
+        os.makedirs(folder, exist_ok=True)
+        target = DestinationCache().allocate(folder, entry["name"], _RESTORED_TAG)
+        location, backend = entry["location"], entry["backend"]
+        packed = backend in (BUNDLED, CHUNKED)
+        run_journal = journal.Journal(journal_dir) if journal_dir else None
+        if run_journal:
+            run_journal.intent(0, _Restore(RESTORE, location, target, entry["size"], entry["mtime_ns"]),
+                               backend if packed else None)
+            run_journal.commit()
+        try:
+            if packed:
+                extract(backend, location, target)
+            else:
+                same_device = os.stat(os.path.dirname(location)).st_dev == os.stat(folder).st_dev
+                mover.move(os.path.dirname(location), os.path.basename(location), target, same_device=same_device)
+                mover.mark_accessed(target)
+        except BaseException:
+            if run_journal:
+                run_journal.failed(0)
+                run_journal.close({RESTORE: 0})
+            raise
+        if packed:
+            try:
+                drop([(backend, location)])
+            except OSError as e:
+                # The file is back; the archive just keeps a stale copy of it
+                print(f"Error dropping {location} from the archive: {e}")
+
+        self.mark_restored("id = ?", (entry_id,))
+        if run_journal:
+            run_journal.done(0)
+            run_journal.close({RESTORE: 1})
+        return Restored(target, run_journal.run_id if run_journal else None)
+
+    # Categories with files in the archive, one index probe per category
+    def categories(self):
+        connection = self._connect()
+        try:
+            rows = connection.execute(f"""
+                WITH RECURSIVE present(category) AS (
+                    SELECT min(category) FROM archived WHERE {_ACTIVE}
+                    UNION ALL
+                    SELECT (SELECT min(category) FROM archived WHERE {_ACTIVE} AND category > present.category)
+                    FROM present WHERE present.category IS NOT NULL
+                )
+                SELECT category FROM present WHERE category IS NOT NULL""").fetchall()
+        finally:
+            connection.close()
+        return [row["category"] for row in rows]
+
+    # Up to limit files of category archived before cutoff (epoch seconds),
+    # oldest first, read from the expiry index; after, the (archived_at, id) of
+    # the last file of the previous page, continues from there
+    def expired(self, category, cutoff, limit, after=(0, 0)):
+        connection = self._connect()
+        try:
+            rows = connection.execute(f"SELECT {', '.join(_COLUMNS)} FROM archived"
+                                      f" WHERE category = ? AND archived_at < ? AND {_ACTIVE}"
+                                      f" AND (archived_at, id) > (?, ?)"
+                                      f" ORDER BY archived_at, id LIMIT ?",
+                                      (category, cutoff) + tuple(after) + (limit,)).fetchall()
+        finally:
+            connection.close()
+        return [dict(row) for row in rows]
+
+    # Up to limit files stored as moved (warm) that were archived before cutoff,
+    # oldest first; after continues from the (archived_at, id) of a previous page
+    def warm(self, cutoff, limit, after=(0, 0)):
+        connection = self._connect()
+        try:
+            rows = connection.execute(f"SELECT {', '.join(_COLUMNS)} FROM archived"
+                                      f" WHERE backend = '{MOVED}' AND {_ACTIVE} AND archived_at < ?"
+                                      f" AND (archived_at, id) > (?, ?)"
+                                      f" ORDER BY archived_at, id LIMIT ?",
+                                      (cutoff,) + tuple(after) + (limit,)).fetchall()
+        finally:
+            connection.close()
+        return [dict(row) for row in rows]
+
+    # Record that entries moved: [(id, location, backend)]
+    def relocate(self, moves):
+        if not moves:
+            return
+        with self._connect() as connection:
+            connection.executemany("UPDATE archived SET location = ?, backend = ? WHERE id = ?",
+                                   [(location, backend, entry_id) for entry_id, location, backend in moves])
+        connection.close()
+
+    def mark_expired(self, entry_ids):
+        if not entry_ids:
+            return
+        now = time.time()
+        with self._connect() as connection:
+            connection.executemany("UPDATE archived SET expired_at = ? WHERE id = ?",
+                                   [(now, entry_id) for entry_id in entry_ids])
+        connection.close()
+
+    # Mark the entries of a run at locations restored, e.g. after the run was undone
+    def forget_run(self, run_id, locations):
+        if not locations:
+            return
+        now = time.time()
+        with self._connect() as connection:
+            connection.executemany("UPDATE archived SET restored_at = ?"
+                                   " WHERE restored_at IS NULL AND run_id = ? AND location = ?",
+                                   [(now, run_id, location) for location in locations])
+        connection.close()
+
+    def mark_restored(self, where, parameters):
+        with self._connect() as connection:
+            connection.execute(f"UPDATE archived SET restored_at = ? WHERE restored_at IS NULL AND {where}",
+                               (time.time(),) + tuple(parameters))
+        connection.close()
+
+
+# Extract the bundle member or chunked file at location to target, through a
+# hidden partial file that only takes the name target once complete. The file
+# stays in the archive until drop().
+def extract(backend, location, target):
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    partial = mover.partial_path(target)
+    if os.path.lexists(partial):
+        os.unlink(partial)
+    try:
+        if backend == BUNDLED:
+            bundles.restore(os.path.dirname(location), os.path.basename(location), partial)
+        else:
+            chunks.restore(location, partial)
+        mover.publish(partial, target)
+    except BaseException:
+        if os.path.lexists(partial):
+            os.unlink(partial)
+        raise
+
+
+# Drop extracted files, [(backend, location)], from the archive: bundle members
+# leave their month's index in one update per month (and a segment goes once
+# no member is left in it), manifests are unlinked and the chunks no manifest
+# refers to any more are collected
+def drop(packed):
+    months, chunk_dirs = {}, set()
+    for backend, location in packed:
+        folder, name = os.path.split(location)
+        if backend == BUNDLED:
+            months.setdefault(folder, []).append(name)
+            continue
+        try:
+            os.unlink(location)
+        except FileNotFoundError:
+            pass
+        chunk_dirs.add(folder)
+    for month_dir, names in months.items():
+        bundles.remove_members(month_dir, names)
+    for archive_dir in chunk_dirs:
+        chunks.collect_garbage(archive_dir)
@@ -0,0 +1,351 @@
+import fcntl
+import hashlib
+import json
+import os
+import random
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack, contextmanager
+from datetime import datetime
+
+import bundles
+
+# Content-defined chunk store for the archive folder.
+#
+# With chunks enabled, an archived file is cut into variable-size chunks at
+# positions chosen by a rolling hash of its contents (Gear hash with FastCDC's
+# normalized chunking), so an insertion or deletion only changes the chunks it
+# touches and the rest of a new version lines up with the old one's. Each
+# chunk is stored once in <archive_dir>/.chunks/<2 hex>/<digest>, and the
+# archived file itself becomes a small manifest, <name>.chunks, listing its
+# chunks in order. Chunks of types that are not already compressed are
+# compressed with zlib.
+#
+# The rolling hash runs in pure Python, at about 5 MiB/s per worker process.
+# Files larger than cdc_max_bytes (CDC_MAX_BYTES by default) are therefore cut
+# into fixed MAX_CHUNK blocks instead, read at disk speed: they still share
+# chunks with versions that were appended to or edited in place, but not across
+# insertions. Both kinds of file have the same manifest. Archiving on behalf of
+# a dashboard request uses the lower interactive_cdc_max_bytes, so the request
+# is not held up by the rolling hash; background sweeps use the full limit.
+#
+# Worker processes chunk files in parallel and write only chunks the store does
+# not have yet. New chunks are flushed with one sync() per batch, then the
+# manifests are written and fsync'ed, and only then are sources removed. A crash
+# before a source is removed can leave a second manifest for it on the next
+# run; its chunks are shared, so that costs a few hundred bytes.
+#
+# Deleting a manifest frees nothing by itself: collect_garbage() then removes
+# the chunks no manifest refers to, holding the store's lock exclusively while
+# archiving holds it shared.
+
+# Chunk sizes: no cut before MIN_CHUNK, a stricter cut condition until
+# AVG_CHUNK, a looser one after, and a forced cut at MAX_CHUNK
+MIN_CHUNK = 4 * 1024
+AVG_CHUNK = 16 * 1024
+MAX_CHUNK = 64 * 1024
+
+# Largest file chunked by content; larger ones are cut into fixed blocks
+CDC_MAX_BYTES = 64 * 1024 * 1024
+
+# The same limit while someone waits on the archive (a dashboard request): about
+# a second of rolling hash per file instead of up to a dozen
+INTERACTIVE_CDC_MAX_BYTES = 4 * 1024 * 1024
+
+# Bytes read from a file at a time while chunking
+READ_SIZE = 1024 * 1024
+
+# Suffix of a manifest in the archive folder
+MANIFEST_SUFFIX = ".chunks"
+
+# Store directory inside the archive folder (hidden, so sweeps never list it)
+STORE_NAME = ".chunks"
+
+_MASK64 = (1 << 64) - 1
+
+# The Gear table must never change: chunk boundaries, and so deduplication
+# against chunks already stored, depend on it
+_GEAR_RANDOM = random.Random(0x6765617220636463)
+_GEAR = tuple(_GEAR_RANDOM.getrandbits(64) for _ in range(256))
+del _GEAR_RANDOM
+
+# Cut conditions test high bits, which depend on the last 64 bytes
+_MASK_STRICT = ((1 << 16) - 1) << 48
+_MASK_LOOSE = ((1 << 12) - 1) << 52
+
+
+# Length of the first chunk of data[start:end]
+def _cut(data, start, end):
+    length = end - start
+    if length <= MIN_CHUNK:
+        return length
+    end = start + min(length, MAX_CHUNK)
+    middle = min(start + AVG_CHUNK, end)
+    gear = _GEAR
+    h = 0
+    position = start + MIN_CHUNK
+    for byte in data[position:middle]:
+        h = ((h << 1) + gear[byte]) & _MASK64
+        position += 1
+        if not h & _MASK_STRICT:
+            return position - start
+    for byte in data[middle:end]:
+        h = ((h << 1) + gear[byte]) & _MASK64
+        position += 1
+        if not h & _MASK_LOOSE:
+            return position - start
+    return end - start
+
+
+# Yield the content-defined chunks of a binary file object
+def split(file):
+    data = b""
+    start = 0
+    eof = False
+    while True:
+        if not eof and len(data) - start < MAX_CHUNK:
+            block = file.read(READ_SIZE)
+            eof = not block
+            data = data[start:] + block
+            start = 0
+        if start == len(data):
+            return
+        if not eof and len(data) - start < MAX_CHUNK:
+            continue
+        length = _cut(data, start, len(data))
+        yield data[start:start + length]
+        start += length
+
+
+# Yield the fixed MAX_CHUNK blocks of a binary file object
+def split_fixed(file):
+    while True:
+        block = file.read(MAX_CHUNK)
+        if not block:
+            return
+        yield block
+
+
+def chunk_digest(chunk):
+    return hashlib.blake2b(chunk, digest_size=20).hexdigest()
+
+
+def store_dir(archive_dir):
+    return os.path.join(archive_dir, STORE_NAME)
+
+
+def chunk_path(store, digest):
+    return os.path.join(store, digest[:2], digest)
+
+
+# Store the chunks of path that store lacks. Returns ([(digest, length)], bytes
+# written to the store). A chunk file is one flag byte ("z" zlib, "r" raw) and
+# the data; it is written under a temporary name and renamed, so concurrent
+# writers of the same chunk are harmless. Files over cdc_max_bytes are cut
+# into fixed blocks.
+def store_file(store, path, compress=True, cdc_max_bytes=CDC_MAX_BYTES):
+    chunks, written = [], 0
+    with open(path, "rb") as file:
+        fixed = os.fstat(file.fileno()).st_size > cdc_max_bytes
+        for chunk in (split_fixed(file) if fixed else split(file)):
+            digest = chunk_digest(chunk)
+            chunks.append((digest, len(chunk)))
+            target = chunk_path(store, digest)
+            if os.path.exists(target):
+                continue
+            packed = zlib.compress(chunk, 6) if compress else None
+            if packed is not None and len(packed) < len(chunk):
+                payload = b"z" + packed
+            else:
+                payload = b"r" + chunk
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            temp_path = f"{target}.{os.getpid()}.tmp"
+            with open(temp_path, "wb") as out:
+                out.write(payload)
+            os.replace(temp_path, target)
+            written += len(payload)
+    return chunks, written
+
+
+def read_chunk(store, digest):
+    with open(chunk_path(store, digest), "rb") as file:
+        payload = file.read()
+    chunk = zlib.decompress(payload[1:]) if payload[:1] == b"z" else payload[1:]
+    if chunk_digest(chunk) != digest:
+        raise OSError(f"chunk {digest} is corrupt")
+    return chunk
+
+
+def load_manifest(manifest_path):
+    with open(manifest_path, "r") as file:
+        return json.load(file)
+
+
+# Yield the contents of an archived file chunk by chunk, never holding more
+# than one chunk in memory
+def iter_content(manifest_path):
+    store = store_dir(os.path.dirname(manifest_path))
+    for digest, _ in load_manifest(manifest_path)["chunks"]:
+        yield read_chunk(store, digest)
+
+
+# Rebuild an archived file at target_path (default: its original path, which
+# must not exist) from its manifest, with its original mtime and marked as just
+# accessed (see bundles.restore())
+def restore(manifest_path, target_path=None):
+    manifest = load_manifest(manifest_path)
+    target_path = target_path or manifest["source"]
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+    with open(target_path, "xb") as target:
+        for chunk in iter_content(manifest_path):
+            target.write(chunk)
+    os.utime(target_path, ns=(time.time_ns(), manifest["mtime_ns"]))
+    return target_path
+
+
+# Hold the store's lock: shared while archiving into it, exclusive while
+# collecting garbage
+@contextmanager
+def _store_lock(store, operation):
+    os.makedirs(store, exist_ok=True)
+    lock_fd = os.open(os.path.join(store, "lock"), os.O_WRONLY | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(lock_fd, operation)
+        yield
+    finally:
+        os.close(lock_fd)
+
+
+# Write a manifest under name, or name_N.ext if taken, without ever replacing one
+def _write_manifest(folder, name, manifest):
+    temp_path = os.path.join(folder, f".{name}.{os.getpid()}.tmp")
+    with open(temp_path, "w") as file:
+        json.dump(manifest, file, separators=(",", ":"))
+        file.flush()
+        os.fsync(file.fileno())
+    base, ext = os.path.splitext(name)
+    candidate, counter = name, 2
+    try:
+        while True:
+            try:
+                os.link(temp_path, os.path.join(folder, candidate + MANIFEST_SUFFIX))
+                return candidate + MANIFEST_SUFFIX
+            except FileExistsError:
+                candidate = f"{base}_{counter}{ext}"
+                counter += 1
+    finally:
+        os.unlink(temp_path)
+
+
+# Archives moves (sweep.PlannedMove) into the chunk store of their archive folder
+class ChunkArchiver:
+    # How catalog.py records what a chunk archiver archived
+    backend = "chunks"
+
+    def __init__(self, compress=True, workers=None, cdc_max_bytes=CDC_MAX_BYTES):
+        self.compress = compress
+        self.workers = workers or os.cpu_count() or 1
+        self.cdc_max_bytes = cdc_max_bytes
+
+    # Archive moves, yielding (move, error) for each like sweep.dispatch(); an
+    # archived move's destination is its manifest
+    def archive(self, moves):
+        with ExitStack() as stack:
+            for store in {store_dir(os.path.dirname(move.destination)) for move in moves}:
+                stack.enter_context(_store_lock(store, fcntl.LOCK_SH))
+            yield from self._archive(moves)
+
+    def _archive(self, moves):
+        stored = []
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            futures = []
+            for move in moves:
+                store = store_dir(os.path.dirname(move.destination))
+                compress = self.compress and not bundles.is_stored(move.source)
+                futures.append((move, pool.submit(store_file, store, move.source, compress, self.cdc_max_bytes)))
+            for move, future in futures:
+                try:
+                    chunks, _ = future.result()
+                except Exception as e:
+                    yield move, e
+                    continue
+                stored.append((move, chunks))
+        if not stored:
+            return
+
+        # New chunks must be on disk before any manifest refers to them
+        os.sync()
+        written = []
+        for move, chunks in stored:
+            folder, name = os.path.split(move.destination)
+            manifest = {
+                "source": move.source, "size": move.size, "mtime_ns": move.mtime_ns,
+                "archived": datetime.now().isoformat(timespec="seconds"), "chunks": chunks,
+            }
+            try:
+                written.append((move, _write_manifest(folder, name, manifest)))
+            except OSError as e:
+                yield move, e
+        for folder in {os.path.dirname(move.destination) for move, _ in written}:
+            dir_fd = os.open(folder, os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+
+        for move, manifest_name in written:
+            manifest_path = os.path.join(os.path.dirname(move.destination), manifest_name)
+            yield self._remove_source(move._replace(destination=manifest_path))
+
+    @staticmethod
+    def _remove_source(move):
+        try:
+            current = os.lstat(move.source)
+            if (current.st_size, current.st_mtime_ns) != (move.size, move.mtime_ns):
+                return move, OSError(f"{move.source} changed while it was being archived")
+            os.unlink(move.source)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            return move, e
+        print(f"Chunked: {os.path.basename(move.source)} -> {move.destination}")
+        return move, None
+
+
+# Delete the chunks of archive_dir's store that no manifest refers to any more
+# and return the bytes freed. Reads every manifest, so it is run after
+# manifests have been deleted rather than on every sweep. Archiving into the
+# store waits meanwhile, as it may be about to refer to an unreferenced chunk.
+def collect_garbage(archive_dir):
+    store = store_dir(archive_dir)
+    if not os.path.isdir(store):
+        return 0
+    with _store_lock(store, fcntl.LOCK_EX):
+        referenced = set()
+        for name in os.listdir(archive_dir):
+            if name.endswith(MANIFEST_SUFFIX) and not name.startswith("."):
+                try:
+                    manifest = load_manifest(os.path.join(archive_dir, name))
+                except (OSError, ValueError):
+                    # An unreadable manifest could refer to anything
+                    return 0
+                referenced.update(digest for digest, _ in manifest["chunks"])
+        freed = 0
+        for directory, _, names in os.walk(store):
+            for name in names:
+                if directory == store or name in referenced:
+                    continue
+                path = os.path.join(directory, name)
+                freed += os.lstat(path).st_size
+                os.unlink(path)
+    return freed
+
+
+# Bytes used by the chunk store of archive_dir
+def store_bytes(archive_dir):
+    total = 0
+    for directory, _, names in os.walk(store_dir(archive_dir)):
+        for name in names:
+            total += os.lstat(os.path.join(directory, name)).st_size
+    return total
@@ -0,0 +1,108 @@
+# File classification tables compiled once from config.json.
+
+# Key under which a trie node stores the category for the suffix ending there;
+# suffix segments are always strings, so None can never collide with one
+_CATEGORY = None
+
+
+# Maps file names to config['folders'] categories.
+#
+# Suffixes are stored in a trie keyed by dot-separated segments read from the
+# right, so the root of the trie is a plain hash map of single extensions
+# ("gz" -> Archives) and compound extensions hang below it ("gz" -> "tar").
+# Classifying a name costs one dict lookup per suffix segment, bounded by the
+# deepest configured suffix, no matter how many categories or extensions exist;
+# the longest matching suffix wins, so ".tar.gz" beats ".gz".
+class ExtensionIndex:
+    def __init__(self, folders, default="Others"):
+        self.default = default
+        self._root = {}
+        self._depth = 1
+        for category, extensions in folders.items():
+            for extension in extensions:
+                segments = extension.lower().strip('.').split('.')
+                node = self._root
+                for segment in reversed(segments):
+                    node = node.setdefault(segment, {})
+                # First category listing a suffix keeps it, as in the old lookup loop
+                node.setdefault(_CATEGORY, category)
+                self._depth = max(self._depth, len(segments))
+
+    # Category for a file name, or for a bare extension such as ".pdf"
+    def category_for(self, file_name):
+        segments = file_name.lower().split('.')
+        # segments[0] is the stem; never treat it as an extension
+        first = max(1, len(segments) - self._depth)
+        category = self.default
+        node = self._root
+        for segment in reversed(segments[first:]):
+            node = node.get(segment)
+            if node is None:
+                break
+            category = node.get(_CATEGORY, category)
+        return category
+
+
+# Matches the keywords of several rule sets against a file name in one pass.
+#
+# rule_sets maps a rule set name to an ordered {label: [keywords]} table, e.g.
+# {"sorting_rules": config['sorting_rules'], "screenshots": {...}}. All keywords
+# are compiled into a single Aho-Corasick automaton, so a name is lowercased once
+# and walked once regardless of how many rules or keywords are configured.
+# Within a rule set the first label (in config order) with any matching keyword
+# wins, which is what the nested per-project loops used to do.
+class KeywordMatcher:
+    def __init__(self, rule_sets):
+        # State 0 is the root; each state has goto edges, a failure link and the
+        # (rule set, priority, label) outputs of every keyword ending there
+        self._goto = [{}]
+        self._fail = [0]
+        self._outputs = [[]]
+        for set_name, rules in rule_sets.items():
+            for priority, (label, keywords) in enumerate(rules.items()):
+                for keyword in keywords:
+                    self._add(keyword.lower(), (set_name, priority, label))
+        self._link()
+
+    def _add(self, keyword, output):
+        if not keyword:
+            return
+        state = 0
+        for char in keyword:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._outputs.append([])
+                self._goto[state][char] = next_state
+            state = next_state
+        self._outputs[state].append(output)
+
+    # Breadth-first pass computing failure links and merging suffix outputs
+    def _link(self):
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[next_state] = target if target != next_state else 0
+                self._outputs[next_state] = self._outputs[next_state] + self._outputs[self._fail[next_state]]
+
+    # {rule set name: winning label} for every rule set with a keyword in text
+    def match(self, text):
+        goto, fail, outputs = self._goto, self._fail, self._outputs
+        best = {}
+        state = 0
+        for char in text.lower():
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for set_name, priority, label in outputs[state]:
+                current = best.get(set_name)
+                if current is None or priority < current[0]:
+                    best[set_name] = (priority, label)
+        return {set_name: label for set_name, (_, label) in best.items()}
@@ -0,0 +1,163 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from PyPDF2 import PdfReader
+
+import scanner
+from classifier import KeywordMatcher
+
+# Content classification for sorting_rules.
+#
+# A PDF or text file whose name matches no sorting rule is read for the rules'
+# keywords instead ("invoice", "statement", ...), so scans called
+# "Document (3).pdf" still reach Finance. Text is extracted page by page (PDF)
+# or block by block (text), matched with the same Aho-Corasick automaton as
+# names, and extraction stops at the first page with a match, after max_pages
+# pages or once max_bytes of text have been examined.
+#
+# Extraction is CPU-bound, so files are parsed on a process pool. Results are
+# memoized in <state_dir>/contents.json by content hash (from the duplicate
+# finder, itself cached by inode and mtime), so a file, or a copy of it, is
+# never parsed twice while the rules stay the same.
+
+# File types read for keywords
+PDF_EXTENSIONS = (".pdf",)
+TEXT_EXTENSIONS = (".txt", ".md", ".csv", ".rtf")
+
+# Pages of a PDF read at most
+MAX_PAGES = 20
+
+# Bytes of text examined per file at most
+MAX_BYTES = 256 * 1024
+
+# Bytes read from a text file per block
+_BLOCK = 64 * 1024
+
+# Characters carried over from one page or block to the next, so a keyword
+# split across them still matches
+_OVERLAP = 64
+
+# Cached results kept; the oldest go first
+MAX_CACHE_ENTRIES = 100000
+
+# Keyword matcher of each worker process, compiled once per worker
+_matcher = None
+
+
+def _init_worker(rules):
+    global _matcher
+    _matcher = KeywordMatcher({"sorting_rules": rules})
+
+
+def _pages(file, max_pages):
+    reader = PdfReader(file)
+    if reader.is_encrypted and not reader.decrypt(""):
+        return
+    for page in reader.pages[:max_pages]:
+        yield page.extract_text() or ""
+
+
+def _blocks(file, max_bytes):
+    while max_bytes > 0:
+        block = file.read(min(_BLOCK, max_bytes))
+        if not block:
+            return
+        max_bytes -= len(block)
+        yield block.decode("utf-8", "replace")
+
+
+# Label of the first sorting rule found in the text of path, or "" (worker side).
+# The file is read without moving its access time (see scanner.open_quietly).
+def _classify(path, max_pages, max_bytes):
+    with scanner.open_quietly(path) as file:
+        is_pdf = file.read(5) == b"%PDF-"
+        file.seek(0)
+        texts = _pages(file, max_pages) if is_pdf else _blocks(file, max_bytes)
+        tail, examined = "", 0
+        try:
+            for text in texts:
+                label = _matcher.match(tail + text).get("sorting_rules")
+                if label:
+                    return label
+                examined += len(text)
+                if examined >= max_bytes:
+                    break
+                tail = text[-_OVERLAP:]
+        except Exception:
+            # Damaged or unsupported documents are treated as matching nothing
+            return ""
+    return ""
+
+
+def is_candidate(name):
+    return name.lower().endswith(PDF_EXTENSIONS + TEXT_EXTENSIONS)
+
+
+class ContentClassifier:
+    def __init__(self, rules, finder, cache_path=None, max_pages=MAX_PAGES, max_bytes=MAX_BYTES, workers=None):
+        self.rules = rules
+        # duplicates.DuplicateFinder supplying content hashes
+        self.finder = finder
+        self.cache_path = cache_path
+        self.max_pages = max_pages
+        self.max_bytes = max_bytes
+        self.workers = workers or os.cpu_count() or 1
+        # Results are only valid for the rules they were computed with
+        self._rules_key = hashlib.sha1(json.dumps(rules, sort_keys=True).encode()).hexdigest()
+        self._labels = {}
+        if cache_path:
+            try:
+                with open(cache_path, "r") as file:
+                    cached = json.load(file)
+                if cached.get("rules") == self._rules_key:
+                    self._labels = cached["labels"]
+            except (FileNotFoundError, ValueError, KeyError):
+                pass
+
+    def _save(self):
+        if not self.cache_path:
+            return
+        if len(self._labels) > MAX_CACHE_ENTRIES:
+            keys = list(self._labels)
+            for key in keys[:len(keys) - MAX_CACHE_ENTRIES]:
+                del self._labels[key]
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        temp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as file:
+            json.dump({"rules": self._rules_key, "labels": self._labels}, file, separators=(",", ":"))
+        os.replace(temp_path, self.cache_path)
+
+    # Sorting rule labels of (path, stat) pairs whose contents match one,
+    # {path: label}
+    def classify(self, files):
+        if not self.rules or not files:
+            return {}
+        digests = self.finder.full_hashes(files)
+        labels = {}
+        missing = {}
+        for path, digest in digests.items():
+            if digest in self._labels:
+                if self._labels[digest]:
+                    labels[path] = self._labels[digest]
+            else:
+                # Identical files are parsed once
+                missing.setdefault(digest, path)
+        if not missing:
+            return labels
+
+        with ProcessPoolExecutor(max_workers=min(self.workers, len(missing)), initializer=_init_worker,
+                                 initargs=(self.rules,)) as pool:
+            futures = {digest: pool.submit(_classify, path, self.max_pages, self.max_bytes)
+                       for digest, path in missing.items()}
+            for digest, future in futures.items():
+                try:
+                    self._labels[digest] = future.result()
+                except OSError:
+                    continue
+        for path, digest in digests.items():
+            if self._labels.get(digest):
+                labels[path] = self._labels[digest]
+        self._save()
+        return labels
@@ -0,0 +1,65 @@
+import os
+
+# Per-sweep cache of destination folders.
+#
+# Each target folder is listed once, the first time a sweep plans a file there;
+# after that, unique names are allocated against the in-memory name set, so a
+# batch of moves needs no per-file exists() probes. Folders that do not exist
+# yet are not created here (planning must not touch the disk); the executor
+# creates them once before their first move.
+# Names are compared casefolded because the default macOS volume format is
+# case-insensitive: "Report.pdf" and "report.pdf" would be the same file.
+#
+# Collisions get the sweep's tag (a timestamp) appended, then a counter, so two
+# same-named files moved in the same second no longer collide again.
+class DestinationCache:
+    def __init__(self):
+        self._names = {}
+        self._devices = {}
+
+    # Casefolded names present in folder (none if it does not exist yet)
+    def _folder_names(self, folder):
+        names = self._names.get(folder)
+        if names is None:
+            try:
+                with os.scandir(folder) as iterator:
+                    names = {entry.name.casefold() for entry in iterator}
+            except FileNotFoundError:
+                names = set()
+            self._names[folder] = names
+            self._devices[folder] = os.stat(_existing_ancestor(folder)).st_dev
+        return names
+
+    # st_dev of folder, so the move engine can pick rename or copy without a stat per file
+    def device_of(self, folder):
+        self._folder_names(folder)
+        return self._devices[folder]
+
+    # Entries in folder, counting names reserved by this sweep; shards.py uses
+    # it to tell a full shard
+    def entry_count(self, folder):
+        return len(self._folder_names(folder))
+
+    # Reserve and return a path in folder that no existing or earlier reserved file uses
+    def allocate(self, folder, file_name, tag):
+        names = self._folder_names(folder)
+        candidate = file_name
+        if candidate.casefold() in names:
+            base, ext = os.path.splitext(file_name)
+            candidate = f"{base}_{tag}{ext}"
+            counter = 2
+            while candidate.casefold() in names:
+                candidate = f"{base}_{tag}_{counter}{ext}"
+                counter += 1
+        names.add(candidate.casefold())
+        return os.path.join(folder, candidate)
+
+
+# folder itself, or its nearest existing parent, whose device a new folder will inherit
+def _existing_ancestor(folder):
+    while not os.path.isdir(folder):
+        parent = os.path.dirname(folder)
+        if parent == folder:
+            break
+        folder = parent
+    return folder
@@ -0,0 +1,318 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import scanner
+
+# Duplicate detection in three stages, each run only on what the previous one
+# could not tell apart:
+#   1. size       from the stat() a scan already has; unique sizes drop out
+#   2. partial    hash of the first and last BLOCK bytes (two preads)
+#   3. full       hash of the whole file, only for partial-hash collisions
+# Files no larger than two blocks are fully read in stage 2 and skip stage 3.
+# Files are opened with scanner.open_quietly(), so hashing leaves their access
+# times (and so their archive age) alone.
+# Hashing runs on a thread pool: hashlib and reads release the GIL.
+#
+# Digests are cached in <state_dir>/hashes.json keyed by (st_dev, st_ino,
+# st_size, st_mtime_ns), so a file is only read again after it changes.
+
+# Bytes hashed at each end of a file for the partial hash
+BLOCK = 64 * 1024
+
+# Read size for full hashes
+CHUNK = 1024 * 1024
+
+# Hashing threads
+WORKERS = 8
+
+# Cached digests kept; the oldest entries go first
+MAX_CACHE_ENTRIES = 200000
+
+# Duplicate policies for sweeps (config['duplicates']['policy'])
+POLICIES = ("off", "skip", "hardlink", "remove")
+
+
+def _digest():
+    return hashlib.blake2b(digest_size=20)
+
+
+def partial_hash(path, size):
+    digest = _digest()
+    with scanner.open_quietly(path, buffering=0) as file:
+        fd = file.fileno()
+        if size <= 2 * BLOCK:
+            digest.update(os.pread(fd, size, 0))
+        else:
+            digest.update(os.pread(fd, BLOCK, 0))
+            digest.update(os.pread(fd, BLOCK, size - BLOCK))
+    return digest.hexdigest()
+
+
+def full_hash(path):
+    digest = _digest()
+    buffer = bytearray(CHUNK)
+    view = memoryview(buffer)
+    with scanner.open_quietly(path, buffering=0) as file:
+        while True:
+            read = file.readinto(buffer)
+            if not read:
+                break
+            digest.update(view[:read])
+    return digest.hexdigest()
+
+
+# Persistent digests keyed by file identity and version. One cache may serve
+# several threads (the dashboard's request threads and hashing pools), so entries
+# are only touched under its lock.
+class HashCache:
+    def __init__(self, path=None):
+        self.path = path
+        self._entries = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+        if path:
+            try:
+                with open(path, "r") as file:
+                    self._entries = json.load(file)
+            except (FileNotFoundError, ValueError):
+                pass
+
+    @staticmethod
+    def _key(st):
+        return f"{st.st_dev}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}"
+
+    def get(self, st, stage):
+        with self._lock:
+            return self._entries.get(self._key(st), {}).get(stage)
+
+    def put(self, st, stage, digest):
+        with self._lock:
+            self._entries.setdefault(self._key(st), {})[stage] = digest
+            self._dirty = True
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            if len(self._entries) > MAX_CACHE_ENTRIES:
+                keys = list(self._entries)
+                for key in keys[:len(keys) - MAX_CACHE_ENTRIES]:
+                    del self._entries[key]
+            data = json.dumps(self._entries, separators=(",", ":"))
+            self._dirty = False
+            directory = os.path.dirname(self.path)
+            os.makedirs(directory, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(prefix=f".{os.path.basename(self.path)}.", dir=directory)
+            try:
+                with os.fdopen(fd, "w") as file:
+                    file.write(data)
+                os.replace(temp_path, self.path)
+            except BaseException:
+                self._dirty = True
+                try:
+                    os.unlink(temp_path)
+                except OSError:
+                    pass
+                raise
+
+
+class DuplicateFinder:
+    def __init__(self, cache_path=None, workers=WORKERS):
+        self.cache = HashCache(cache_path)
+        self.workers = workers
+
+    # Hash every (path, stat) with fn(path, size) for stage, using the cache;
+    # files that cannot be read are left out
+    def _hash_all(self, files, stage, fn, pool):
+        digests = {}
+        missing = []
+        for path, st in files:
+            cached = self.cache.get(st, stage)
+            if cached:
+                digests[path] = cached
+            else:
+                missing.append((path, st))
+
+        def run(item):
+            path, st = item
+            try:
+                return path, st, fn(path, st.st_size)
+            except OSError:
+                return path, st, None
+
+        for path, st, digest in pool.map(run, missing):
+            if digest:
+                self.cache.put(st, stage, digest)
+                digests[path] = digest
+        return digests
+
+    # Full content hashes of (path, stat) pairs, {path: hex digest}
+    def full_hashes(self, files):
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            digests = self._hash_all(files, "full", lambda path, size: full_hash(path), pool)
+        self.cache.save()
+        return digests
+
+    # Groups (lists of at least two paths) of files with identical contents,
+    # given (path, stat) pairs. Empty files are never reported.
+    def groups(self, files):
+        by_size = {}
+        for path, st in files:
+            if st.st_size > 0:
+                by_size.setdefault(st.st_size, []).append((path, st))
+        candidates = [group for group in by_size.values() if len(group) > 1]
+        if not candidates:
+            return []
+
+        stats = {path: st for group in candidates for path, st in group}
+        result = []
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            partials = self._hash_all([item for group in candidates for item in group], "partial",
+                                      partial_hash, pool)
+            by_partial = {}
+            for path, digest in partials.items():
+                by_partial.setdefault((stats[path].st_size, digest), []).append(path)
+
+            needs_full = []
+            for (size, _), paths in by_partial.items():
+                if len(paths) < 2:
+                    continue
+                if size <= 2 * BLOCK:
+                    result.append(sorted(paths))
+                else:
+                    needs_full.append(paths)
+
+            fulls = self._hash_all([(path, stats[path]) for paths in needs_full for path in paths], "full",
+                                   lambda path, size: full_hash(path), pool)
+            for paths in needs_full:
+                by_full = {}
+                for path in paths:
+                    if path in fulls:
+                        by_full.setdefault(fulls[path], []).append(path)
+                result.extend(sorted(group) for group in by_full.values() if len(group) > 1)
+
+        self.cache.save()
+        return result
+
+
+# (path, lstat) of every regular file in directories, descending max_depth
+# levels; a file reached from two of the directories is listed once
+def tree_files(directories, max_depth=0):
+    files = {}
+
+    def add(entries):
+        for entry in entries:
+            try:
+                if entry.is_file(follow_symlinks=False):
+                    files[entry.path] = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+
+    for directory in directories:
+        try:
+            add(scanner.scan_files(directory))
+        except OSError:
+            continue
+        for _, _, entries, _ in scanner.walk_tree(directory, max_depth):
+            add(entries or ())
+    return list(files.items())
+
+
+# Duplicate report for directories: groups with the oldest file first, plus
+# the bytes the extra copies take
+def report(finder, directories, max_depth=0):
+    files = tree_files(directories, max_depth)
+    stats = dict(files)
+    groups = []
+    for group in finder.groups(files):
+        group.sort(key=lambda path: (stats[path].st_mtime_ns, path))
+        size = stats[group[0]].st_size
+        groups.append({"size": size, "paths": group, "wasted_bytes": size * (len(group) - 1)})
+    groups.sort(key=lambda group: group["wasted_bytes"], reverse=True)
+    return {"groups": groups, "files_scanned": len(files),
+            "wasted_bytes": sum(group["wasted_bytes"] for group in groups)}
+
+
+# Apply policy to planned moves (sweep.PlannedMove): a move whose file has the
+# same contents as a file already in its target folder, or as an earlier move
+# of the plan, is dropped ("skip"), turned into a removal of the source
+# ("remove", destination None) or into a hard link to the kept copy
+# ("hardlink", same device only). Changed moves carry the kept copy's final
+# path in duplicate_of.
+def apply_policy(finder, moves, policy):
+    if policy == "off" or not moves:
+        return moves
+
+    files = []
+    planned = {}
+    # Plan position of each source, for picking the first planned copy
+    order = {}
+    for index, move in enumerate(moves):
+        try:
+            st = os.lstat(move.source)
+        except OSError:
+            continue
+        files.append((move.source, st))
+        planned[move.source] = move
+        order[move.source] = index
+    existing = set()
+    for folder in {os.path.dirname(move.destination) for move in moves}:
+        try:
+            entries = scanner.scan_files(folder)
+        except OSError:
+            continue
+        for entry in entries:
+            try:
+                if entry.is_file(follow_symlinks=False):
+                    files.append((entry.path, entry.stat(follow_symlinks=False)))
+                    existing.add(entry.path)
+            except OSError:
+                continue
+    stats = dict(files)
+
+    replaced = {}
+    for group in finder.groups(files):
+        if not any(path in planned for path in group):
+            continue
+        # Keep a copy that is already in place, else the first planned one
+        kept = next((path for path in group if path in existing), None)
+        if kept is None:
+            kept = min((path for path in group if path in planned), key=order.__getitem__)
+            kept_final, kept_dev = planned[kept].destination, planned[kept].target_dev
+        else:
+            kept_final, kept_dev = kept, stats[kept].st_dev
+        for path in group:
+            if path == kept or path not in planned:
+                continue
+            move = planned[path]
+            reason = f"duplicate of {kept_final}"
+            if policy == "skip":
+                replaced[path] = None
+            elif policy == "remove":
+                replaced[path] = move._replace(destination=None, reason=reason, duplicate_of=kept_final)
+            elif policy == "hardlink" and move.target_dev == kept_dev:
+                replaced[path] = move._replace(reason=reason, duplicate_of=kept_final)
+
+    result = []
+    for move in moves:
+        if move.source in replaced:
+            if replaced[move.source] is not None:
+                result.append(replaced[move.source])
+        else:
+            result.append(move)
+    return tuple(result)
+
+
+# Carry out a duplicate move once its kept copy is in place at kept (which is
+# move.duplicate_of unless the kept copy's move was re-routed): remove the
+# source, or put a hard link to kept at the destination and then remove the source
+def resolve(move, kept):
+    if move.destination is not None:
+        os.link(kept, move.destination, follow_symlinks=False)
+    os.unlink(move.source)
@@ -0,0 +1,177 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+# Thread pool whose concurrency tunes itself while a batch runs (AIMD).
+#
+# Tasks are measured in windows of completions. After each window:
+#   - if mean task latency climbed past LATENCY_TOLERANCE x the best window
+#     seen so far, the device is saturated: halve the concurrency limit;
+#   - else if throughput (tasks/s) rose over the previous window, add a worker;
+#   - otherwise hold.
+# Renames on an SSD quickly settle at a handful of workers, while copies to a
+# slow disk back off instead of piling up requests that only add latency.
+
+# Mean latency over the best window that counts as saturation
+LATENCY_TOLERANCE = 2.0
+
+# Relative throughput gain that justifies one more worker
+THROUGHPUT_GAIN = 0.05
+
+
+class AdaptiveExecutor:
+    def __init__(self, max_workers=16, min_workers=1, initial_workers=2, name="adaptive"):
+        self.max_workers = max_workers
+        self.min_workers = min_workers
+        self.name = name
+        self._limit = max(min_workers, min(initial_workers, max_workers))
+        self._peak = self._limit
+        self._active = 0
+        self._queue = deque()
+        self._threads = []
+        self._shutdown = False
+        self._condition = threading.Condition()
+
+        self._completed = 0
+        self._started_at = None
+        self._finished_at = None
+        self._window_count = 0
+        self._window_latency = 0.0
+        self._window_started = None
+        self._best_latency = None
+        self._last_throughput = None
+
+    # Queue fn(*args) and return its Future
+    def submit(self, fn, *args):
+        future = Future()
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError("cannot submit after shutdown")
+            if self._started_at is None:
+                self._started_at = self._window_started = time.perf_counter()
+            self._queue.append((future, fn, args))
+            self._spawn()
+            self._condition.notify()
+        return future
+
+    # Start threads up to the current limit; called with the condition held
+    def _spawn(self):
+        while len(self._threads) < self._limit:
+            thread = threading.Thread(target=self._work, daemon=True,
+                                      name=f"{self.name}-{len(self._threads)}")
+            self._threads.append(thread)
+            thread.start()
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._queue or self._active >= self._limit:
+                    if self._shutdown and not self._queue:
+                        return
+                    self._condition.wait()
+                future, fn, args = self._queue.popleft()
+                self._active += 1
+
+            if future.set_running_or_notify_cancel():
+                start = time.perf_counter()
+                try:
+                    future.set_result(fn(*args))
+                except BaseException as e:
+                    future.set_exception(e)
+                latency = time.perf_counter() - start
+            else:
+                latency = None
+
+            with self._condition:
+                self._active -= 1
+                if latency is not None:
+                    self._record(latency)
+                self._condition.notify_all()
+
+    # Feed one task latency into the controller; called with the condition held
+    def _record(self, latency):
+        now = time.perf_counter()
+        self._completed += 1
+        self._finished_at = now
+        self._window_count += 1
+        self._window_latency += latency
+        if self._window_count < max(4, 2 * self._limit):
+            return
+
+        mean_latency = self._window_latency / self._window_count
+        throughput = self._window_count / max(now - self._window_started, 1e-9)
+        if self._best_latency is None or mean_latency < self._best_latency:
+            self._best_latency = mean_latency
+
+        if mean_latency > self._best_latency * LATENCY_TOLERANCE:
+            self._limit = max(self.min_workers, self._limit // 2)
+        elif self._last_throughput is None or throughput > self._last_throughput * (1 + THROUGHPUT_GAIN):
+            self._limit = min(self.max_workers, self._limit + 1)
+            self._peak = max(self._peak, self._limit)
+            self._spawn()
+
+        self._last_throughput = throughput
+        self._window_count = 0
+        self._window_latency = 0.0
+        self._window_started = now
+
+    # Chosen concurrency and overall throughput of everything run so far
+    def report(self):
+        with self._condition:
+            elapsed = (self._finished_at or 0) - (self._started_at or 0)
+            return {
+                "executor": self.name,
+                "tasks": self._completed,
+                "concurrency": self._limit,
+                "peak_concurrency": self._peak,
+                "throughput": round(self._completed / elapsed, 1) if elapsed > 0 else None,
+            }
+
+    def shutdown(self, wait=True):
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+
+# Runs tasks on the calling thread, for tasks cheaper than a hand-off to a
+# worker thread (or even a Future); reports like AdaptiveExecutor, at a fixed
+# concurrency of 1
+class InlineExecutor:
+    def __init__(self, name="inline"):
+        self.name = name
+        self._completed = 0
+        self._started_at = None
+        self._finished_at = None
+
+    # Run fn(*args) and return its result; exceptions propagate
+    def run(self, fn, *args):
+        if self._started_at is None:
+            self._started_at = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            self._completed += 1
+            self._finished_at = time.perf_counter()
+
+    def report(self):
+        elapsed = (self._finished_at or 0) - (self._started_at or 0)
+        return {
+            "executor": self.name,
+            "tasks": self._completed,
+            "concurrency": 1,
+            "peak_concurrency": 1,
+            "throughput": round(self._completed / elapsed, 1) if elapsed > 0 else None,
+        }
+
+    def shutdown(self, wait=True):
+        pass
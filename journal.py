@@ -0,0 +1,426 @@
+import fcntl
+import filecmp
+import json
+import os
+import stat
+import threading
+import time
+from collections import namedtuple
+
+import bundles
+import chunks
+import mover
+from destinations import DestinationCache
+
+# Write-ahead journal of sweep moves, with crash recovery.
+#
+# Every executed plan is a run with its own append-only log under
+# <state_dir>/journal/runs/<run id>.log, one JSON array per line:
+#   ["B", run_id, pid, time]                 run started
+#   ["I", seq, kind, source, destination, size, mtime_ns(, backend)]
+#                                            a move is about to happen (destination
+#                                            null: a file is about to be deleted, a
+#                                            duplicate or an expired archive entry;
+#                                            backend: the file is packed into a
+#                                            bundle or chunk store, see below)
+#   ["D", seq] / ["F", seq]                  it finished / failed
+#   ["E", counts]                            run ended
+#   ["U", undo run id]                       the run was undone (see undo.py)
+# Records are buffered and group-committed: every intent of a batch is written
+# with one fsync() before the first move starts, and completions are flushed
+# every COMMIT_RECORDS records or COMMIT_SECONDS, plus once at the end. A crash
+# can therefore lose completion records, never an intent; recovery reads the
+# filesystem to tell which of the unfinished moves actually happened. It never
+# deletes or replaces a file at a destination it cannot prove is the move's own
+# (see _roll_forward()); such a move finishes under a free name instead.
+#
+# A bundled or chunked archive move is done once its source is removed, which
+# the backend does last; its intent is rewritten with the member or manifest it
+# became. Recovery never replays one: with its source gone it is done, with its
+# source still there it failed, and the backend recognises (bundles) or shares
+# the chunks of (chunks) whatever it had written when the file is archived again.
+# A packed intent of a restore (undo.py, catalog.py) runs the other way: source
+# is the member or manifest and destination the file being extracted from it.
+# It is done once the complete file, with its recorded size and mtime, is at
+# destination, and recovery then drops it from the archive as the restore
+# would have; otherwise the archive still has it, and a partial extraction is
+# removed.
+#
+# A live run holds an flock() on its log, so recover() only touches runs whose
+# process has died. Cumulative dashboard counters live in stats.json, which a
+# run updates once when it ends.
+
+# Completion records buffered before a group commit
+COMMIT_RECORDS = 4096
+
+# Longest a completion record waits for a group commit
+COMMIT_SECONDS = 1.0
+
+# Finished run logs older than this are removed by recover()
+KEEP_DAYS = 30
+
+# Move kinds counted in stats.json (the sweep kinds)
+_KINDS = ("organize", "archive", "screenshot")
+
+# Kinds of moves that put archived files back: undo (sweep.UNDO) and catalog
+# restores (catalog.RESTORE)
+_RESTORE_KINDS = ("undo", "restore")
+
+# Tag appended to the name of a file whose journaled destination was taken
+# by another file before the move was replayed
+_RECOVERED_TAG = "recovered"
+
+# Nanosecond timestamp of the last run ID handed out (see new_run_id())
+_last_ns = 0
+_run_id_lock = threading.Lock()
+
+
+def _runs_dir(journal_dir):
+    return os.path.join(journal_dir, "runs")
+
+
+def _fsync_dir(directory):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+# Run IDs sort in the order runs started: the time to the nanosecond, bumped
+# past the previous ID of this process, so runs started in the same second are
+# still ordered; the pid separates processes
+def new_run_id():
+    global _last_ns
+    with _run_id_lock:
+        ns = max(time.time_ns(), _last_ns + 1)
+        _last_ns = ns
+    seconds, fraction = divmod(ns, 10 ** 9)
+    return f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(seconds))}-{fraction:09d}-{os.getpid()}"
+
+
+# Journal of one run; the log file is only created once there is something to record
+class Journal:
+    def __init__(self, journal_dir, run_id=None):
+        self.journal_dir = journal_dir
+        self.run_id = run_id or new_run_id()
+        self.path = os.path.join(_runs_dir(journal_dir), f"{self.run_id}.log")
+        self._fd = None
+        self._buffer = []
+        self._last_commit = time.monotonic()
+
+    def _open(self):
+        os.makedirs(_runs_dir(self.journal_dir), exist_ok=True)
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        _fsync_dir(_runs_dir(self.journal_dir))
+        self._buffer.insert(0, json.dumps(["B", self.run_id, os.getpid(), time.time()]) + "\n")
+
+    # Record that move (a sweep.PlannedMove) number seq is about to run, packed
+    # by backend if given; a retry under a new destination records a new intent
+    # with the same seq
+    def intent(self, seq, move, backend=None):
+        record = ["I", seq, move.kind, move.source, move.destination, move.size, move.mtime_ns]
+        if backend:
+            record.append(backend)
+        self._buffer.append(json.dumps(record) + "\n")
+
+    def done(self, seq):
+        self._buffer.append(f'["D",{seq}]\n')
+
+    def failed(self, seq):
+        self._buffer.append(f'["F",{seq}]\n')
+
+    # Write every buffered record with one fsync()
+    def commit(self):
+        if not self._buffer:
+            return
+        if self._fd is None:
+            self._open()
+        data = "".join(self._buffer).encode("utf-8", "surrogateescape")
+        self._buffer = []
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self._fd, view):]
+        os.fsync(self._fd)
+        self._last_commit = time.monotonic()
+
+    # Group commit of completion records once enough have piled up
+    def maybe_commit(self):
+        if len(self._buffer) >= COMMIT_RECORDS or time.monotonic() - self._last_commit >= COMMIT_SECONDS:
+            self.commit()
+
+    # End the run: record counts (moves per kind), commit, and add them to stats.json
+    def close(self, counts):
+        if self._fd is None and not self._buffer:
+            return
+        totals = {kind: count for kind, count in counts.items() if isinstance(count, int)}
+        self._buffer.append(json.dumps(["E", totals]) + "\n")
+        self.commit()
+        os.close(self._fd)
+        self._fd = None
+        add_stats(self.journal_dir, totals)
+
+
+# One parsed run log. moves maps seq to [kind, source, destination, state,
+# size, mtime_ns, backend], state being "D", "F" or None (unfinished) and
+# backend None for plain moves.
+Run = namedtuple('Run', ['run_id', 'pid', 'started', 'moves', 'counts', 'undone_by'])
+
+
+def run_path(journal_dir, run_id):
+    return os.path.join(_runs_dir(journal_dir), f"{run_id}.log")
+
+
+# Parse a run log; a line torn by a crash ends it
+def read_run(path):
+    header, moves, end, undone_by = [None, None, None, None], {}, None, None
+    with open(path, "r", encoding="utf-8", errors="surrogateescape") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            op = record[0]
+            if op == "B":
+                header = record
+            elif op == "I":
+                size, mtime_ns = (record[5], record[6]) if len(record) > 6 else (None, None)
+                backend = record[7] if len(record) > 7 else None
+                moves[record[1]] = [record[2], record[3], record[4], None, size, mtime_ns, backend]
+            elif op in ("D", "F") and record[1] in moves:
+                moves[record[1]][3] = op
+            elif op == "E":
+                end = record[1]
+            elif op == "U":
+                undone_by = record[1]
+    return Run(header[1], header[2], header[3], moves, end, undone_by)
+
+
+# Finished runs, newest first
+def list_runs(journal_dir):
+    try:
+        names = sorted(os.listdir(_runs_dir(journal_dir)), reverse=True)
+    except FileNotFoundError:
+        return
+    for name in names:
+        if name.endswith(".log"):
+            run = read_run(os.path.join(_runs_dir(journal_dir), name))
+            if run.counts is not None:
+                yield run
+
+
+# Record in run_id's log that undo_run_id reversed it
+def mark_undone(journal_dir, run_id, undo_run_id):
+    fd = os.open(run_path(journal_dir, run_id), os.O_WRONLY | os.O_APPEND)
+    try:
+        os.write(fd, (json.dumps(["U", undo_run_id]) + "\n").encode())
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+# Do two paths hold the same file contents (or symlinks to the same target)?
+def _same_contents(path, other):
+    st, other_st = os.lstat(path), os.lstat(other)
+    if stat.S_ISLNK(st.st_mode) or stat.S_ISLNK(other_st.st_mode):
+        return (stat.S_ISLNK(st.st_mode) and stat.S_ISLNK(other_st.st_mode)
+                and os.readlink(path) == os.readlink(other))
+    return (stat.S_ISREG(st.st_mode) and stat.S_ISREG(other_st.st_mode) and st.st_size == other_st.st_size
+            and filecmp.cmp(path, other, shallow=False))
+
+
+# Finish an interrupted move of process pid if it can be. Returns the path the
+# file ends up at, or None if it did not get there. A deletion (destination
+# None) is never replayed: whether it was still wanted (a duplicate's kept copy
+# made it, an expired entry was not restored) is unknown, so the file stays
+# until it is decided again.
+#
+# A file found at destination is only treated as this move's own when it
+# provably is: the source's inode (crashed between link() and unlink()), the
+# complete copy linked from this process's partial file, or identical contents
+# (a copy published by rename()). Anything else was put there by someone else
+# after the intent was written; it is left alone and the file goes to a free
+# name next to it, recorded with reroute(new destination) before it is moved.
+def _roll_forward(source, destination, pid, reroute):
+    source_exists = os.path.lexists(source)
+    if destination is None:
+        return None if source_exists else source
+    partial = mover.partial_path(destination, pid)
+    if os.path.lexists(partial):
+        if (source_exists and os.path.lexists(destination)
+                and os.path.samestat(os.lstat(partial), os.lstat(destination))):
+            # Crashed between linking the complete copy and cleaning up
+            os.unlink(partial)
+            os.unlink(source)
+            return destination
+        # Crashed mid-copy; the partial file carries this run's pid, so it is ours
+        os.unlink(partial)
+    if not source_exists:
+        return destination if os.path.lexists(destination) else None
+    if os.path.lexists(destination):
+        if os.path.samestat(os.lstat(source), os.lstat(destination)) or _same_contents(source, destination):
+            os.unlink(source)
+            return destination
+        folder, name = os.path.split(destination)
+        destination = DestinationCache().allocate(folder, name, _RECOVERED_TAG)
+        reroute(destination)
+    folder = os.path.dirname(destination)
+    os.makedirs(folder, exist_ok=True)
+    same_device = os.stat(os.path.dirname(source)).st_dev == os.stat(folder).st_dev
+    mover.move(os.path.dirname(source), os.path.basename(source), destination, same_device=same_device)
+    return destination
+
+
+# Settle an interrupted extraction of process pid from the bundle member or
+# chunk manifest at location to destination. Returns True if the file made it
+# to destination, after dropping it from the archive, False if the archive
+# still has it.
+def _settle_extraction(location, destination, backend, size, mtime_ns, pid):
+    partial = mover.partial_path(destination, pid)
+    if os.path.lexists(partial):
+        os.unlink(partial)
+    try:
+        st = os.lstat(destination)
+    except FileNotFoundError:
+        return False
+    if (st.st_size, st.st_mtime_ns) != (size, mtime_ns):
+        return False
+    folder, name = os.path.split(location)
+    if backend == bundles.Bundler.backend:
+        bundles.remove_members(folder, [name])
+    elif os.path.lexists(location):
+        os.unlink(location)
+        chunks.collect_garbage(folder)
+    return True
+
+
+# Bytes read from the end of a log to find its last record
+_TAIL_BYTES = 4096
+
+
+# Does the log open as fd end with an end or undo record? Only the tail is read,
+# so startup does not parse every retained log; anything else (an unfinished run,
+# a torn last line) is left to read_run().
+def _finished(fd):
+    size = os.fstat(fd).st_size
+    tail = os.pread(fd, min(size, _TAIL_BYTES), max(0, size - _TAIL_BYTES))
+    if not tail.endswith(b"\n"):
+        return False
+    last = tail[:-1].rsplit(b"\n", 1)[-1]
+    try:
+        record = json.loads(last)
+    except ValueError:
+        return False
+    return isinstance(record, list) and bool(record) and record[0] in ("E", "U")
+
+
+# Append lines to a log and fsync it
+def _append(fd, lines):
+    view = memoryview("".join(lines).encode("utf-8", "surrogateescape"))
+    while view:
+        view = view[os.write(fd, view):]
+    os.fsync(fd)
+
+
+# Replay the unfinished runs of dead processes and prune old finished logs.
+# Finished runs are recognised from their last record alone. Returns the moves
+# per kind completed by replay.
+def recover(journal_dir, keep_days=KEEP_DAYS):
+    recovered = {kind: 0 for kind in _KINDS}
+    runs_dir = _runs_dir(journal_dir)
+    try:
+        names = sorted(os.listdir(runs_dir))
+    except FileNotFoundError:
+        return recovered
+
+    cutoff = time.time() - keep_days * 86400
+    for name in names:
+        path = os.path.join(runs_dir, name)
+        try:
+            fd = os.open(path, os.O_RDWR | os.O_APPEND)
+        except OSError:
+            continue
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue  # still running
+            if _finished(fd):
+                if os.fstat(fd).st_mtime < cutoff:
+                    os.unlink(path)
+                continue
+            run = read_run(path)
+            if run.counts is not None:
+                continue
+
+            totals = {kind: 0 for kind in _KINDS}
+            lines = []
+            for seq, (kind, source, destination, state, size, mtime_ns, backend) in run.moves.items():
+                if state is None and backend and kind in _RESTORE_KINDS:
+                    try:
+                        state = "D" if _settle_extraction(source, destination, backend, size, mtime_ns,
+                                                          run.pid) else "F"
+                    except OSError as e:
+                        print(f"Error settling the restore of {source} -> {destination}: {e}")
+                        state = "F"
+                    if state == "D":
+                        recovered[kind] = recovered.get(kind, 0) + 1
+                    lines.append(f'["{state}",{seq}]\n')
+                elif state is None and backend:
+                    state = "F" if os.path.lexists(source) else "D"
+                    if state == "D":
+                        recovered[kind] = recovered.get(kind, 0) + 1
+                    lines.append(f'["{state}",{seq}]\n')
+                elif state is None:
+                    def reroute(new_destination):
+                        # The new destination is on disk before the file moves there
+                        _append(fd, lines + [json.dumps(["I", seq, kind, source, new_destination,
+                                                         size, mtime_ns]) + "\n"])
+                        lines.clear()
+                    try:
+                        state = "D" if _roll_forward(source, destination, run.pid, reroute) else "F"
+                    except OSError as e:
+                        print(f"Error replaying {source} -> {destination}: {e}")
+                        state = "F"
+                    if state == "D":
+                        recovered[kind] = recovered.get(kind, 0) + 1
+                    lines.append(f'["{state}",{seq}]\n')
+                if state == "D":
+                    totals[kind] = totals.get(kind, 0) + 1
+            lines.append(json.dumps(["E", totals]) + "\n")
+            _append(fd, lines)
+            add_stats(journal_dir, totals)
+        finally:
+            os.close(fd)
+    return recovered
+
+
+# Add counts to the cumulative per-kind totals in stats.json
+def add_stats(journal_dir, counts):
+    os.makedirs(journal_dir, exist_ok=True)
+    lock_fd = os.open(os.path.join(journal_dir, "stats.lock"), os.O_WRONLY | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        totals = load_stats(journal_dir)
+        for kind in _KINDS:
+            totals[kind] += counts.get(kind, 0)
+        path = os.path.join(journal_dir, "stats.json")
+        with open(f"{path}.tmp", "w") as file:
+            json.dump(totals, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(f"{path}.tmp", path)
+    finally:
+        os.close(lock_fd)
+
+
+# Cumulative moves per kind over every journaled run
+def load_stats(journal_dir):
+    totals = {kind: 0 for kind in _KINDS}
+    try:
+        with open(os.path.join(journal_dir, "stats.json"), "r") as file:
+            totals.update(json.load(file))
+    except (FileNotFoundError, ValueError):
+        pass
+    return totals
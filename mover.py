@@ -0,0 +1,223 @@
+import errno
+import os
+import shutil
+import stat
+import sys
+import time
+
+from executor import AdaptiveExecutor, InlineExecutor
+
+# Device-aware file moves.
+#
+# A move never replaces an existing file. When source and target share a device
+# (st_dev) it is metadata only: link() then unlink(), falling back to rename()
+# on filesystems without hard links. Across devices the data is copied inside
+# the kernel with os.copy_file_range() (or os.sendfile() where that is missing)
+# into a hidden partial file, which is linked to the target name once complete
+# and only then is the source removed; only if both primitives are unavailable
+# does the copy fall back to a read/write loop in Python.
+#
+# MoveEngine runs copies on one bounded, self-tuning pool (executor.py) per
+# (source device, target device) pair, so copies onto a slow external archive
+# disk queue up behind each other and never behind renames on the internal SSD,
+# and each pair settles on the concurrency its disks can actually absorb.
+# Same-device moves are a link() and unlink() taking a few microseconds, less
+# than handing them to a worker thread (a pool ran them at about 0.4x the speed
+# of a plain loop) or even creating a Future, so they run inline on the calling
+# thread.
+
+# Upper bound on worker threads per device pair
+WORKERS_PER_DEVICE = 16
+
+# Bytes per copy_file_range()/sendfile()/read() call
+COPY_CHUNK = 8 * 1024 * 1024
+
+# Errors meaning the filesystem cannot hard link (FAT/exFAT, some network mounts)
+_NO_LINK_ERRNOS = {errno.EPERM, errno.EACCES, errno.ENOTSUP, errno.EOPNOTSUPP, errno.EMLINK, errno.ENOSYS}
+
+# Errors meaning a kernel copy primitive cannot handle this pair of files
+_NO_KERNEL_COPY_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.ENOTSUP, errno.EOPNOTSUPP, errno.EBADF}
+
+
+# Move name (in directory, or relative to dir_fd) to target_path.
+# same_device picks the rename path; a wrong guess (e.g. bind mounts) still works.
+# Raises FileExistsError if target_path already exists.
+def move(directory, name, target_path, dir_fd=None, same_device=True):
+    if same_device:
+        try:
+            _rename_noreplace(directory, name, target_path, dir_fd)
+            return
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+    _copy_and_unlink(directory, name, target_path, dir_fd)
+
+
+def _source(directory, name, dir_fd):
+    return name if dir_fd is not None else os.path.join(directory, name)
+
+
+def _rename_noreplace(directory, name, target_path, dir_fd):
+    source = _source(directory, name, dir_fd)
+    try:
+        os.link(source, target_path, src_dir_fd=dir_fd, follow_symlinks=False)
+    except FileExistsError:
+        raise
+    except OSError as e:
+        if e.errno not in _NO_LINK_ERRNOS:
+            raise
+        if os.path.lexists(target_path):
+            raise FileExistsError(errno.EEXIST, "Destination exists", target_path)
+        os.rename(source, target_path, src_dir_fd=dir_fd)
+    else:
+        os.unlink(source, dir_fd=dir_fd)
+
+
+# Name a cross-device copy to target_path is written under by process pid (the
+# current one by default) until it is complete. It is hidden, so sweeps never
+# pick it up, and tagged with the pid, so recovery knows which one is its own.
+def partial_path(target_path, pid=None):
+    folder, name = os.path.split(target_path)
+    return os.path.join(folder, f".{name}.{pid or os.getpid()}.partial")
+
+
+def _copy_and_unlink(directory, name, target_path, dir_fd):
+    source = _source(directory, name, dir_fd)
+    source_stat = os.stat(source, dir_fd=dir_fd, follow_symlinks=False)
+
+    if stat.S_ISLNK(source_stat.st_mode):
+        os.symlink(os.readlink(source, dir_fd=dir_fd), target_path)
+    else:
+        # The copy only appears at target_path once complete, so a file found
+        # there is never a half-written copy of ours
+        partial = partial_path(target_path)
+        source_fd = os.open(source, os.O_RDONLY, dir_fd=dir_fd)
+        try:
+            target_fd = os.open(partial, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, stat.S_IMODE(source_stat.st_mode))
+            try:
+                copy_fd(source_fd, target_fd)
+            except BaseException:
+                os.close(target_fd)
+                os.unlink(partial)
+                raise
+            os.close(target_fd)
+        finally:
+            os.close(source_fd)
+        try:
+            # Timestamps, flags and (on macOS) extended attributes such as Finder tags
+            shutil.copystat(os.path.join(directory, name), partial)
+            publish(partial, target_path)
+        except BaseException:
+            os.unlink(partial)
+            raise
+
+    os.unlink(source, dir_fd=dir_fd)
+
+
+# Give the complete copy partial its final name without replacing a file there;
+# raises FileExistsError if target_path is taken
+def publish(partial, target_path):
+    try:
+        os.link(partial, target_path)
+    except FileExistsError:
+        raise
+    except OSError as e:
+        if e.errno not in _NO_LINK_ERRNOS:
+            raise
+        if os.path.lexists(target_path):
+            raise FileExistsError(errno.EEXIST, "Destination exists", target_path)
+        os.rename(partial, target_path)
+        return
+    os.unlink(partial)
+
+
+# Set path's access time to now, keeping its mtime. A file put back from the
+# archive would otherwise look unused since it was archived, and the next sweep
+# would archive it again.
+def mark_accessed(path):
+    os.utime(path, ns=(time.time_ns(), os.lstat(path).st_mtime_ns), follow_symlinks=False)
+
+
+# Copy source_fd to target_fd from their current positions, in the kernel where possible
+def copy_fd(source_fd, target_fd):
+    copied = 0
+    for primitive in _KERNEL_COPIES:
+        try:
+            while True:
+                sent = primitive(source_fd, target_fd, copied)
+                if sent == 0:
+                    return copied
+                copied += sent
+        except OSError as e:
+            # Only fall back if nothing was written; a partial copy is a real error
+            if copied or e.errno not in _NO_KERNEL_COPY_ERRNOS:
+                raise
+    while True:
+        chunk = os.read(source_fd, COPY_CHUNK)
+        if not chunk:
+            return copied
+        view = memoryview(chunk)
+        while view:
+            written = os.write(target_fd, view)
+            view = view[written:]
+        copied += len(chunk)
+
+
+# Both primitives read the source at an explicit offset and append at the target's position
+def _copy_file_range(source_fd, target_fd, offset):
+    return os.copy_file_range(source_fd, target_fd, COPY_CHUNK, offset)
+
+
+def _sendfile(source_fd, target_fd, offset):
+    return os.sendfile(target_fd, source_fd, offset, COPY_CHUNK)
+
+
+_KERNEL_COPIES = []
+if hasattr(os, 'copy_file_range'):
+    _KERNEL_COPIES.append(_copy_file_range)
+# sendfile() into a regular file is Linux-only; macOS only sends to sockets
+if hasattr(os, 'sendfile') and sys.platform.startswith('linux'):
+    _KERNEL_COPIES.append(_sendfile)
+
+
+# Runs moves on one executor per (source device, target device) pair: inline
+# for same-device renames, an adaptive pool for copies
+class MoveEngine:
+    def __init__(self, workers_per_device=WORKERS_PER_DEVICE):
+        self.workers_per_device = workers_per_device
+        self._pools = {}
+
+    def _pool(self, source_dev, target_dev):
+        key = (source_dev, target_dev)
+        pool = self._pools.get(key)
+        if pool is None:
+            name = f"move-{source_dev}-{target_dev}"
+            if source_dev == target_dev:
+                pool = InlineExecutor(name=name)
+            else:
+                pool = AdaptiveExecutor(max_workers=self.workers_per_device, name=name)
+            self._pools[key] = pool
+        return pool
+
+    # Queue a move and return its Future. A same-device move is run right away
+    # instead and None returned; its errors are raised here.
+    def submit(self, directory, name, target_path, dir_fd, source_dev, target_dev):
+        pool = self._pool(source_dev, target_dev)
+        if source_dev == target_dev:
+            pool.run(move, directory, name, target_path, dir_fd, True)
+            return None
+        return pool.submit(move, directory, name, target_path, dir_fd, False)
+
+    # Chosen concurrency and throughput per device pair
+    def report(self):
+        return [pool.report() for pool in self._pools.values()]
+
+    def shutdown(self):
+        for pool in self._pools.values():
+            pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
@@ -0,0 +1,133 @@
+import os
+import time
+
+import bundles
+import catalog
+import chunks
+import journal
+import sweep
+
+# Retention expiry for the archive (`POST /expire`, `python Automation.py expire`).
+#
+# config['retention']['days'] gives the days an archived file of each category
+# is kept after it was archived, and default_days applies to the categories not
+# listed (null: kept forever). An expiry run asks the catalog's (category,
+# archive date) index for the oldest files past their category's cutoff, BATCH
+# at a time, so it reads and deletes only the files that have expired and
+# never lists or stats the rest of the archive.
+#
+# An expiry run is journaled like a sweep: the deletions of a batch are
+# recorded as intents without a destination and committed before the first
+# file goes, and completions are committed with the batch. Moved files are
+# unlinked, bundle members dropped from their month's index (a segment goes
+# once all its members have), and chunk manifests unlinked, followed by one
+# garbage collection of each chunk store touched.
+
+# Files expired per batch
+BATCH = 500
+
+# Journal kind of an expiry deletion
+EXPIRE = "expire"
+
+
+# (days per category, default days) from config['retention']
+def policies(config):
+    settings = config.get('retention', {})
+    return settings.get('days', {}), settings.get('default_days')
+
+
+# Delete a batch of expired catalog entries, journaled from seq on. Returns
+# (ids of the entries now gone, [(entry, error)] for those that could not be).
+def _expire_batch(entries, seq, run_journal, chunk_dirs):
+    deletions = [sweep.PlannedMove(entry["location"], None, "expired", entry["size"], EXPIRE,
+                                   None, None, None, entry["mtime_ns"]) for entry in entries]
+    if run_journal:
+        for offset, deletion in enumerate(deletions):
+            run_journal.intent(seq + offset, deletion)
+        run_journal.commit()
+
+    gone, failed = [], []
+    months = {}
+    for entry in entries:
+        location = entry["location"]
+        try:
+            if entry["backend"] == catalog.BUNDLED:
+                months.setdefault(os.path.dirname(location), []).append(entry)
+                continue
+            if entry["backend"] == catalog.MOVED:
+                current = os.lstat(location)
+                if (current.st_size, current.st_mtime_ns) != (entry["size"], entry["mtime_ns"]):
+                    raise OSError(f"{location} changed since it was archived")
+            else:
+                chunk_dirs.add(os.path.dirname(location))
+            os.unlink(location)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            failed.append((entry, e))
+            continue
+        gone.append(entry)
+    for month_dir, month_entries in months.items():
+        try:
+            bundles.remove_members(month_dir, [os.path.basename(entry["location"]) for entry in month_entries])
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            failed.extend((entry, e) for entry in month_entries)
+            continue
+        gone.extend(month_entries)
+
+    if run_journal:
+        failed_ids = {entry["id"] for entry, _ in failed}
+        for offset, entry in enumerate(entries):
+            if entry["id"] in failed_ids:
+                run_journal.failed(seq + offset)
+            else:
+                run_journal.done(seq + offset)
+        run_journal.commit()
+    return [entry["id"] for entry in gone], failed
+
+
+# Delete every archived file past its category's retention and return
+# {"expire": files deleted, "failed", "bytes": their total size, "run_id"}
+def expire(archive_catalog, days, default_days=None, journal_dir=None, now=None, batch=BATCH):
+    now = now or time.time()
+    run_journal = journal.Journal(journal_dir) if journal_dir else None
+    counts = {EXPIRE: 0, "failed": 0, "bytes": 0}
+    categories = set(days)
+    if default_days is not None:
+        categories.update(archive_catalog.categories())
+
+    seq = 0
+    chunk_dirs = set()
+    for category in sorted(categories):
+        keep = days.get(category, default_days)
+        if keep is None:
+            continue
+        cutoff = now - keep * 86400
+        after = (0, 0)
+        while True:
+            entries = archive_catalog.expired(category, cutoff, batch, after)
+            if not entries:
+                break
+            after = (entries[-1]["archived_at"], entries[-1]["id"])
+            gone, failed = _expire_batch(entries, seq, run_journal, chunk_dirs)
+            seq += len(entries)
+            archive_catalog.mark_expired(gone)
+            gone = set(gone)
+            for entry in entries:
+                if entry["id"] in gone:
+                    print(f"Expired: {entry['name']} (archived from {entry['original_dir']})")
+                    counts["bytes"] += entry["size"]
+            for entry, error in failed:
+                print(f"Error expiring {entry['location']}: {error}")
+            counts[EXPIRE] += len(gone)
+            counts["failed"] += len(failed)
+
+    for archive_dir in chunk_dirs:
+        chunks.collect_garbage(archive_dir)
+    if run_journal:
+        run_journal.close(counts)
+        if seq:
+            counts["run_id"] = run_journal.run_id
+    return counts
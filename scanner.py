@@ -0,0 +1,256 @@
+import os
+import stat
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+# Directory scanning shared by app.py and Automation.py.
+#
+# The old sweeps called os.listdir() and then os.path.isdir(), os.path.exists()
+# and os.path.getatime() for every name, each of which is a separate stat().
+# os.scandir() returns the entry type with the directory read itself (d_type on
+# Linux/macOS, the FindNextFile record on Windows), and DirEntry.stat() is
+# cached, so a sweep pays for at most one stat() per file:
+#
+#   per file                      listdir + os.path.*   scan_files()
+#   type check (isdir/isfile)     1 stat()              0 (d_type)
+#   atime for archiving           1 stat()              1 fstatat() (0 on Windows)
+#   source path resolution        full path lookup      dir_fd relative (see mover.py)
+#
+# Symlinks and filesystems that report DT_UNKNOWN still need a stat() for the
+# type check; DirEntry caches it so the atime lookup reuses the same result.
+# `python benchmarks.py scan` times both approaches on a synthetic directory.
+
+# linkat()/renameat()/fstatat() style calls are not available on Windows
+DIR_FD_SUPPORTED = (os.link in os.supports_dir_fd and os.rename in os.supports_dir_fd
+                    and os.scandir in os.supports_fd)
+
+
+# Open a directory so entries can be stat'ed and moved relative to it.
+# Yields None where dir_fd operations are unsupported; callers fall back to paths.
+@contextmanager
+def open_dir(directory):
+    if not DIR_FD_SUPPORTED:
+        yield None
+        return
+    dir_fd = os.open(directory, os.O_RDONLY | getattr(os, 'O_DIRECTORY', 0))
+    try:
+        yield dir_fd
+    finally:
+        os.close(dir_fd)
+
+
+# O_NOATIME exists on Linux only, and is only allowed on files the caller owns
+_NOATIME = getattr(os, 'O_NOATIME', 0)
+
+
+# Open path read-only (a binary file object) without moving its access time,
+# which decides when it is archived: hashing, sniffing, classifying or
+# previewing a file must not make it look recently used. O_NOATIME is used where
+# allowed; otherwise the atime is put back after reading if the reads moved it.
+@contextmanager
+def open_quietly(path, buffering=-1):
+    fd = None
+    if _NOATIME:
+        try:
+            fd = os.open(path, os.O_RDONLY | _NOATIME)
+        except PermissionError:
+            pass
+    before = None
+    if fd is None:
+        fd = os.open(path, os.O_RDONLY)
+        before = os.fstat(fd)
+    with os.fdopen(fd, 'rb', buffering) as file:
+        try:
+            yield file
+        finally:
+            if before is not None:
+                _restore_atime(path, fd, before)
+
+
+def _restore_atime(path, fd, before):
+    try:
+        after = os.fstat(fd)
+        if after.st_atime_ns != before.st_atime_ns:
+            os.utime(fd if os.utime in os.supports_fd else path, ns=(before.st_atime_ns, after.st_mtime_ns))
+    except OSError:
+        # Only the owner may set times; the read itself succeeded
+        pass
+
+
+# Snapshot the non-directory entries of a directory.
+# A list is returned (not a generator) so callers can move entries while iterating.
+# Names of non-hidden subdirectories are appended to subdirs when it is given.
+def scan_files(directory, dir_fd=None, skip_hidden=True, subdirs=None):
+    entries = []
+    with os.scandir(directory if dir_fd is None else dir_fd) as iterator:
+        for entry in iterator:
+            if entry.is_dir():
+                if subdirs is not None and not entry.name.startswith('.'):
+                    subdirs.append(entry.name)
+                continue
+            if skip_hidden and entry.name.startswith('.'):
+                continue
+            entries.append(entry)
+    return entries
+
+
+# DirEntry stand-in for a single known path (e.g. from a filesystem event).
+# Like DirEntry, stat() results are cached after the first call.
+class PathEntry:
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        self._stat = {}
+
+    def stat(self, follow_symlinks=True):
+        if follow_symlinks not in self._stat:
+            self._stat[follow_symlinks] = os.stat(self.path, follow_symlinks=follow_symlinks)
+        return self._stat[follow_symlinks]
+
+    def is_dir(self, follow_symlinks=True):
+        try:
+            return stat.S_ISDIR(self.stat(follow_symlinks).st_mode)
+        except OSError:
+            return False
+
+    def is_file(self, follow_symlinks=True):
+        try:
+            return stat.S_ISREG(self.stat(follow_symlinks).st_mode)
+        except OSError:
+            return False
+
+    def inode(self):
+        return self.stat(follow_symlinks=False).st_ino
+
+
+# Threads used by walk_tree; scandir() and stat() release the GIL, so directory
+# enumeration overlaps across threads even though entry handling does not
+WALK_WORKERS = 4
+
+
+# Walk the subdirectories of root up to max_depth levels down, in parallel.
+#
+# Each worker owns a deque of directories: it pushes the subdirectories it finds
+# and pops its own work LIFO (depth first, warm dentry cache), and when it runs
+# dry it steals the oldest (shallowest, so largest) directory from another
+# worker. Directories are identified by (st_dev, st_ino), so symlinks and bind
+# mounts can never make the walk loop; symlinked directories are only entered
+# with follow_symlinks. skip_names are excluded directly below root (the folders
+# the organizer generates), skip_paths anywhere, hidden directories always.
+#
+# root_subdirs seeds the walk with root's subdirectory names when the caller
+# already listed root. unchanged(directory, dir_stat) may return a directory's
+# recorded subdirectory names to skip listing it (see snapshots.py).
+#
+# Returns [(directory, dir_stat, files, subdirs), ...] for every directory below
+# root, where files is a list of file DirEntry objects (None if skipped as
+# unchanged) and subdirs the names of its non-hidden subdirectories.
+def walk_tree(root, max_depth, skip_names=(), skip_paths=(), workers=WALK_WORKERS, follow_symlinks=False,
+              root_subdirs=None, unchanged=None):
+    results = []
+    if max_depth < 1:
+        return results
+
+    skip_paths = {os.path.normpath(path) for path in skip_paths}
+    root_stat = os.stat(root)
+    visited = {(root_stat.st_dev, root_stat.st_ino)}
+    queues = [deque() for _ in range(workers)]
+    lock = threading.Lock()
+    changed = threading.Condition(lock)
+    state = {"pending": 0, "error": None}
+
+    # Queue subdirectory name of directory (at depth) unless it is filtered or already seen
+    def push(queue, directory, depth, name, entry=None):
+        path = os.path.join(directory, name)
+        if name.startswith('.') or depth + 1 > max_depth:
+            return
+        if (depth == 0 and name in skip_names) or os.path.normpath(path) in skip_paths:
+            return
+        try:
+            if entry is not None:
+                if not entry.is_dir(follow_symlinks=follow_symlinks):
+                    return
+                dir_stat = entry.stat(follow_symlinks=follow_symlinks)
+            else:
+                dir_stat = os.stat(path, follow_symlinks=follow_symlinks)
+                if not stat.S_ISDIR(dir_stat.st_mode):
+                    return
+        except OSError:
+            return
+        key = (dir_stat.st_dev, dir_stat.st_ino)
+        with lock:
+            if key in visited:
+                return
+            visited.add(key)
+            state["pending"] += 1
+            queue.append((path, depth + 1, dir_stat))
+            changed.notify()
+
+    def scan(directory, depth, dir_stat, own_queue):
+        recorded = unchanged(directory, dir_stat) if unchanged else None
+        if recorded is not None:
+            for name in recorded:
+                push(own_queue, directory, depth, name)
+            results.append((directory, dir_stat, None, recorded))
+            return
+
+        files, subdirs = [], []
+        with os.scandir(directory) as iterator:
+            for entry in iterator:
+                if entry.is_dir():
+                    if not entry.name.startswith('.'):
+                        subdirs.append(entry.name)
+                        push(own_queue, directory, depth, entry.name, entry)
+                elif not entry.name.startswith('.'):
+                    files.append(entry)
+        results.append((directory, dir_stat, files, subdirs))
+
+    def steal(index):
+        for offset in range(1, workers):
+            try:
+                return queues[(index + offset) % workers].popleft()
+            except IndexError:
+                continue
+        return None
+
+    def work(index):
+        own_queue = queues[index]
+        while True:
+            try:
+                item = own_queue.pop()
+            except IndexError:
+                item = steal(index)
+            if item is None:
+                with lock:
+                    if state["pending"] == 0:
+                        return
+                    changed.wait(0.05)
+                continue
+            try:
+                scan(*item, own_queue)
+            except OSError:
+                # Unreadable or vanished directory: skip it like os.walk does
+                pass
+            except BaseException as e:
+                state["error"] = e
+            finally:
+                with lock:
+                    state["pending"] -= 1
+                    if state["pending"] == 0:
+                        changed.notify_all()
+
+    if root_subdirs is None:
+        root_subdirs = []
+        scan_files(root, subdirs=root_subdirs)
+    for name in root_subdirs:
+        push(queues[0], root, 0, name)
+
+    threads = [threading.Thread(target=work, args=(i,), daemon=True, name=f"walk-{i}") for i in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if state["error"] is not None:
+        raise state["error"]
+    return results
@@ -0,0 +1,99 @@
+import hashlib
+import os
+
+# Sharded layouts for the archive folder and the category folders.
+#
+# A flat folder gains every file a sweep sends there and after a year holds tens
+# of thousands of entries, which every listing, collision check and dashboard
+# view pays for. A sharded folder spreads its files over subfolders instead:
+#
+#   flat    <folder>/<name>                      (the default)
+#   month   <folder>/<YYYY>/<MM>/<name>          month of the sweep
+#   hash    <folder>/<h0>/<name>                 h0: first 2 hex digits of a hash of the name
+#
+# A shard holds at most max_entries entries. Once one is full, new files go one
+# level down, into the sub-shard named by the next 2 hex digits of their name's
+# hash (<YYYY>/<MM>/<h0>/, <h0>/<h1>/, ...), and so on, so no directory grows
+# past max_entries files plus 256 sub-shards.
+#
+# Shards are chosen while planning, from the DestinationCache's listing of each
+# shard (so a shard is listed once per sweep, like any target folder), and
+# created by the executor before their first move.
+
+FLAT = "flat"
+MONTH = "month"
+HASH = "hash"
+LAYOUTS = (FLAT, MONTH, HASH)
+
+# Entries a shard holds before new files go into its sub-shards
+MAX_ENTRIES = 1000
+
+# Hex digits of the name hash per shard level (256 sub-shards per shard)
+_PREFIX = 2
+
+# Levels of sub-shards a name hash provides
+_LEVELS = 8
+
+
+def _prefixes(name):
+    digest = hashlib.blake2b(name.casefold().encode("utf-8", "surrogateescape"),
+                             digest_size=_LEVELS * _PREFIX // 2).hexdigest()
+    return [digest[i:i + _PREFIX] for i in range(0, len(digest), _PREFIX)]
+
+
+# How files are spread over the subfolders of a target folder
+class ShardLayout:
+    def __init__(self, kind=FLAT, max_entries=MAX_ENTRIES):
+        if kind not in LAYOUTS:
+            raise ValueError(f"unknown shard layout {kind!r}")
+        self.kind = kind
+        self.max_entries = max_entries
+
+    # Top shard of folder for a file moved at when (a datetime)
+    def _base(self, folder, name, when):
+        if self.kind == MONTH:
+            return os.path.join(folder, when.strftime("%Y"), when.strftime("%m")), _prefixes(name)
+        prefixes = _prefixes(name)
+        if self.kind == HASH:
+            return os.path.join(folder, prefixes[0]), prefixes[1:]
+        return folder, prefixes
+
+    # Shard of folder that name goes into, given a destinations.DestinationCache
+    # listing the shards; the first one along the name's chain that is not full
+    def folder_for(self, folder, name, when, destinations):
+        if self.kind == FLAT:
+            return folder
+        shard, prefixes = self._base(folder, name, when)
+        for prefix in prefixes:
+            if destinations.entry_count(shard) < self.max_entries:
+                break
+            shard = os.path.join(shard, prefix)
+        return shard
+
+
+# Layout for the "archive" or "folders" (category folders) of config['shards']
+def layout(config, target):
+    settings = config.get('shards', {})
+    return ShardLayout(settings.get(target, FLAT), settings.get('max_entries', MAX_ENTRIES))
+
+
+# One page of a folder for the dashboard: its subfolders (shards) and up to limit
+# files after the name after, in name order. Sharded folders stay small enough to
+# be listed whole.
+def listing(folder, limit=500, after=None):
+    folders, files = [], []
+    with os.scandir(folder) as iterator:
+        for entry in iterator:
+            if entry.name.startswith('.'):
+                continue
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    folders.append(entry.name)
+                elif after is None or entry.name > after:
+                    st = entry.stat(follow_symlinks=False)
+                    files.append({"name": entry.name, "size": st.st_size, "mtime": st.st_mtime})
+            except OSError:
+                continue
+    files.sort(key=lambda file: file["name"])
+    return {"folder": folder, "folders": sorted(folders), "files": files[:limit],
+            "more": len(files) > limit}
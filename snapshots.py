@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+
+# Persistent per-root directory snapshots for incremental sweeps.
+#
+# A snapshot has two levels, stored under <state_dir>/snapshots/<root key>/:
+#   summary.json        every directory swept under the root, with its mtime_ns,
+#                       the earliest time a file in it becomes due (archive age),
+#                       and its subdirectory names
+#   <dir key>.json      the directory's remaining entries as sorted
+#                       [name, inode, due] rows
+#
+# A directory whose mtime has not moved and has nothing due is skipped without
+# being listed; a quiet cron run only loads summary.json and stats each
+# directory once. A changed directory is listed and merged against its sorted
+# rows, and only entries that are new, replaced (different inode) or due are
+# decided again. Names and inodes come from scandir itself, so the diff costs
+# no stat() calls; a file's content changing never changes where it belongs.
+
+# Directory mtimes this close to "now" may still change within the same tick
+MTIME_SETTLE = 2.0
+
+
+def _key(text):
+    return hashlib.sha1(text.encode("utf-8", "surrogateescape")).hexdigest()
+
+
+def _write_json(path, data):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as file:
+        json.dump(data, file, separators=(",", ":"))
+    os.replace(temp_path, path)
+
+
+def _read_json(path):
+    try:
+        with open(path, "r") as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+# Snapshot of one sweep root. fingerprint covers everything that changes
+# decisions (root flags, routing config); a mismatch discards the snapshot.
+class RootSnapshot:
+    def __init__(self, snapshot_dir, root_key, fingerprint):
+        self.directory = os.path.join(snapshot_dir, root_key)
+        self.fingerprint = fingerprint
+        summary = _read_json(os.path.join(self.directory, "summary.json"))
+        if summary is None or summary.get("fingerprint") != fingerprint:
+            summary = {"fingerprint": fingerprint, "directories": {}}
+        self._previous = summary["directories"]
+        self._current = {}
+
+    # Every directory recorded by the previous sweep (the root's tree summary)
+    def directories(self):
+        return list(self._previous)
+
+    # Recorded subdirectory names if directory can be skipped, else None
+    def unchanged(self, directory, dir_stat, now_ts):
+        record = self._previous.get(directory)
+        if (record is None or record["mtime_ns"] != dir_stat.st_mtime_ns
+                or (record["due"] is not None and now_ts >= record["due"])):
+            return None
+        self._current[directory] = record
+        return record["subdirs"]
+
+    # Sorted merge of the scanned entries against the recorded rows.
+    # Returns (entries to decide, {name: (inode, due)} carried over unchanged).
+    def changed_entries(self, directory, entries, now_ts):
+        record = self._previous.get(directory)
+        rows = _read_json(os.path.join(self.directory, record["entries"])) if record else None
+        if not rows:
+            return entries, {}
+
+        changed, carried = [], {}
+        index = 0
+        for entry in sorted(entries, key=lambda entry: entry.name):
+            while index < len(rows) and rows[index][0] < entry.name:
+                index += 1
+            if index < len(rows) and rows[index][0] == entry.name:
+                _, inode, due = rows[index]
+                if inode == entry.inode() and (due is None or now_ts < due):
+                    carried[entry.name] = (inode, due)
+                    continue
+            changed.append(entry)
+        return changed, carried
+
+    # Record what a sweep left in directory. dirty forces a rescan next time
+    # (e.g. a move failed and must be retried even if nothing else changes).
+    def record(self, directory, dir_stat, remaining, subdirs, now_ts, dirty=False):
+        rows = sorted([name, inode, due] for name, (inode, due) in remaining.items())
+        dues = [due for _, _, due in rows if due is not None]
+        fresh = now_ts - dir_stat.st_mtime_ns / 1e9 < MTIME_SETTLE
+        entries_file = f"{_key(directory)}.json"
+        self._current[directory] = {
+            "mtime_ns": None if dirty or fresh else dir_stat.st_mtime_ns,
+            "due": min(dues) if dues else None,
+            "subdirs": sorted(subdirs),
+            "entries": entries_file,
+        }
+        os.makedirs(self.directory, exist_ok=True)
+        _write_json(os.path.join(self.directory, entries_file), rows)
+
+    # Persist the directories seen by this sweep; vanished directories drop out
+    def save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        live = {record["entries"] for record in self._current.values()} | {"summary.json"}
+        _write_json(os.path.join(self.directory, "summary.json"),
+                    {"fingerprint": self.fingerprint, "directories": self._current})
+        for record in self._previous.values():
+            if record["entries"] not in live:
+                try:
+                    os.unlink(os.path.join(self.directory, record["entries"]))
+                except FileNotFoundError:
+                    pass
+
+
+# Open the snapshot for root (a SweepRoot) under snapshot_dir
+def open_snapshot(snapshot_dir, root, routing_fingerprint):
+    root_key = _key(json.dumps(list(root)))
+    fingerprint = _key(json.dumps([list(root), routing_fingerprint]))
+    return RootSnapshot(snapshot_dir, root_key, fingerprint)
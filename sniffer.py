@@ -0,0 +1,188 @@
+import os
+import stat
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+import scanner
+from duplicates import HashCache
+
+# Content sniffing for files whose name does not say what they are.
+#
+# Extensionless downloads and misnamed files used to land in "Others". The
+# sniffer reads the first PREFIX bytes of such a file with a single pread() and
+# matches them against a table of magic numbers, compiled once into one dict
+# per (offset, length): a file costs one slice and one dict lookup per group,
+# longest signatures first. The match is an extension (".pdf", ".docx", ...),
+# which the ExtensionIndex then maps to a category like any file name.
+#
+# A sweep sniffs all its unknown files at once on a thread pool, and results,
+# unknown ones included, are cached in <state_dir>/types.json keyed by (st_dev,
+# st_ino, st_size, st_mtime_ns), so a file is only read again after it changes.
+
+# Bytes read from the start of a file; enough for the tar header and for the
+# first member names of an OOXML zip
+PREFIX = 4096
+
+# Sniffing threads
+WORKERS = 8
+
+# (offset, magic bytes, extension)
+SIGNATURES = (
+    (0, b"%PDF-", ".pdf"),
+    (0, b"PK\x03\x04", ".zip"),
+    (0, b"PK\x05\x06", ".zip"),
+    (0, b"\x89PNG\r\n\x1a\n", ".png"),
+    (0, b"\xff\xd8\xff", ".jpg"),
+    (0, b"GIF87a", ".gif"),
+    (0, b"GIF89a", ".gif"),
+    (0, b"BM", ".bmp"),
+    (0, b"II*\x00", ".tiff"),
+    (0, b"MM\x00*", ".tiff"),
+    (4, b"ftyp", ".mp4"),
+    (0, b"\x1aE\xdf\xa3", ".mkv"),
+    (0, b"FLV\x01", ".flv"),
+    (0, b"RIFF", ".riff"),
+    (0, b"ID3", ".mp3"),
+    (0, b"\xff\xfb", ".mp3"),
+    (0, b"\xff\xf3", ".mp3"),
+    (0, b"\xff\xf2", ".mp3"),
+    (0, b"\xff\xf1", ".aac"),
+    (0, b"\xff\xf9", ".aac"),
+    (0, b"fLaC", ".flac"),
+    (0, b"OggS", ".ogg"),
+    (0, b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1", ".doc"),
+    (0, b"{\\rtf", ".rtf"),
+    (0, b"7z\xbc\xaf\x27\x1c", ".7z"),
+    (0, b"Rar!\x1a\x07", ".rar"),
+    (0, b"\x1f\x8b", ".gz"),
+    (0, b"BZh", ".bz2"),
+    (0, b"\xfd7zXZ\x00", ".xz"),
+    (0, b"(\xb5/\xfd", ".zst"),
+    (257, b"ustar", ".tar"),
+    (0, b"xar!", ".pkg"),
+    (0, b"MZ", ".exe"),
+    (0, b"#!", ".script"),
+)
+
+
+# Containers told apart by what follows the magic number
+def _zip_type(prefix):
+    for marker, extension in ((b"word/", ".docx"), (b"xl/", ".xlsx"), (b"ppt/", ".pptx")):
+        if marker in prefix:
+            return extension
+    return ".zip"
+
+
+def _ftyp_type(prefix):
+    brand = prefix[8:12]
+    if brand == b"qt  ":
+        return ".mov"
+    if brand in (b"M4A ", b"M4B "):
+        return ".m4a"
+    if brand in (b"heic", b"heix", b"mif1"):
+        return ".heic"
+    return ".mp4"
+
+
+def _riff_type(prefix):
+    return {b"WAVE": ".wav", b"AVI ": ".avi", b"WEBP": ".webp"}.get(prefix[8:12])
+
+
+# Two-byte magics that plain text can start with ("BMW ...", "MZ ...") are only
+# trusted with the header fields that follow them
+_BMP_HEADER_SIZES = {12, 16, 40, 52, 56, 64, 108, 124}
+
+
+def _bmp_type(prefix):
+    if len(prefix) < 18:
+        return None
+    pixels_offset, header_size = struct.unpack_from("<II", prefix, 10)
+    if header_size not in _BMP_HEADER_SIZES or pixels_offset < 14 + header_size:
+        return None
+    return ".bmp"
+
+
+# A Windows executable: the DOS header's e_lfanew points at the "PE\0\0" header
+def _exe_type(prefix):
+    if len(prefix) < 0x40:
+        return None
+    (pe_offset,) = struct.unpack_from("<I", prefix, 0x3C)
+    return ".exe" if prefix[pe_offset:pe_offset + 4] == b"PE\0\0" else None
+
+
+def _script_type(prefix):
+    interpreter = prefix.split(b"\n", 1)[0]
+    for marker, extension in ((b"python", ".py"), (b"node", ".js"), (b"sh", ".sh")):
+        if marker in interpreter:
+            return extension
+    return None
+
+
+_REFINE = {".zip": _zip_type, ".mp4": _ftyp_type, ".riff": _riff_type, ".bmp": _bmp_type, ".exe": _exe_type,
+           ".script": _script_type}
+
+
+# Signature groups, longest magic first: [(offset, length, {magic: extension})]
+def _compile(signatures):
+    groups = {}
+    for offset, magic, extension in signatures:
+        groups.setdefault((offset, len(magic)), {})[magic] = extension
+    return [(offset, length, table)
+            for (offset, length), table in sorted(groups.items(), key=lambda item: (-item[0][1], item[0][0]))]
+
+
+_TABLE = _compile(SIGNATURES)
+
+
+# Extension matching the first bytes of a file, or None
+def sniff_bytes(prefix):
+    for offset, length, table in _TABLE:
+        extension = table.get(prefix[offset:offset + length])
+        if extension:
+            refine = _REFINE.get(extension)
+            return refine(prefix) if refine else extension
+    return None
+
+
+def sniff_file(path):
+    with scanner.open_quietly(path, buffering=0) as file:
+        return sniff_bytes(os.pread(file.fileno(), PREFIX, 0))
+
+
+class Sniffer:
+    def __init__(self, cache_path=None, workers=WORKERS):
+        self.cache = HashCache(cache_path)
+        self.workers = workers
+
+    # Sniffed extensions of (path, stat) pairs, {path: extension}; files that are
+    # not regular, cannot be read or match no signature are left out
+    def sniff(self, files):
+        extensions = {}
+        missing = []
+        for path, st in files:
+            if not stat.S_ISREG(st.st_mode):
+                continue
+            cached = self.cache.get(st, "type")
+            if cached is None:
+                missing.append((path, st))
+            elif cached:
+                extensions[path] = cached
+
+        def run(item):
+            path, st = item
+            try:
+                return path, st, sniff_file(path) or ""
+            except OSError:
+                return path, st, None
+
+        if missing:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(missing))) as pool:
+                for path, st, extension in pool.map(run, missing):
+                    if extension is None:
+                        continue
+                    # Unknown files are cached too, as "", so they are not read again
+                    self.cache.put(st, "type", extension)
+                    if extension:
+                        extensions[path] = extension
+            self.cache.save()
+        return extensions
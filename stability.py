@@ -0,0 +1,132 @@
+import math
+import os
+import stat
+import time
+
+# Download-completion detection: files still being written are never moved.
+#
+# Browsers write into a temporary name and rename it when the download ends
+# (Chrome/Edge "x.pdf.crdownload", Firefox "x.pdf.part" next to an empty
+# placeholder "x.pdf", Safari a "x.pdf.download" bundle). Such files, and the
+# final names they are about to become, are always held back. Any other file
+# counts as complete once its size and mtime have stayed the same for
+# quiet_seconds: a sweep judges that from one stat() sample (mtime age), the
+# watcher re-samples held files on a single timer wheel instead of sleeping
+# per file.
+
+# Seconds a file's size and mtime must stay unchanged before it is moved
+QUIET_SECONDS = 5.0
+
+# Resolution of the timer wheel
+TICK_SECONDS = 0.5
+
+# Suffixes of in-progress downloads (browsers, download managers, rsync/aria2 temp files)
+TEMP_SUFFIXES = (".crdownload", ".part", ".partial", ".download", ".opdownload",
+                 ".tmp", ".!ut", ".aria2", ".filepart", ".unconfirmed")
+
+# Suffixes whose download also leaves a placeholder under the final name
+PLACEHOLDER_SUFFIXES = (".part", ".download")
+
+
+def is_partial(name):
+    return name.lower().endswith(TEMP_SUFFIXES)
+
+
+# Final names in a directory listing that a temporary file is about to replace
+def placeholder_names(names):
+    pending = set()
+    for name in names:
+        lowered = name.lower()
+        for suffix in PLACEHOLDER_SUFFIXES:
+            if lowered.endswith(suffix):
+                pending.add(name[:-len(suffix)])
+    return pending
+
+
+# Whether path has a temporary sibling, for callers without a directory listing
+def has_partial_sibling(path):
+    return any(os.path.lexists(path + suffix) for suffix in PLACEHOLDER_SUFFIXES)
+
+
+# Timestamp at which a file seen in a sweep should be looked at again, or None
+# if it is complete now. stat_result is the file's own (lstat) result.
+def hold_until(name, stat_result, now_ts, quiet_seconds=QUIET_SECONDS, placeholder=False):
+    if placeholder or is_partial(name):
+        return now_ts + quiet_seconds
+    ready_at = stat_result.st_mtime + quiet_seconds
+    return ready_at if ready_at > now_ts else None
+
+
+# Holds watched paths back until they are complete. observe() a path whenever
+# an event mentions it; due() returns the held paths that have since settled.
+class StabilityTracker:
+    def __init__(self, quiet_seconds=QUIET_SECONDS, tick_seconds=TICK_SECONDS):
+        self.quiet_seconds = quiet_seconds
+        self.tick_seconds = tick_seconds
+        # Hashed timer wheel: slot i holds (tick, path) for ticks = i modulo its size
+        self._slots = [[] for _ in range(max(8, 2 * math.ceil(quiet_seconds / tick_seconds)))]
+        self._next_tick = None
+        # path -> (size, mtime_ns, tick) of the latest sample; older wheel entries are stale
+        self._held = {}
+
+    def __len__(self):
+        return len(self._held)
+
+    # Sample path now; True if it is complete and can be moved, False if it
+    # is held (or gone, or a temporary file whose rename will be seen later)
+    def observe(self, path, now=None):
+        now = time.time() if now is None else now
+        try:
+            st = os.lstat(path)
+        except OSError:
+            self._held.pop(path, None)
+            return False
+        if not stat.S_ISREG(st.st_mode):
+            self._held.pop(path, None)
+            return True
+        if is_partial(os.path.basename(path)) or has_partial_sibling(path):
+            self._held.pop(path, None)
+            return False
+
+        previous = self._held.get(path)
+        unchanged = previous is None or previous[:2] == (st.st_size, st.st_mtime_ns)
+        ready_at = st.st_mtime + self.quiet_seconds
+        if unchanged and now >= ready_at:
+            self._held.pop(path, None)
+            return True
+        # Changed since the last sample (or written too recently): wait a full quiet period
+        deadline = ready_at if unchanged else now + self.quiet_seconds
+        self._schedule(path, st, max(deadline, now + self.tick_seconds))
+        return False
+
+    def _schedule(self, path, st, deadline):
+        tick = math.ceil(deadline / self.tick_seconds)
+        if self._next_tick is None:
+            self._next_tick = math.floor(time.time() / self.tick_seconds)
+        self._held[path] = (st.st_size, st.st_mtime_ns, tick)
+        self._slots[tick % len(self._slots)].append((tick, path))
+
+    # Held paths that have settled by now; the rest are re-armed
+    def due(self, now=None):
+        now = time.time() if now is None else now
+        if self._next_tick is None:
+            return []
+        current = math.floor(now / self.tick_seconds)
+        # After a long pause every slot is visited once rather than every missed tick
+        ticks = range(self._next_tick, current + 1)
+        if len(ticks) > len(self._slots):
+            ticks = range(current - len(self._slots) + 1, current + 1)
+        self._next_tick = current + 1
+
+        expired = []
+        for tick in ticks:
+            slot = self._slots[tick % len(self._slots)]
+            keep = []
+            for item in slot:
+                item_tick, path = item
+                if item_tick > current:
+                    keep.append(item)
+                elif path in self._held and self._held[path][2] == item_tick:
+                    expired.append(path)
+            slot[:] = keep
+        return [path for path in expired if self.observe(path, now)]
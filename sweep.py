@@ -0,0 +1,790 @@
+import hashlib
+import itertools
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import ExitStack
+from datetime import datetime, timedelta
+
+import bundles
+import catalog
+import chunks
+import content
+import duplicates
+import journal
+import scanner
+import shards
+import sniffer
+import snapshots
+import stability
+from classifier import ExtensionIndex, KeywordMatcher
+from destinations import DestinationCache
+from mover import MoveEngine
+
+# A sweep lists each root directory once, makes one decision per entry
+# (screenshot, archive by age, or category move) and then dispatches every
+# decided move in a single batch. /organize, /archive and /screenshots are
+# single-purpose sweeps; /sweep and `python Automation.py sweep` do all three
+# in one traversal, so Desktop and Downloads are listed and stat'ed once
+# instead of once per action.
+#
+# Deciding and moving are separate phases: plan_sweep()/plan_files() produce an
+# immutable SweepPlan of (source, destination, reason, size) moves without
+# touching any file, and execute_plan() runs a plan in bulk. /plan serves the
+# plan as a dry run, and each phase is timed on its own.
+
+# Duplicate finders by hash cache path (see duplicate_finder())
+_finders = {}
+_finders_lock = threading.Lock()
+
+# Move kinds, one per dashboard counter
+ORGANIZE = "organize"
+ARCHIVE = "archive"
+SCREENSHOT = "screenshot"
+# Moves that put a file back where a journaled run found it (undo.py)
+UNDO = "undo"
+
+# Log line prefix per move kind
+_MESSAGES = {
+    ORGANIZE: "Moved",
+    ARCHIVE: "Archived",
+    SCREENSHOT: "Moved Screenshot",
+    UNDO: "Restored",
+}
+
+# Attempts at a free destination name before a move is reported as failed
+_MAX_ATTEMPTS = 5
+
+# Source directories an execution holds open for dir_fd-relative moves; beyond
+# this, moves use full paths
+_MAX_DIR_FDS = 256
+
+# A directory to sweep and the decisions that apply to its entries.
+# Archiving is enabled by giving an archive_dir; recursive_depth > 0 also sweeps
+# files that many levels of subdirectories down, into the root's folders.
+SweepRoot = namedtuple(
+    'SweepRoot',
+    ['directory', 'organize', 'screenshots', 'archive_dir', 'days_old', 'recursive_depth'],
+    defaults=[True, False, None, 30, 0]
+)
+
+# One decided move; tag is appended to the name if the target already exists,
+# reason says which rule decided it
+Move = namedtuple('Move', ['kind', 'directory', 'name', 'target_folder', 'tag', 'reason'])
+
+# One move of a plan: where a file goes, why, and how many bytes it is. source_dev
+# and target_dev pick the move engine pool; tag and name allocation retry collisions;
+# mtime_ns (with size) lets an undo tell whether the file changed after the move.
+# duplicate_of names the kept copy of a file with the same contents: the move
+# then links the destination to it instead (or, with destination None, only
+# removes the source; see duplicates.py). backend names the bundle or chunk
+# store the file is extracted from instead of moved (undo of a packed archive
+# move; source is then the member or manifest).
+PlannedMove = namedtuple('PlannedMove', ['source', 'destination', 'reason', 'size', 'kind',
+                                         'source_dev', 'target_dev', 'tag', 'mtime_ns', 'duplicate_of',
+                                         'backend'],
+                         defaults=[None, None])
+
+# Everything a sweep decided, before any file is touched. moves is a tuple of
+# PlannedMove; the rest is carried to execute_plan() for retries and snapshots.
+# unplanned holds the directories of files decided but not planned (e.g. their
+# target folder could not be listed), which the snapshots must not skip.
+SweepPlan = namedtuple('SweepPlan', ['moves', 'now', 'planning_seconds', 'destinations', 'listings', 'snapshots',
+                                     'unplanned'],
+                       defaults=[frozenset()])
+
+DEFAULT_SCREENSHOT_PROJECTS = {
+    "Meeting": ["meeting", "call", "discussion"],
+    "Presentation": ["presentation", "slide", "ppt"],
+    "Design": ["design", "mockup", "sketch"]
+}
+
+
+# Routing tables compiled once from config.json
+class Router:
+    def __init__(self, config):
+        self.screenshots_dir = os.path.expanduser(config['directories']['screenshots'])
+        self.extensions = ExtensionIndex(config['folders'])
+        # Files written within this many seconds (or still downloading) stay in place
+        self.quiet_seconds = config.get('stability', {}).get('quiet_seconds', stability.QUIET_SECONDS)
+        # What happens to files that duplicate one already at (or on its way to) their target
+        self.duplicate_policy = config.get('duplicates', {}).get('policy', 'off')
+        if self.duplicate_policy not in duplicates.POLICIES:
+            raise ValueError(f"unknown duplicates policy {self.duplicate_policy!r}")
+        self.duplicates = duplicate_finder(config) if self.duplicate_policy != 'off' else None
+        # Reads the first bytes of files whose name has no known extension
+        self.sniffer = content_sniffer(config)
+        # Reads PDFs and text files whose name matches no sorting rule for the rules' keywords
+        self.contents = content_classifier(config, self.duplicates)
+        # Subfolder layouts of the category folders and of the archive folder; bundles
+        # and chunks lay out the archive themselves, so moved files only are sharded
+        self.shards = {
+            ORGANIZE: shards.layout(config, 'folders'),
+            ARCHIVE: shards.layout(config, 'archive') if bundler(config) is None else shards.ShardLayout(),
+        }
+        # Changes whenever a config edit could change a decision; invalidates sweep snapshots
+        self.fingerprint = hashlib.sha1(json.dumps([
+            config['folders'], config.get('sorting_rules'), config.get('screenshot_projects'), self.screenshots_dir,
+            config.get('shards'), config.get('duplicates'), config.get('sniff'), config.get('content_rules')
+        ], sort_keys=True).encode()).hexdigest()
+        # Folders the organizer creates directly below a root; recursive sweeps never descend into them
+        self.generated_folders = set(config['folders']) | set(config.get('sorting_rules', {})) | {self.extensions.default}
+        # One automaton for every keyword rule set, matched in a single pass per file name
+        self.keywords = KeywordMatcher({
+            "sorting_rules": config.get('sorting_rules', {}),
+            "screenshots": config.get('screenshot_projects', DEFAULT_SCREENSHOT_PROJECTS)
+        })
+
+    # Decide what happens to one scanned entry of root (found in directory, which
+    # defaults to the root itself); None leaves it in place
+    def decide(self, root, entry, now, directory=None):
+        directory = directory or root.directory
+        name = entry.name
+        matches = self.keywords.match(name)
+
+        if root.screenshots and name.lower().startswith("screenshot"):
+            project = matches.get("screenshots")
+            folder = project or now.strftime("%B_%Y")
+            reason = f"screenshot for project {project}" if project else "screenshot"
+            return Move(SCREENSHOT, directory, name,
+                        os.path.join(self.screenshots_dir, folder), now.strftime("%Y%m%d%H%M%S"), reason)
+
+        if root.archive_dir:
+            # Archive age follows symlinks, unlike the completeness check
+            access_time = datetime.fromtimestamp(entry.stat().st_atime)
+            if now - access_time > timedelta(days=root.days_old):
+                return Move(ARCHIVE, directory, name, root.archive_dir, access_time.strftime("%Y%m%d"),
+                            f"not accessed for {(now - access_time).days} days")
+
+        if root.organize:
+            # sorting_rules keywords take priority over the extension category
+            rule = matches.get("sorting_rules")
+            category = rule or self.extensions.category_for(name)
+            reason = f"sorting rule {rule}" if rule else f"file type {category}"
+            return Move(ORGANIZE, directory, name,
+                        os.path.join(root.directory, category), now.strftime("%Y%m%d%H%M%S"), reason)
+
+        return None
+
+    # Re-route organize moves of files with no known extension by their contents:
+    # decided is [(move, source_dev, source_stat)] as collected while planning.
+    # Every such file of a plan is sniffed in one batch.
+    def sniff_unknown(self, decided):
+        unknown_reason = f"file type {self.extensions.default}"
+        unknown = [(os.path.join(move.directory, move.name), source_stat) for move, _, source_stat in decided
+                   if move.kind == ORGANIZE and move.reason == unknown_reason]
+        if not self.sniffer or not unknown:
+            return decided
+        sniffed = self.sniffer.sniff(unknown)
+        result = []
+        for move, source_dev, source_stat in decided:
+            extension = sniffed.get(os.path.join(move.directory, move.name)) if move.reason == unknown_reason else None
+            category = self.extensions.category_for(extension) if extension else self.extensions.default
+            if category != self.extensions.default:
+                move = move._replace(target_folder=os.path.join(os.path.dirname(move.target_folder), category),
+                                     reason=f"contents look like {extension} ({category})")
+            result.append((move, source_dev, source_stat))
+        return result
+
+    # Re-route organize moves of PDF and text files (sniffed PDFs included) whose
+    # name matched no sorting rule to the rule their contents match, parsing every such file of a plan
+    # in one batch; decided is as for sniff_unknown()
+    def classify_contents(self, decided):
+        if not self.contents:
+            return decided
+        candidates = [(os.path.join(move.directory, move.name), source_stat) for move, _, source_stat in decided
+                      if move.kind == ORGANIZE and not move.reason.startswith("sorting rule")
+                      and (content.is_candidate(move.name) or move.reason.startswith("contents look like .pdf"))]
+        labels = self.contents.classify(candidates)
+        if not labels:
+            return decided
+        result = []
+        for move, source_dev, source_stat in decided:
+            rule = labels.get(os.path.join(move.directory, move.name)) if move.kind == ORGANIZE else None
+            if rule:
+                move = move._replace(target_folder=os.path.join(os.path.dirname(move.target_folder), rule),
+                                     reason=f"contents match sorting rule {rule}")
+            result.append((move, source_dev, source_stat))
+        return result
+
+    # Shard of move's target folder that its file goes into (see shards.py)
+    def target_shard(self, move, now, destinations):
+        layout = self.shards.get(move.kind)
+        if layout is None:
+            return move.target_folder
+        return layout.folder_for(move.target_folder, move.name, now, destinations)
+
+
+# Subdirectory depth for recursive sweeps from config['recursive']; enabled overrides the config switch
+def recursive_depth(config, enabled=None):
+    settings = config.get('recursive', {})
+    if enabled is None:
+        enabled = settings.get('enabled', False)
+    return settings.get('max_depth', 3) if enabled else 0
+
+
+# The Desktop/Downloads roots swept by /sweep and `Automation.py sweep`
+def default_roots(config, depth=None):
+    directories = config['directories']
+    depth = recursive_depth(config) if depth is None else depth
+    return [
+        SweepRoot(os.path.expanduser(directories['desktop']), screenshots=True, recursive_depth=depth),
+        SweepRoot(os.path.expanduser(directories['downloads']),
+                  archive_dir=os.path.expanduser(directories['archive']),
+                  days_old=config['days_old_for_archive'], recursive_depth=depth)
+    ]
+
+
+# Archive backend: a bundler packing archived files into monthly compressed
+# bundles, a chunk archiver storing them deduplicated by content, or None when
+# archiving moves files as they are. With tiers enabled, sweeps always move and
+# the backend is only used for cold storage (see cold_archiver()). interactive
+# is for sweeps someone waits on, which chunk by content only up to
+# chunks.interactive_cdc_max_bytes.
+def bundler(config, interactive=False):
+    if config.get('tiers', {}).get('enabled', False):
+        return None
+    return _archive_backend(config, interactive)
+
+
+# Cold storage for a tiered archive: the configured backend, bundles by default
+def cold_archiver(config):
+    return _archive_backend(config) or bundles.Bundler()
+
+
+def _archive_backend(config, interactive=False):
+    chunk_settings = config.get('chunks', {})
+    if chunk_settings.get('enabled', False):
+        cdc_max_bytes = chunk_settings.get('cdc_max_bytes', chunks.CDC_MAX_BYTES)
+        if interactive:
+            cdc_max_bytes = min(cdc_max_bytes, chunk_settings.get('interactive_cdc_max_bytes',
+                                                                  chunks.INTERACTIVE_CDC_MAX_BYTES))
+        return chunks.ChunkArchiver(chunk_settings.get('compress', True), chunk_settings.get('workers'),
+                                    cdc_max_bytes)
+    settings = config.get('bundles', {})
+    if not settings.get('enabled', False):
+        return None
+    return bundles.Bundler(settings.get('compression', 'lzma'), settings.get('workers'))
+
+
+# Duplicate finder with its hash cache in the state directory. There is one per
+# state directory in a process, shared by the router, the catalog, the content
+# classifier and the dashboard, so none of them overwrites the others' hashes.
+def duplicate_finder(config):
+    settings = config.get('duplicates', {})
+    cache_path = os.path.join(os.path.expanduser(config.get('state_dir', '~/.file_automation')), 'hashes.json')
+    with _finders_lock:
+        finder = _finders.get(cache_path)
+        if finder is None:
+            finder = duplicates.DuplicateFinder(cache_path, settings.get('workers', duplicates.WORKERS))
+            _finders[cache_path] = finder
+    return finder
+
+
+# Content sniffer with its cache in the state directory, or None when
+# config['sniff'] is false
+def content_sniffer(config):
+    if not config.get('sniff', True):
+        return None
+    state_dir = os.path.expanduser(config.get('state_dir', '~/.file_automation'))
+    return sniffer.Sniffer(os.path.join(state_dir, 'types.json'))
+
+
+# Content classifier for sorting_rules from config['content_rules'], or None when
+# it is disabled or there are no rules; finder defaults to a new duplicate finder
+def content_classifier(config, finder=None):
+    settings = config.get('content_rules', {})
+    rules = config.get('sorting_rules', {})
+    if not settings.get('enabled', True) or not rules:
+        return None
+    state_dir = os.path.expanduser(config.get('state_dir', '~/.file_automation'))
+    return content.ContentClassifier(rules, finder or duplicate_finder(config), os.path.join(state_dir, 'contents.json'),
+                                     settings.get('max_pages', content.MAX_PAGES),
+                                     settings.get('max_bytes', content.MAX_BYTES), settings.get('workers'))
+
+
+# Catalog of archived files, or None when config['catalog'] is false
+def archive_catalog(config):
+    if not config.get('catalog', True):
+        return None
+    state_dir = os.path.expanduser(config.get('state_dir', '~/.file_automation'))
+    return catalog.Catalog(os.path.join(state_dir, 'catalog.db'), duplicate_finder(config),
+                           ExtensionIndex(config['folders']))
+
+
+# Directory holding the move journal and cumulative stats, or None when journaling is disabled
+def journal_dir(config):
+    if not config.get('journal', True):
+        return None
+    return os.path.join(os.path.expanduser(config.get('state_dir', '~/.file_automation')), 'journal')
+
+
+# Directory holding per-root snapshots, or None when incremental sweeps are disabled
+def snapshot_dir(config):
+    if not config.get('incremental', True):
+        return None
+    return os.path.join(os.path.expanduser(config.get('state_dir', '~/.file_automation')), 'snapshots')
+
+
+# Decide the entries of one listed directory. With a snapshot only new, replaced
+# or due entries are decided; the rest are carried over as remaining. Files
+# still being downloaded or written are held, due again once they may be complete.
+def _plan_directory(router, root, snapshot, directory, dir_stat, entries, subdirs, now, moves):
+    now_ts = now.timestamp()
+    remaining = {}
+    placeholders = stability.placeholder_names([entry.name for entry in entries] + subdirs)
+    if snapshot:
+        entries, remaining = snapshot.changed_entries(directory, entries, now_ts)
+    for entry in entries:
+        try:
+            held = stability.hold_until(entry.name, entry.stat(follow_symlinks=False), now_ts,
+                                        router.quiet_seconds, entry.name in placeholders)
+        except OSError:
+            continue
+        if held is not None:
+            remaining[entry.name] = (entry.inode(), held)
+            continue
+        move = router.decide(root, entry, now, directory)
+        if move:
+            moves.append((move, dir_stat.st_dev, entry.stat(follow_symlinks=False)))
+            continue
+        # Only archive age can change the decision for a file left in place
+        due = entry.stat().st_atime + root.days_old * 86400 if root.archive_dir else None
+        remaining[entry.name] = (entry.inode(), due)
+    return (snapshot, directory, dir_stat, remaining, subdirs)
+
+
+# Turn decided moves into an immutable plan, sniffing files of unknown type and
+# reading documents for sorting rules, reserving a free destination name for
+# each in its shard of the target folder and applying the router's duplicate
+# policy. Nothing is created or moved; destination folders are only listed.
+def _make_plan(router, decided, now, started, listings=(), root_snapshots=()):
+    destinations = DestinationCache()
+    moves = []
+    unplanned = set()
+    for move, source_dev, source_stat in router.classify_contents(router.sniff_unknown(decided)):
+        try:
+            folder = router.target_shard(move, now, destinations)
+            destination = destinations.allocate(folder, move.name, move.tag)
+            target_dev = destinations.device_of(folder)
+        except OSError as e:
+            print(f"Error planning {move.name} -> {move.target_folder}: {e}")
+            unplanned.add(move.directory)
+            continue
+        moves.append(PlannedMove(os.path.join(move.directory, move.name), destination, move.reason,
+                                 source_stat.st_size, move.kind, source_dev, target_dev, move.tag,
+                                 source_stat.st_mtime_ns))
+    if router.duplicates:
+        moves = duplicates.apply_policy(router.duplicates, moves, router.duplicate_policy)
+    return SweepPlan(tuple(moves), now, time.perf_counter() - started, destinations,
+                     tuple(listings), tuple(root_snapshots), frozenset(unplanned))
+
+
+# Decide everything a sweep of roots would do, in one traversal each, without
+# moving anything. With a snapshot_dir, directories unchanged since the previous
+# sweep are skipped (and the snapshot is only updated if the plan is executed).
+def plan_sweep(roots, router, now=None, snapshot_dir=None):
+    started = time.perf_counter()
+    now = now or datetime.now()
+    now_ts = now.timestamp()
+    decided = []
+    listings = []
+    root_snapshots = []
+    for root in roots:
+        snapshot = None
+        unchanged = None
+        if snapshot_dir:
+            snapshot = snapshots.open_snapshot(snapshot_dir, root, router.fingerprint)
+            root_snapshots.append(snapshot)
+            unchanged = lambda directory, dir_stat, snapshot=snapshot: snapshot.unchanged(directory, dir_stat, now_ts)
+
+        # Every entry of a root lives on the root's device: one stat() per root
+        root_stat = os.stat(root.directory)
+        subdirs = unchanged(root.directory, root_stat) if unchanged else None
+        if subdirs is None:
+            subdirs = []
+            # Entries listed through dir_fd stat() through it too, so it stays open while deciding
+            with scanner.open_dir(root.directory) as dir_fd:
+                entries = scanner.scan_files(root.directory, dir_fd, subdirs=subdirs)
+                listings.append(_plan_directory(router, root, snapshot, root.directory,
+                                                root_stat, entries, subdirs, now, decided))
+
+        skip_paths = [router.screenshots_dir] + ([root.archive_dir] if root.archive_dir else [])
+        walk = scanner.walk_tree(root.directory, root.recursive_depth, router.generated_folders, skip_paths,
+                                 root_subdirs=subdirs, unchanged=unchanged)
+        for directory, dir_stat, entries, subdirs in walk:
+            if entries is not None:
+                listings.append(_plan_directory(router, root, snapshot, directory,
+                                                dir_stat, entries, subdirs, now, decided))
+
+    return _make_plan(router, decided, now, started, listings, root_snapshots)
+
+
+# Plan moves for specific files under root, e.g. the paths gathered from a burst
+# of filesystem events. Missing, hidden and directory paths are ignored; paths of
+# files not yet complete are appended to held.
+def plan_files(root, paths, router, now=None, held=None):
+    started = time.perf_counter()
+    now = now or datetime.now()
+    decided = []
+    for path in paths:
+        entry = scanner.PathEntry(path)
+        if entry.name.startswith('.') or entry.is_dir():
+            continue
+        try:
+            source_stat = entry.stat(follow_symlinks=False)
+        except OSError:
+            continue
+        if stability.hold_until(entry.name, source_stat, now.timestamp(), router.quiet_seconds,
+                                stability.has_partial_sibling(path)) is not None:
+            if held is not None:
+                held.append(path)
+            continue
+        move = router.decide(root, entry, now, os.path.dirname(path))
+        if move:
+            decided.append((move, source_stat.st_dev, source_stat))
+    return _make_plan(router, decided, now, started)
+
+
+# Run a plan in bulk and return the number of moves per kind, the move engine's
+# per-device concurrency/throughput report under "engine", and planning and
+# execution seconds under "timings". Updates the snapshots the plan was made from.
+# With a journal_dir the run is journaled (see journal.py) and its id returned
+# under "run_id"; with a bundler, archive moves are packed into bundles instead.
+# With an archive_catalog, every archived file is recorded there.
+def execute_plan(plan, journal_dir=None, bundler=None, archive_catalog=None):
+    started = time.perf_counter()
+    counts = dict.fromkeys(_MESSAGES, 0)
+    run_journal = journal.Journal(journal_dir) if journal_dir and plan.moves else None
+    failed_directories = _execute(plan, counts, run_journal, bundler, archive_catalog)
+    if run_journal:
+        run_journal.close(counts)
+        counts["run_id"] = run_journal.run_id
+
+    # A directory with a failed move, or a file that could not be planned, is
+    # listed again by the next sweep
+    failed_directories |= plan.unplanned
+    now_ts = plan.now.timestamp()
+    for snapshot, directory, dir_stat, remaining, subdirs in plan.listings:
+        if snapshot:
+            snapshot.record(directory, dir_stat, remaining, subdirs, now_ts,
+                            dirty=directory in failed_directories)
+    for snapshot in plan.snapshots:
+        snapshot.save()
+
+    counts["timings"] = {"plan": round(plan.planning_seconds, 4),
+                         "execute": round(time.perf_counter() - started, 4)}
+    if plan.moves:
+        print(f"Planned {len(plan.moves)} moves in {counts['timings']['plan']}s, "
+              f"executed in {counts['timings']['execute']}s")
+    return counts
+
+
+# Plan and execute a sweep of roots; see plan_sweep() and execute_plan()
+def run_sweep(roots, router, now=None, snapshot_dir=None, journal_dir=None, bundler=None, archive_catalog=None):
+    return execute_plan(plan_sweep(roots, router, now, snapshot_dir), journal_dir, bundler, archive_catalog)
+
+
+# Plan and move specific files under root; see plan_files() and execute_plan()
+def sweep_files(root, paths, router, now=None, held=None, journal_dir=None, bundler=None, archive_catalog=None):
+    return execute_plan(plan_files(root, paths, router, now, held), journal_dir, bundler, archive_catalog)
+
+
+# JSON-ready view of a plan, as served by /plan
+def plan_summary(plan):
+    return {
+        "moves": [{"source": move.source, "destination": move.destination, "reason": move.reason,
+                   "size": move.size, "kind": move.kind, "duplicate_of": move.duplicate_of}
+                  for move in plan.moves],
+        "files": len(plan.moves),
+        "bytes": sum(move.size for move in plan.moves),
+        "planning_seconds": round(plan.planning_seconds, 4),
+    }
+
+
+# Dispatch a plan's moves on a fresh move engine (archive moves on the bundler,
+# if any, extractions from bundles and chunks on a thread pool, and duplicates
+# once their kept copies are in place), adding successes
+# to counts and the engine report under counts["engine"], and archived files to
+# archive_catalog; returns the directories with failed moves
+def _execute(plan, counts, run_journal=None, bundler=None, archive_catalog=None):
+    failed_directories = set()
+    moves = tuple(move for move in plan.moves if move.duplicate_of is None and move.backend is None)
+    duplicate_moves = tuple(move for move in plan.moves if move.duplicate_of is not None)
+    extractions = tuple(move for move in plan.moves if move.backend is not None)
+    bundled = ()
+    if bundler:
+        bundled = tuple(move for move in moves if move.kind == ARCHIVE)
+        moves = tuple(move for move in moves if move.kind != ARCHIVE)
+    planned = {move.source: move for move in plan.moves}
+    hashes = {}
+    if archive_catalog:
+        # Hashed while the sources are still in place, whatever the backend
+        files = []
+        for move in plan.moves:
+            if move.kind == ARCHIVE:
+                try:
+                    files.append((move.source, os.lstat(move.source)))
+                except OSError:
+                    continue
+        hashes = archive_catalog.hash_files(files)
+    entries = []
+    with ExitStack() as stack, MoveEngine() as engine:
+        # Moves run relative to one descriptor per source directory where supported
+        dir_fds = {}
+        for move in moves:
+            directory = os.path.dirname(move.source)
+            if directory not in dir_fds and len(dir_fds) < _MAX_DIR_FDS:
+                try:
+                    dir_fds[directory] = stack.enter_context(scanner.open_dir(directory))
+                except OSError:
+                    dir_fds[directory] = None
+        results = dispatch(moves, engine, plan.destinations, dir_fds, run_journal)
+        if bundled:
+            results = itertools.chain(results, _archive_packed(bundler, bundled, len(moves), run_journal))
+        # Planned destination -> (location, backend), filled in as results come
+        # in, before the duplicates are resolved
+        placed = {}
+        if duplicate_moves:
+            kept_planned = {move.destination for move in plan.moves if move.duplicate_of is None}
+            results = itertools.chain(results, _resolve_duplicates(duplicate_moves, placed, kept_planned,
+                                                                   len(moves) + len(bundled), run_journal))
+        if extractions:
+            results = itertools.chain(results, _extract_packed(
+                extractions, len(moves) + len(bundled) + len(duplicate_moves), run_journal))
+        for move, error in results:
+            if error:
+                failed_directories.add(os.path.dirname(move.source))
+                continue
+            counts[move.kind] += 1
+            if move.duplicate_of is not None and move.destination is None:
+                location, backend = placed.get(move.duplicate_of, (move.duplicate_of, catalog.MOVED))
+            else:
+                location = move.destination
+                backend = bundler.backend if move.kind == ARCHIVE and bundler else catalog.MOVED
+            placed[planned[move.source].destination] = (location, backend)
+            if move.kind == ARCHIVE:
+                entries.append((move.source, location, backend, move.size, move.mtime_ns, hashes.get(move.source)))
+    if archive_catalog:
+        archive_catalog.record(entries, run_journal.run_id if run_journal else None)
+    counts["engine"] = engine.report()
+    for report in counts["engine"]:
+        print(f"Move pool {report['executor']}: {report['tasks']} moves, "
+              f"concurrency {report['concurrency']} (peak {report['peak_concurrency']}), "
+              f"{report['throughput']} moves/s")
+    return failed_directories
+
+
+# Archive moves on bundler (seq numbered from first_seq in the journal),
+# yielding (move, error) like dispatch(). Every intent is committed before the
+# bundler writes a segment or manifest; a move is done once the bundler has
+# removed its source, and its intent is then rewritten with the member or
+# manifest it became (see journal.py).
+def _archive_packed(bundler, moves, first_seq, run_journal=None):
+    seqs = {}
+    for seq, move in enumerate(moves, first_seq):
+        seqs[move.source] = seq
+        if run_journal:
+            run_journal.intent(seq, move, bundler.backend)
+    if run_journal:
+        run_journal.commit()
+    for move, error in bundler.archive(moves):
+        if run_journal:
+            seq = seqs[move.source]
+            if error:
+                run_journal.failed(seq)
+            else:
+                run_journal.intent(seq, move, bundler.backend)
+                run_journal.done(seq)
+            run_journal.maybe_commit()
+        yield move, error
+
+
+# Extract moves of files packed into bundles or chunks (seq numbered from
+# first_seq in the journal) on a thread pool, yielding (move, error) like
+# dispatch(). Every file is back before any is dropped from the archive (in one
+# index update per month), and a move is only recorded as done after that (see
+# journal.py).
+def _extract_packed(moves, first_seq, run_journal=None):
+    if run_journal:
+        for seq, move in enumerate(moves, first_seq):
+            run_journal.intent(seq, move, move.backend)
+        run_journal.commit()
+    extracted, failed = [], []
+    with ThreadPoolExecutor(max_workers=min(len(moves), os.cpu_count() or 1)) as pool:
+        futures = [(seq, move, pool.submit(catalog.extract, move.backend, move.source, move.destination))
+                   for seq, move in enumerate(moves, first_seq)]
+        for seq, move, future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                failed.append((seq, move, e))
+                continue
+            extracted.append((seq, move))
+    try:
+        catalog.drop([(move.backend, move.source) for _, move in extracted])
+    except OSError as e:
+        # The files are back; the archive just keeps stale copies of them
+        print(f"Error dropping restored files from the archive: {e}")
+
+    for seq, move, error in failed:
+        print(f"Error restoring {move.source} -> {move.destination}: {error}")
+        if run_journal:
+            run_journal.failed(seq)
+        yield move, error
+    for seq, move in extracted:
+        print(f"{_MESSAGES[move.kind]}: {os.path.basename(move.destination)} -> {os.path.dirname(move.destination)}")
+        if run_journal:
+            run_journal.done(seq)
+        yield move, None
+    if run_journal:
+        run_journal.commit()
+
+
+# Where the kept copy of duplicate move is now, as (location, backend): where
+# this run put it (placed, by planned destination) or where it already was.
+# Raises FileNotFoundError for a kept copy this run planned (kept_planned) but
+# did not place, or that has gone since planning.
+def _kept_copy(move, placed, kept_planned):
+    if move.duplicate_of in placed:
+        return placed[move.duplicate_of]
+    if move.duplicate_of in kept_planned:
+        raise FileNotFoundError(f"kept copy {move.duplicate_of} was not placed")
+    if not os.path.lexists(move.duplicate_of):
+        raise FileNotFoundError(f"kept copy {move.duplicate_of} is missing")
+    return move.duplicate_of, catalog.MOVED
+
+
+# Resolve duplicate moves (seq numbered from first_seq in the journal), yielding
+# (move, error) like dispatch(). Links go to where the kept copy actually ended
+# up, which may differ from its planned destination; a kept copy that failed to
+# move, or was packed into a bundle or chunks (nothing to link to), leaves the
+# duplicate where it is for a later sweep.
+def _resolve_duplicates(moves, placed, kept_planned, first_seq, run_journal=None):
+    kept = []
+    for move in moves:
+        try:
+            location, backend = _kept_copy(move, placed, kept_planned)
+            if move.destination is not None and backend != catalog.MOVED:
+                raise OSError(f"kept copy {move.duplicate_of} was packed into the archive, not linked")
+            kept.append((location, None))
+        except OSError as e:
+            kept.append((None, e))
+    if run_journal:
+        for seq, move, (location, _) in zip(itertools.count(first_seq), moves, kept):
+            if move.destination is not None and location is not None:
+                # A linked destination is the kept copy's inode, with its mtime
+                try:
+                    move = move._replace(mtime_ns=os.lstat(location).st_mtime_ns)
+                except OSError:
+                    pass
+            run_journal.intent(seq, move)
+        run_journal.commit()
+    for seq, move, (location, error) in zip(itertools.count(first_seq), moves, kept):
+        if not error:
+            try:
+                if move.destination is not None:
+                    os.makedirs(os.path.dirname(move.destination), exist_ok=True)
+                duplicates.resolve(move, location)
+            except OSError as e:
+                error = e
+        if error:
+            print(f"Error resolving duplicate {move.source}: {error}")
+        elif move.destination is None:
+            print(f"Removed duplicate: {os.path.basename(move.source)} (kept {location})")
+        else:
+            print(f"Linked duplicate: {os.path.basename(move.source)} -> {location}")
+        if run_journal:
+            if error:
+                run_journal.failed(seq)
+            else:
+                run_journal.done(seq)
+        yield move, error
+
+
+# Execute planned moves as one batch on the move engine, yielding (move, error)
+# for each, with error None on success. Destination folders are created on first
+# use; a name taken since planning is re-allocated from destinations on the
+# calling thread, so workers only move. With a run_journal every intent is
+# committed before its move is submitted, and completions are group-committed.
+def dispatch(moves, engine, destinations, dir_fds, run_journal=None):
+    created = set()
+    pending = {}
+
+    # Submit a move; returns its (move, error) if that already settled it (a
+    # same-device move runs inline, see mover.MoveEngine), else None
+    def start(seq, move, attempt):
+        try:
+            folder = os.path.dirname(move.destination)
+            if folder not in created:
+                os.makedirs(folder, exist_ok=True)
+                created.add(folder)
+            directory, name = os.path.split(move.source)
+            future = engine.submit(directory, name, move.destination, dir_fds.get(directory),
+                                   move.source_dev, move.target_dev)
+        except OSError as e:
+            return settle(seq, move, attempt, e)
+        if future is None:
+            return finish(seq, move, None)
+        pending[future] = (seq, move, attempt)
+        return None
+
+    # A failed move, retried under a new name if its name was taken; returns
+    # (move, error) once that is final, else None
+    def settle(seq, move, attempt, error):
+        # Created by someone else after the folder was listed; the taken name
+        # stays reserved, so the next allocation differs
+        if isinstance(error, FileExistsError) and attempt < _MAX_ATTEMPTS:
+            try:
+                folder = os.path.dirname(move.destination)
+                retry = move._replace(destination=destinations.allocate(
+                    folder, os.path.basename(move.source), move.tag))
+                if run_journal:
+                    run_journal.intent(seq, retry)
+                    run_journal.commit()
+            except OSError as retry_error:
+                return finish(seq, move, retry_error)
+            return start(seq, retry, attempt + 1)
+        return finish(seq, move, error)
+
+    def finish(seq, move, error):
+        if error:
+            print(f"Error moving {move.source} -> {move.destination}: {error}")
+        else:
+            print(f"{_MESSAGES[move.kind]}: {os.path.basename(move.source)} -> {os.path.dirname(move.destination)}")
+        if run_journal:
+            if error:
+                run_journal.failed(seq)
+            else:
+                run_journal.done(seq)
+        return move, error
+
+    if run_journal:
+        for seq, move in enumerate(moves):
+            run_journal.intent(seq, move)
+        run_journal.commit()
+
+    for seq, move in enumerate(moves):
+        result = start(seq, move, 1)
+        if result:
+            yield result
+            if run_journal:
+                run_journal.maybe_commit()
+
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            seq, move, attempt = pending.pop(future)
+            try:
+                future.result()
+            except OSError as e:
+                result = settle(seq, move, attempt, e)
+            else:
+                result = finish(seq, move, None)
+            if result:
+                yield result
+        if run_journal:
+            run_journal.maybe_commit()
@@ -0,0 +1,68 @@
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sweep  # noqa: E402
+
+# Seconds before now the files a test sweeps were last written and read, so
+# they are complete and old enough to archive
+AGE = 90 * 86400
+
+
+# Write data to path, dated AGE seconds ago
+def make_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as file:
+        file.write(data)
+    then = time.time() - AGE
+    os.utime(path, (then, then))
+    return path
+
+
+def read(path):
+    with open(path, "rb") as file:
+        return file.read()
+
+
+# Config of an organizer confined to tmp_path: its state directory, no content
+# sniffing or classification, and settings merged over the defaults
+@pytest.fixture
+def make_config(tmp_path):
+    def make(**settings):
+        config = {
+            "directories": {
+                "desktop": str(tmp_path / "Desktop"),
+                "downloads": str(tmp_path / "Downloads"),
+                "screenshots": str(tmp_path / "Desktop" / "Screenshots"),
+                "archive": str(tmp_path / "Downloads" / "Archive"),
+            },
+            "folders": {
+                "Documents": [".pdf", ".txt"],
+                "Images": [".jpg", ".png"],
+            },
+            "days_old_for_archive": 30,
+            "state_dir": str(tmp_path / "state"),
+            "sniff": False,
+            "content_rules": {"enabled": False},
+            "stability": {"quiet_seconds": 0},
+        }
+        config.update(settings)
+        return config
+    return make
+
+
+@pytest.fixture
+def journal_dir(tmp_path):
+    return str(tmp_path / "state" / "journal")
+
+
+# Forget duplicate finders of earlier tests, whose state directories are gone
+@pytest.fixture(autouse=True)
+def _fresh_finders():
+    yield
+    with sweep._finders_lock:
+        sweep._finders.clear()
@@ -0,0 +1,88 @@
+import os
+import zipfile
+
+import bundles
+import sweep
+from conftest import make_file, read
+
+
+def _move(source, archive):
+    st = os.lstat(source)
+    return sweep.PlannedMove(source, os.path.join(archive, os.path.basename(source)), "test", st.st_size,
+                             sweep.ARCHIVE, st.st_dev, st.st_dev, "t", st.st_mtime_ns)
+
+
+def _bundle(moves, workers=2):
+    results = list(bundles.Bundler("deflate", workers).archive(moves))
+    assert all(error is None for _, error in results)
+    return {move.source: move.destination for move, _ in results}
+
+
+def test_archived_files_are_packed_into_their_month(tmp_path):
+    archive = str(tmp_path / "Archive")
+    sources = [make_file(str(tmp_path / "one" / "a.txt"), b"a" * 1000),
+               make_file(str(tmp_path / "two" / "a.txt"), b"b" * 1000),
+               make_file(str(tmp_path / "one" / "c.jpg"), b"c" * 1000)]
+    moves = [_move(source, archive) for source in sources]
+
+    destinations = _bundle(moves)
+    month_dir = os.path.join(archive, bundles.month_of(moves[0].mtime_ns))
+    # Clashing names get a suffix within the month
+    assert sorted(os.path.relpath(destination, month_dir) for destination in destinations.values()) == \
+        ["a.txt", "a_2.txt", "c.jpg"]
+    assert not any(os.path.lexists(source) for source in sources)
+
+    members = bundles.load_index(month_dir)["members"]
+    assert {members[name]["source"] for name in members} == set(sources)
+    segments = {members[name]["segment"] for name in members}
+    methods = {}
+    for segment in segments:
+        with zipfile.ZipFile(os.path.join(month_dir, segment)) as bundle:
+            methods.update((info.filename, info.compress_type) for info in bundle.infolist())
+    # Already compressed types are stored as they are
+    assert methods == {"a.txt": zipfile.ZIP_DEFLATED, "a_2.txt": zipfile.ZIP_DEFLATED, "c.jpg": zipfile.ZIP_STORED}
+
+    restored = bundles.restore(month_dir, "a_2.txt")
+    assert restored == sources[1]
+    assert read(restored) == b"b" * 1000
+    assert os.stat(restored).st_mtime_ns == moves[1].mtime_ns
+
+
+def test_sources_left_by_a_crash_are_only_removed(tmp_path):
+    archive = str(tmp_path / "Archive")
+    source = make_file(str(tmp_path / "a.txt"), b"a")
+    move = _move(source, archive)
+    _bundle([move])
+    month_dir = os.path.join(archive, bundles.month_of(move.mtime_ns))
+    segments = sorted(os.listdir(month_dir))
+
+    # The same file, still in place as if the run had died before deleting it
+    make_file(source, b"a")
+    os.utime(source, ns=(move.mtime_ns, move.mtime_ns))
+    assert _bundle([move]) == {source: os.path.join(month_dir, "a.txt")}
+    assert not os.path.lexists(source)
+    assert sorted(os.listdir(month_dir)) == segments
+
+
+def test_a_file_changed_while_bundling_is_kept(tmp_path):
+    source = make_file(str(tmp_path / "a.txt"), b"a")
+    move = _move(source, str(tmp_path / "Archive"))
+    with open(source, "ab") as file:
+        file.write(b" edited")
+
+    _, error = bundles.Bundler._remove_source(move)
+    assert isinstance(error, OSError)
+    assert read(source) == b"a edited"
+
+
+def test_segments_go_with_their_last_member(tmp_path):
+    archive = str(tmp_path / "Archive")
+    moves = [_move(make_file(str(tmp_path / name), name.encode()), archive) for name in ("a.txt", "b.txt")]
+    _bundle(moves, workers=1)
+    month_dir = os.path.join(archive, bundles.month_of(moves[0].mtime_ns))
+
+    assert bundles.remove_members(month_dir, ["a.txt", "missing.txt"]) == ["a.txt"]
+    assert list(bundles.load_index(month_dir)["members"]) == ["b.txt"]
+    assert [name for name in os.listdir(month_dir) if name.endswith(".zip")]
+    assert bundles.remove_members(month_dir, ["b.txt"]) == ["b.txt"]
+    assert not [name for name in os.listdir(month_dir) if name.endswith(".zip")]
@@ -0,0 +1,179 @@
+import os
+import time
+
+import pytest
+
+import bundles
+import catalog
+import chunks
+import journal
+import mover
+import sweep
+from conftest import make_file, read
+
+BACKENDS = {
+    catalog.MOVED: {},
+    catalog.BUNDLED: {"bundles": {"enabled": True, "workers": 1}},
+    catalog.CHUNKED: {"chunks": {"enabled": True, "workers": 1}},
+}
+
+
+# Archive files {name: data} from Downloads with config; returns its catalog
+def _archive(tmp_path, config, journal_dir, files):
+    downloads = tmp_path / "Downloads"
+    for name, data in files.items():
+        make_file(str(downloads / name), data)
+    archive_catalog = sweep.archive_catalog(config)
+    _sweep(tmp_path, config, journal_dir, archive_catalog)
+    return archive_catalog
+
+
+def _sweep(tmp_path, config, journal_dir, archive_catalog):
+    downloads = tmp_path / "Downloads"
+    root = sweep.SweepRoot(str(downloads), organize=False, archive_dir=str(downloads / "Archive"))
+    return sweep.run_sweep([root], sweep.Router(config), journal_dir=journal_dir, bundler=sweep.bundler(config),
+                           archive_catalog=archive_catalog)
+
+
+# Is the file at entry's location still in the archive?
+def _archived(entry):
+    location = entry["location"]
+    if entry["backend"] == catalog.BUNDLED:
+        return os.path.basename(location) in bundles.load_index(os.path.dirname(location))["members"]
+    return os.path.lexists(location)
+
+
+@pytest.mark.parametrize("backend", list(BACKENDS))
+def test_restore(tmp_path, make_config, journal_dir, backend):
+    config = make_config(**BACKENDS[backend])
+    source = str(tmp_path / "Downloads" / "a.txt")
+    archive_catalog = _archive(tmp_path, config, journal_dir, {"a.txt": os.urandom(20000)})
+    (entry,) = archive_catalog.search()
+    assert entry["backend"] == backend
+    data_mtime = entry["mtime_ns"]
+
+    restored, run_id = archive_catalog.restore(entry["id"], journal_dir)
+    assert restored == source
+    assert not _archived(entry)
+    assert archive_catalog.search() == []
+    with pytest.raises(LookupError):
+        archive_catalog.restore(entry["id"], journal_dir)
+    archive = str(tmp_path / "Downloads" / "Archive")
+    if backend == catalog.CHUNKED:
+        assert chunks.store_bytes(archive) == 0
+    if backend == catalog.BUNDLED:
+        month_dir = os.path.dirname(entry["location"])
+        assert not [name for name in os.listdir(month_dir) if name.endswith(".zip")]
+
+    # The original mtime, but just accessed: the next sweep leaves it in place
+    st = os.stat(restored)
+    assert st.st_mtime_ns == data_mtime
+    assert st.st_atime > time.time() - 60
+    assert _sweep(tmp_path, config, journal_dir, archive_catalog)[sweep.ARCHIVE] == 0
+    assert os.path.lexists(restored)
+
+    (run,) = [run for run in journal.list_runs(journal_dir) if catalog.RESTORE in run.counts]
+    assert run.run_id == run_id
+    assert list(run.moves.values()) == [[catalog.RESTORE, entry["location"], restored, "D", entry["size"],
+                                         data_mtime, None if backend == catalog.MOVED else backend]]
+
+
+def test_restore_beside_a_taken_name(tmp_path, make_config, journal_dir):
+    archive_catalog = _archive(tmp_path, make_config(), journal_dir, {"a.txt": b"old"})
+    make_file(str(tmp_path / "Downloads" / "a.txt"), b"new")
+    (entry,) = archive_catalog.search()
+
+    restored, run_id = archive_catalog.restore(entry["id"])
+    assert run_id is None
+    assert restored == str(tmp_path / "Downloads" / "a_restored.txt")
+    assert read(restored) == b"old"
+    assert read(str(tmp_path / "Downloads" / "a.txt")) == b"new"
+
+
+# Journal a restore of entry to target as a run whose process died after
+# committing its intent
+def _crashed_restore(journal_dir, entry, target):
+    run_journal = journal.Journal(journal_dir)
+    run_journal.intent(0, catalog._Restore(catalog.RESTORE, entry["location"], target, entry["size"],
+                                           entry["mtime_ns"]), entry["backend"])
+    run_journal.commit()
+    os.close(run_journal._fd)
+    return run_journal.run_id
+
+
+@pytest.mark.parametrize("backend", [catalog.BUNDLED, catalog.CHUNKED])
+def test_crash_before_dropping_a_restored_file(tmp_path, make_config, journal_dir, backend):
+    archive_catalog = _archive(tmp_path, make_config(**BACKENDS[backend]), journal_dir, {"a.txt": b"a" * 100})
+    (entry,) = archive_catalog.search()
+    target = str(tmp_path / "Downloads" / "a.txt")
+    run_id = _crashed_restore(journal_dir, entry, target)
+    catalog.extract(backend, entry["location"], target)
+
+    journal.recover(journal_dir)
+    assert read(target) == b"a" * 100
+    assert not _archived(entry)
+    assert journal.read_run(journal.run_path(journal_dir, run_id)).moves[0][3] == "D"
+
+
+@pytest.mark.parametrize("backend", [catalog.BUNDLED, catalog.CHUNKED])
+def test_crash_mid_extraction(tmp_path, make_config, journal_dir, backend):
+    archive_catalog = _archive(tmp_path, make_config(**BACKENDS[backend]), journal_dir, {"a.txt": b"a" * 100})
+    (entry,) = archive_catalog.search()
+    target = str(tmp_path / "Downloads" / "a.txt")
+    run_id = _crashed_restore(journal_dir, entry, target)
+    partial = make_file(mover.partial_path(target), b"a" * 10)
+
+    journal.recover(journal_dir)
+    assert not os.path.lexists(partial) and not os.path.lexists(target)
+    assert _archived(entry)
+    assert journal.read_run(journal.run_path(journal_dir, run_id)).moves[0][3] == "F"
+    # The restore can simply be run again
+    assert read(archive_catalog.restore(entry["id"], journal_dir).path) == b"a" * 100
+
+
+# A catalog of files archived one per second from 1000, in the order of paths
+def _catalog(tmp_path, monkeypatch, paths):
+    archive_catalog = catalog.Catalog(str(tmp_path / "state" / "catalog.db"))
+    for n, path in enumerate(paths):
+        with monkeypatch.context() as patch:
+            patch.setattr(catalog.time, "time", lambda n=n: 1000.0 + n)
+            archive_catalog.record([(path, "/archive/" + os.path.basename(path), catalog.MOVED, 1, 1, None)])
+    return archive_catalog
+
+
+def _names(entries):
+    return [entry["name"] for entry in entries]
+
+
+def test_search_filters(tmp_path, monkeypatch):
+    archive_catalog = _catalog(tmp_path, monkeypatch, [
+        "/home/Downloads/Report.pdf", "/home/Downloads/sub/report_2.pdf", "/home/Downloads/reportx2.pdf",
+        "/home/Downloads-old/report.txt", "/home/Downloads2/notes.txt", "/home/Desktop/50%.txt",
+    ])
+
+    # Newest first; names match by prefix, case-insensitively and literally
+    assert _names(archive_catalog.search()) == ["50%.txt", "notes.txt", "report.txt", "reportx2.pdf",
+                                                "report_2.pdf", "Report.pdf"]
+    assert _names(archive_catalog.search(name="REPORT")) == ["report.txt", "reportx2.pdf", "report_2.pdf",
+                                                              "Report.pdf"]
+    assert _names(archive_catalog.search(name="report_")) == ["report_2.pdf"]
+    assert _names(archive_catalog.search(name="50%")) == ["50%.txt"]
+    # A directory matches its whole subtree and nothing that merely shares its prefix
+    assert _names(archive_catalog.search(directory="/home/Downloads/")) == ["reportx2.pdf", "report_2.pdf",
+                                                                            "Report.pdf"]
+    assert _names(archive_catalog.search(name="report", directory="/home/Downloads/sub")) == ["report_2.pdf"]
+    assert _names(archive_catalog.search(since=1001, until=1003)) == ["reportx2.pdf", "report_2.pdf"]
+    assert _names(archive_catalog.search(limit=2)) == ["50%.txt", "notes.txt"]
+
+
+def test_restored_files_are_only_searched_on_request(tmp_path, monkeypatch):
+    archive_catalog = _catalog(tmp_path, monkeypatch, ["/home/Downloads/a.txt", "/home/Downloads/b.txt"])
+    (entry,) = archive_catalog.search(name="a.txt")
+    archive_catalog.mark_restored("id = ?", [entry["id"]])
+
+    assert _names(archive_catalog.search()) == ["b.txt"]
+    restored = archive_catalog.search(include_restored=True)
+    assert _names(restored) == ["b.txt", "a.txt"]
+    assert restored[1]["restored_at"] is not None
+    assert archive_catalog.get(entry["id"])["name"] == "a.txt"
+    assert archive_catalog.get(entry["id"] + 100) is None
@@ -0,0 +1,94 @@
+import io
+import os
+import random
+
+import pytest
+
+import chunks
+import sweep
+from conftest import make_file, read
+
+
+def test_interactive_archiving_caps_content_defined_chunking(make_config):
+    config = make_config(chunks={"enabled": True, "cdc_max_bytes": 2 ** 30})
+    assert sweep.bundler(config).cdc_max_bytes == 2 ** 30
+    assert sweep.bundler(config, interactive=True).cdc_max_bytes == chunks.INTERACTIVE_CDC_MAX_BYTES
+    # A lower limit than the interactive one applies everywhere
+    config = make_config(chunks={"enabled": True, "cdc_max_bytes": 1024})
+    assert sweep.bundler(config, interactive=True).cdc_max_bytes == 1024
+
+
+def _random_bytes(size, seed=0):
+    return random.Random(seed).randbytes(size)
+
+
+def _digests(data, splitter=chunks.split):
+    return [chunks.chunk_digest(chunk) for chunk in splitter(io.BytesIO(data))]
+
+
+def test_chunks_stay_within_their_bounds():
+    data = _random_bytes(1024 * 1024)
+    pieces = list(chunks.split(io.BytesIO(data)))
+    assert b"".join(pieces) == data
+    assert all(chunks.MIN_CHUNK <= len(piece) <= chunks.MAX_CHUNK for piece in pieces[:-1])
+    assert chunks.MIN_CHUNK < len(data) / len(pieces) < chunks.MAX_CHUNK
+    assert list(chunks.split(io.BytesIO(b"tiny"))) == [b"tiny"]
+    assert list(chunks.split(io.BytesIO(b""))) == []
+
+
+def test_an_insertion_only_changes_the_chunks_around_it():
+    data = _random_bytes(512 * 1024)
+    edited = data[:200000] + b"inserted" * 10 + data[200000:]
+    old, new = _digests(data), _digests(edited)
+    assert len(set(new) - set(old)) <= 2
+    # Fixed blocks never line up again after an insertion
+    assert len(set(_digests(edited, chunks.split_fixed)) - set(_digests(data, chunks.split_fixed))) > 2
+
+
+def test_stored_files_share_their_chunks(tmp_path):
+    store = str(tmp_path / "store")
+    data = _random_bytes(300 * 1024)
+    first = make_file(str(tmp_path / "a.bin"), data)
+    second = make_file(str(tmp_path / "b.bin"), data[:100000] + b"edit" + data[100000:])
+    listed, written = chunks.store_file(store, first)
+    assert written > len(data)
+    assert sum(length for _, length in listed) == len(data)
+    listed, written = chunks.store_file(store, second)
+    assert written < 3 * chunks.MAX_CHUNK
+
+    # Over cdc_max_bytes files are cut into fixed blocks
+    listed, _ = chunks.store_file(store, first, cdc_max_bytes=1024)
+    assert [length for _, length in listed] == [chunks.MAX_CHUNK] * 4 + [len(data) - 4 * chunks.MAX_CHUNK]
+    assert b"".join(chunks.read_chunk(store, digest) for digest, _ in listed) == data
+
+    digest = listed[0][0]
+    with open(chunks.chunk_path(store, digest), "r+b") as file:
+        file.write(b"rgarbage")
+    with pytest.raises(OSError):
+        chunks.read_chunk(store, digest)
+
+
+def test_archive_restore_and_collect(tmp_path):
+    archive = str(tmp_path / "Archive")
+    shared = _random_bytes(100 * 1024)
+    sources = [make_file(str(tmp_path / "a.txt"), shared + b"a" * 50000),
+               make_file(str(tmp_path / "b.txt"), shared + _random_bytes(50000, seed=1))]
+    moves = []
+    for source in sources:
+        st = os.lstat(source)
+        moves.append(sweep.PlannedMove(source, os.path.join(archive, os.path.basename(source)), "test",
+                                       st.st_size, sweep.ARCHIVE, st.st_dev, st.st_dev, "t", st.st_mtime_ns))
+    results = list(chunks.ChunkArchiver(workers=1).archive(moves))
+    assert all(error is None for _, error in results)
+    assert sorted(os.listdir(archive)) == [chunks.STORE_NAME, "a.txt.chunks", "b.txt.chunks"]
+    assert not any(os.path.lexists(source) for source in sources)
+    before = chunks.store_bytes(archive)
+
+    # Chunks b.txt shares with a.txt survive its manifest being deleted
+    os.unlink(os.path.join(archive, "b.txt.chunks"))
+    freed = chunks.collect_garbage(archive)
+    assert 0 < freed < before
+    assert chunks.store_bytes(archive) == before - freed
+    assert chunks.restore(os.path.join(archive, "a.txt.chunks")) == sources[0]
+    assert read(sources[0]) == shared + b"a" * 50000
+    assert os.stat(sources[0]).st_mtime_ns == moves[0].mtime_ns
@@ -0,0 +1,58 @@
+from classifier import ExtensionIndex, KeywordMatcher
+
+FOLDERS = {
+    "Documents": [".pdf", ".txt"],
+    "Archives": [".zip", ".gz", ".tar.gz"],
+    "Backups": [".tar.gz.bak", ".txt"],
+}
+
+
+def test_extensions_map_to_their_category():
+    index = ExtensionIndex(FOLDERS)
+    assert index.category_for("report.pdf") == "Documents"
+    assert index.category_for("REPORT.PDF") == "Documents"
+    assert index.category_for(".zip") == "Archives"
+    assert index.category_for("notes") == "Others"
+    assert index.category_for("photo.jpeg") == "Others"
+    assert ExtensionIndex(FOLDERS, default="Misc").category_for("photo.jpeg") == "Misc"
+
+
+def test_the_longest_suffix_wins():
+    index = ExtensionIndex(FOLDERS)
+    assert index.category_for("logs.gz") == "Archives"
+    assert index.category_for("site.tar.gz") == "Archives"
+    assert index.category_for("site.tar.gz.bak") == "Backups"
+    # An unknown outer suffix is not skipped over
+    assert index.category_for("site.tar.gz.old") == "Others"
+    # Segments of the stem are never taken for an extension
+    assert index.category_for("tar.gz") == "Archives"
+    assert index.category_for("gz") == "Others"
+
+
+def test_the_first_category_listing_a_suffix_keeps_it():
+    assert ExtensionIndex(FOLDERS).category_for("a.txt") == "Documents"
+
+
+def test_keywords_of_every_rule_set_match_in_one_pass():
+    matcher = KeywordMatcher({
+        "sorting_rules": {"Finance": ["invoice", "receipt"], "Work": ["meeting"]},
+        "screenshots": {"Meeting": ["meeting", "call"]},
+    })
+    assert matcher.match("Invoice_March.pdf") == {"sorting_rules": "Finance"}
+    assert matcher.match("team MEETING notes") == {"sorting_rules": "Work", "screenshots": "Meeting"}
+    assert matcher.match("holiday.jpg") == {}
+
+
+def test_the_first_label_in_config_order_wins():
+    matcher = KeywordMatcher({"sorting_rules": {"Finance": ["invoice"], "Work": ["work"]}})
+    # Work matches first in the name, but Finance comes first in the config
+    assert matcher.match("work_invoice.pdf") == {"sorting_rules": "Finance"}
+
+
+def test_overlapping_keywords_are_all_found():
+    # "she" ends inside "ushers" and "he" inside "she", through failure links
+    matcher = KeywordMatcher({"rules": {"A": ["hers"], "B": ["she"], "C": ["he"]}})
+    assert matcher.match("ushers") == {"rules": "A"}
+    assert matcher.match("ushe") == {"rules": "B"}
+    assert matcher.match("uhe") == {"rules": "C"}
+    assert KeywordMatcher({"rules": {"A": [""]}}).match("anything") == {}
@@ -0,0 +1,74 @@
+import os
+
+import content
+import sweep
+from conftest import make_file, read
+
+RULES = {"Finance": ["invoice", "statement"], "Projects": ["proposal"]}
+
+
+# A minimal PDF with one page per text
+def _pdf(texts):
+    count = len(texts)
+    kids = " ".join(f"{3 + 2 * n} 0 R" for n in range(count))
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>",
+               f"<< /Type /Pages /Kids [{kids}] /Count {count} >>".encode()]
+    for n, text in enumerate(texts):
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode()
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {4 + 2 * n} 0 R"
+                       f" /Resources << /Font << /F1 << /Type /Font /Subtype /Type1 /BaseFont /Helvetica >> >> >>"
+                       f" >>".encode())
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+    data, offsets = b"%PDF-1.4\n", []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(data))
+        data += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(data)
+    data += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    data += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    data += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return data
+
+
+def test_texts_and_pdfs_are_read_for_keywords(tmp_path):
+    content._init_worker(RULES)
+    notes = make_file(str(tmp_path / "notes.txt"), b"x" * 1000 + b" Monthly STATEMENT")
+    scan = make_file(str(tmp_path / "Document (3).pdf"), _pdf(["Cover page", "Project proposal"]))
+    assert content._classify(notes, 20, 1 << 20) == "Finance"
+    assert content._classify(scan, 20, 1 << 20) == "Projects"
+    # Not past max_pages or max_bytes
+    assert content._classify(notes, 20, 500) == ""
+    assert content._classify(scan, 1, 1 << 20) == ""
+    # A keyword split across two blocks still matches
+    split = make_file(str(tmp_path / "split.txt"), b"x" * (content._BLOCK - 3) + b"invoice")
+    assert content._classify(split, 20, 1 << 20) == "Finance"
+    assert content._classify(make_file(str(tmp_path / "broken.pdf"), b"%PDF-1.4 broken"), 20, 1 << 20) == ""
+
+
+def test_results_are_cached_by_content(tmp_path, make_config, monkeypatch):
+    config = make_config(sorting_rules=RULES, content_rules={"workers": 1})
+    paths = [make_file(str(tmp_path / name), data) for name, data in
+             (("a.txt", b"an invoice"), ("copy.txt", b"an invoice"), ("b.txt", b"nothing"))]
+    files = [(path, os.stat(path)) for path in paths]
+    classifier = sweep.content_classifier(config)
+    assert classifier.classify(files) == {paths[0]: "Finance", paths[1]: "Finance"}
+
+    def unparsed(*args):
+        raise AssertionError("a file was parsed again")
+    with monkeypatch.context() as patch:
+        patch.setattr(content, "ProcessPoolExecutor", unparsed)
+        assert sweep.content_classifier(config).classify(files) == {paths[0]: "Finance", paths[1]: "Finance"}
+    # Other rules start afresh
+    rules = dict(RULES, Finance=["nothing"])
+    other = sweep.content_classifier(make_config(sorting_rules=rules, content_rules={"workers": 1}))
+    assert other.classify(files) == {paths[2]: "Finance"}
+
+
+def test_sweeps_route_files_by_their_contents(tmp_path, make_config):
+    make_file(str(tmp_path / "one" / "Document (3).pdf"), _pdf(["Invoice 2024-118"]))
+    make_file(str(tmp_path / "one" / "invoice.txt"), b"named")
+    config = make_config(sorting_rules=RULES, content_rules={"workers": 1})
+
+    assert sweep.run_sweep([sweep.SweepRoot(str(tmp_path / "one"))], sweep.Router(config))[sweep.ORGANIZE] == 2
+    assert read(str(tmp_path / "one" / "Finance" / "Document (3).pdf"))[:5] == b"%PDF-"
+    assert read(str(tmp_path / "one" / "Finance" / "invoice.txt")) == b"named"
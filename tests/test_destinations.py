@@ -0,0 +1,30 @@
+import os
+
+from conftest import make_file
+from destinations import DestinationCache
+
+
+def test_names_are_allocated_around_existing_and_reserved_ones(tmp_path):
+    make_file(str(tmp_path / "report.pdf"), b"r")
+    cache = DestinationCache()
+    folder = str(tmp_path)
+
+    assert cache.allocate(folder, "notes.txt", "t") == str(tmp_path / "notes.txt")
+    assert cache.allocate(folder, "notes.txt", "t") == str(tmp_path / "notes_t.txt")
+    assert cache.allocate(folder, "notes.txt", "t") == str(tmp_path / "notes_t_2.txt")
+    # Case-insensitive volumes would clash on these
+    assert cache.allocate(folder, "Report.PDF", "t") == str(tmp_path / "Report_t.PDF")
+    assert cache.entry_count(folder) == 5
+    # Planning creates nothing
+    assert os.listdir(tmp_path) == ["report.pdf"]
+
+
+def test_each_folder_is_listed_once(tmp_path):
+    cache = DestinationCache()
+    folder = str(tmp_path / "Documents")
+    assert cache.allocate(folder, "a.txt", "t") == os.path.join(folder, "a.txt")
+    # Created after it was listed: the cache still answers from its listing
+    make_file(os.path.join(folder, "b.txt"), b"b")
+    assert cache.allocate(folder, "b.txt", "t") == os.path.join(folder, "b.txt")
+    # A folder yet to be created is on the device of its nearest parent
+    assert cache.device_of(str(tmp_path / "New" / "Deeper")) == os.stat(tmp_path).st_dev
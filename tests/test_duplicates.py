@@ -0,0 +1,151 @@
+import os
+
+import pytest
+
+import duplicates
+import journal
+import scanner
+import sweep
+import undo
+from conftest import make_file, read
+
+
+def _sweep(config, root, journal_dir):
+    return sweep.run_sweep([root], sweep.Router(config), journal_dir=journal_dir)
+
+
+def test_duplicates_removed_by_a_sweep(tmp_path, make_config, journal_dir):
+    make_file(str(tmp_path / "one" / "a.txt"), b"same")
+    make_file(str(tmp_path / "one" / "b.txt"), b"same")
+    make_file(str(tmp_path / "one" / "Documents" / "c.txt"), b"other")
+    config = make_config(duplicates={"policy": "remove"})
+    counts = _sweep(config, sweep.SweepRoot(str(tmp_path / "one")), journal_dir)
+
+    assert counts[sweep.ORGANIZE] == 2
+    assert sorted(os.listdir(tmp_path / "one")) == ["Documents"]
+    # Whichever copy was scanned first is kept
+    run = journal.read_run(journal.run_path(journal_dir, counts["run_id"]))
+    (removed,) = [move[1] for move in run.moves.values() if move[2] is None and move[3] == "D"]
+    kept = ({"a.txt", "b.txt"} - {os.path.basename(removed)}).pop()
+    assert sorted(os.listdir(tmp_path / "one" / "Documents")) == sorted([kept, "c.txt"])
+
+    result = undo.undo_run(journal_dir)
+    assert result["restored"] == 1
+    assert result["skipped"] == [{"path": removed, "reason": "removed as a duplicate"}]
+    assert read(str(tmp_path / "one" / kept)) == b"same"
+    assert not os.path.lexists(removed)
+    assert read(str(tmp_path / "one" / "Documents" / "c.txt")) == b"other"
+
+
+def test_duplicate_of_a_file_already_in_place_is_removed(tmp_path, make_config, journal_dir):
+    make_file(str(tmp_path / "one" / "a.txt"), b"same")
+    kept = make_file(str(tmp_path / "one" / "Documents" / "kept.txt"), b"same")
+    config = make_config(duplicates={"policy": "remove"})
+    _sweep(config, sweep.SweepRoot(str(tmp_path / "one")), journal_dir)
+
+    assert sorted(os.listdir(tmp_path / "one")) == ["Documents"]
+    assert os.listdir(tmp_path / "one" / "Documents") == ["kept.txt"]
+    assert read(kept) == b"same"
+
+
+def test_duplicates_hardlinked_by_a_sweep(tmp_path, make_config, journal_dir):
+    make_file(str(tmp_path / "one" / "a.txt"), b"same")
+    make_file(str(tmp_path / "one" / "b.txt"), b"same")
+    config = make_config(duplicates={"policy": "hardlink"})
+    counts = _sweep(config, sweep.SweepRoot(str(tmp_path / "one")), journal_dir)
+
+    assert counts[sweep.ORGANIZE] == 2
+    documents = tmp_path / "one" / "Documents"
+    assert os.path.samestat(os.lstat(documents / "a.txt"), os.lstat(documents / "b.txt"))
+
+    result = undo.undo_run(journal_dir)
+    assert result["restored"] == 2 and result["skipped"] == []
+    assert read(str(tmp_path / "one" / "a.txt")) == b"same"
+    assert read(str(tmp_path / "one" / "b.txt")) == b"same"
+    assert not os.path.lexists(documents)
+
+
+def test_hardlink_follows_a_rerouted_kept_copy(tmp_path, make_config, journal_dir):
+    make_file(str(tmp_path / "one" / "a.txt"), b"same")
+    make_file(str(tmp_path / "one" / "b.txt"), b"same")
+    router = sweep.Router(make_config(duplicates={"policy": "hardlink"}))
+    plan = sweep.plan_sweep([sweep.SweepRoot(str(tmp_path / "one"))], router)
+    (kept,) = [move for move in plan.moves if move.duplicate_of is None]
+    (duplicate,) = [move for move in plan.moves if move.duplicate_of is not None]
+    # The kept copy's name is taken between planning and execution
+    foreign = make_file(kept.destination, b"someone else's")
+
+    counts = sweep.execute_plan(plan, journal_dir)
+    assert counts[sweep.ORGANIZE] == 2
+    assert read(foreign) == b"someone else's"
+    # The duplicate is linked to the kept copy under its new name
+    documents = tmp_path / "one" / "Documents"
+    (moved,) = set(os.listdir(documents)) - {os.path.basename(foreign), os.path.basename(duplicate.destination)}
+    assert os.path.samestat(os.lstat(documents / moved), os.lstat(duplicate.destination))
+    assert read(duplicate.destination) == b"same"
+
+
+def test_hardlink_to_a_bundled_kept_copy_leaves_the_duplicate(tmp_path, make_config, journal_dir):
+    downloads = tmp_path / "Downloads"
+    files = [make_file(str(downloads / name), b"same" * 100) for name in ("a.txt", "b.txt")]
+    config = make_config(duplicates={"policy": "hardlink"}, bundles={"enabled": True, "workers": 1})
+    root = sweep.SweepRoot(str(downloads), organize=False, archive_dir=str(downloads / "Archive"))
+    counts = sweep.run_sweep([root], sweep.Router(config), journal_dir=journal_dir, bundler=sweep.bundler(config))
+
+    # There is nothing to link to in a bundle, so the duplicate waits for the next sweep
+    assert counts[sweep.ARCHIVE] == 1
+    (left,) = [path for path in files if os.path.lexists(path)]
+    assert read(left) == b"same" * 100
+    run = journal.read_run(journal.run_path(journal_dir, counts["run_id"]))
+    assert sorted(move[3] for move in run.moves.values()) == ["D", "F"]
+
+
+@pytest.mark.parametrize("noatime", [True, False])
+def test_hashing_leaves_access_times_alone(tmp_path, monkeypatch, noatime):
+    if not noatime:
+        # Where O_NOATIME is unavailable or refused, the atime is put back
+        monkeypatch.setattr(scanner, "_NOATIME", 0)
+    data = os.urandom(3 * duplicates.BLOCK)
+    paths = [make_file(str(tmp_path / name), data) for name in ("a.bin", "b.bin")]
+    atimes = [os.stat(path).st_atime_ns for path in paths]
+
+    result = duplicates.report(duplicates.DuplicateFinder(), [str(tmp_path)])
+    assert [group["paths"] for group in result["groups"]] == [sorted(paths)]
+    assert [os.stat(path).st_atime_ns for path in paths] == atimes
+
+
+def _planned(source, destination):
+    st = os.lstat(source)
+    return sweep.PlannedMove(source, destination, "test", st.st_size, sweep.ORGANIZE, st.st_dev, st.st_dev, "t",
+                             st.st_mtime_ns)
+
+
+def test_the_first_planned_copy_is_kept(tmp_path):
+    sources = [make_file(str(tmp_path / "in" / f"{n}.txt"), b"same") for n in (3, 1, 2)]
+    moves = tuple(_planned(source, str(tmp_path / "out" / os.path.basename(source))) for source in sources)
+    finder = duplicates.DuplicateFinder()
+
+    assert duplicates.apply_policy(finder, moves, "skip") == moves[:1]
+    kept, *removed = duplicates.apply_policy(finder, moves, "remove")
+    assert kept == moves[0]
+    assert [(move.source, move.destination, move.duplicate_of) for move in removed] == \
+        [(source, None, moves[0].destination) for source in sources[1:]]
+    assert duplicates.apply_policy(finder, moves, "off") == moves
+
+
+def test_groups_need_identical_contents(tmp_path):
+    block = duplicates.BLOCK
+    head, tail = os.urandom(block), os.urandom(block)
+    files = {
+        "a": head + b"middle" + tail,
+        "b": head + b"middle" + tail,
+        # Same size and ends, so only the full hash tells it apart
+        "c": head + b"MIDDLE" + tail,
+        "d": os.urandom(len(head + b"middle" + tail)),
+        "e": b"",
+        "f": b"",
+    }
+    paths = {name: make_file(str(tmp_path / name), data) for name, data in files.items()}
+    stats = [(path, os.lstat(path)) for path in paths.values()]
+
+    assert duplicates.DuplicateFinder().groups(stats) == [[paths["a"], paths["b"]]]
@@ -0,0 +1,69 @@
+import threading
+import time
+
+import pytest
+
+import mover
+from conftest import make_file, read
+from executor import AdaptiveExecutor, InlineExecutor
+
+
+def test_results_and_errors_come_back_through_futures():
+    def task(n):
+        if n == 3:
+            raise ValueError(n)
+        return n * n
+
+    with AdaptiveExecutor(max_workers=4) as pool:
+        futures = [pool.submit(task, n) for n in range(10)]
+        assert [future.result() for future in futures if not future.exception()] == \
+            [n * n for n in range(10) if n != 3]
+        with pytest.raises(ValueError):
+            futures[3].result()
+    assert pool.report()["tasks"] == 10
+    with pytest.raises(RuntimeError):
+        pool.submit(task, 1)
+
+
+def test_concurrency_grows_while_throughput_does():
+    # Sleeping tasks scale with every worker added
+    with AdaptiveExecutor(max_workers=8, initial_workers=1) as pool:
+        for future in [pool.submit(time.sleep, 0.005) for _ in range(300)]:
+            future.result()
+    report = pool.report()
+    assert report["peak_concurrency"] > 2
+    assert report["concurrency"] <= 8
+
+
+def test_concurrency_halves_when_latency_climbs():
+    pool = AdaptiveExecutor(max_workers=8, initial_workers=8)
+    with pool._condition:
+        pool._window_started = time.perf_counter()
+        for _ in range(16):
+            pool._record(0.01)
+        assert pool._limit == 8
+        # Twice the best latency and more: the device is saturated
+        for _ in range(16):
+            pool._record(0.05)
+        assert pool._limit == 4
+    pool.shutdown()
+
+
+def test_inline_tasks_run_on_the_calling_thread():
+    pool = InlineExecutor()
+    assert pool.run(threading.get_ident) == threading.get_ident()
+    with pytest.raises(ZeroDivisionError):
+        pool.run(lambda: 1 / 0)
+    assert pool.report()["tasks"] == 2 and pool.report()["concurrency"] == 1
+
+
+def test_only_copies_go_to_a_pool(tmp_path):
+    make_file(str(tmp_path / "a.txt"), b"a")
+    make_file(str(tmp_path / "b.txt"), b"b")
+    with mover.MoveEngine() as engine:
+        assert engine.submit(str(tmp_path), "a.txt", str(tmp_path / "a2.txt"), None, 1, 1) is None
+        # Devices that differ get a copy on the pair's pool
+        future = engine.submit(str(tmp_path), "b.txt", str(tmp_path / "b2.txt"), None, 1, 2)
+        future.result()
+    assert read(str(tmp_path / "a2.txt")) == b"a" and read(str(tmp_path / "b2.txt")) == b"b"
+    assert sorted(report["executor"] for report in engine.report()) == ["move-1-1", "move-1-2"]
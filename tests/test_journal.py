@@ -0,0 +1,253 @@
+import json
+import os
+import time
+
+import journal
+import mover
+import sweep
+from conftest import make_file, read
+
+
+def _move(source, destination, kind=sweep.ORGANIZE):
+    st = os.lstat(source)
+    return sweep.PlannedMove(source, destination, "test", st.st_size, kind, st.st_dev, st.st_dev, "t",
+                             st.st_mtime_ns)
+
+
+# Journal moves as a run whose process died right after committing their
+# intents: the log is left without completions, an end record or a lock
+def _crashed_run(journal_dir, moves, backend=None):
+    run_journal = journal.Journal(journal_dir)
+    for seq, move in enumerate(moves):
+        run_journal.intent(seq, move, backend)
+    run_journal.commit()
+    os.close(run_journal._fd)
+    return run_journal.run_id
+
+
+def _run(journal_dir, run_id):
+    return journal.read_run(journal.run_path(journal_dir, run_id))
+
+
+def test_intent_only_is_replayed(tmp_path, journal_dir):
+    source = make_file(str(tmp_path / "in" / "a.txt"), b"contents")
+    destination = str(tmp_path / "out" / "a.txt")
+    run_id = _crashed_run(journal_dir, [_move(source, destination)])
+
+    assert journal.recover(journal_dir)[sweep.ORGANIZE] == 1
+    assert not os.path.lexists(source)
+    assert read(destination) == b"contents"
+    run = _run(journal_dir, run_id)
+    assert run.moves[0][3] == "D"
+    assert run.counts == {sweep.ORGANIZE: 1, sweep.ARCHIVE: 0, sweep.SCREENSHOT: 0}
+    assert journal.load_stats(journal_dir)[sweep.ORGANIZE] == 1
+
+
+def test_crash_between_link_and_unlink(tmp_path, journal_dir):
+    source = make_file(str(tmp_path / "in" / "a.txt"), b"contents")
+    destination = str(tmp_path / "out" / "a.txt")
+    run_id = _crashed_run(journal_dir, [_move(source, destination)])
+    os.makedirs(os.path.dirname(destination))
+    os.link(source, destination)
+
+    assert journal.recover(journal_dir)[sweep.ORGANIZE] == 1
+    assert not os.path.lexists(source)
+    assert read(destination) == b"contents"
+    assert _run(journal_dir, run_id).moves[0][3] == "D"
+
+
+def test_crash_mid_copy_discards_the_partial_file(tmp_path, journal_dir):
+    source = make_file(str(tmp_path / "in" / "a.txt"), b"contents")
+    destination = str(tmp_path / "out" / "a.txt")
+    _crashed_run(journal_dir, [_move(source, destination)])
+    partial = mover.partial_path(destination)
+    make_file(partial, b"cont")
+
+    journal.recover(journal_dir)
+    assert not os.path.lexists(partial)
+    assert not os.path.lexists(source)
+    assert read(destination) == b"contents"
+
+
+def test_crash_after_publishing_the_copy(tmp_path, journal_dir):
+    source = make_file(str(tmp_path / "in" / "a.txt"), b"contents")
+    destination = str(tmp_path / "out" / "a.txt")
+    _crashed_run(journal_dir, [_move(source, destination)])
+    partial = make_file(mover.partial_path(destination), b"contents")
+    os.link(partial, destination)
+
+    journal.recover(journal_dir)
+    assert not os.path.lexists(partial)
+    assert not os.path.lexists(source)
+    assert read(destination) == b"contents"
+
+
+def test_finished_move_with_lost_completion(tmp_path, journal_dir):
+    source = make_file(str(tmp_path / "in" / "a.txt"), b"contents")
+    destination = str(tmp_path / "out" / "a.txt")
+    run_id = _crashed_run(journal_dir, [_move(source, destination)])
+    os.makedirs(os.path.dirname(destination))
+    os.rename(source, destination)
+
+    assert journal.recover(journal_dir)[sweep.ORGANIZE] == 1
+    assert read(destination) == b"contents"
+    assert _run(journal_dir, run_id).moves[0][3] == "D"
+
+
+def test_foreign_file_at_destination_is_kept(tmp_path, journal_dir):
+    source = make_file(str(tmp_path / "in" / "a.txt"), b"ours")
+    destination = str(tmp_path / "out" / "a.txt")
+    run_id = _crashed_run(journal_dir, [_move(source, destination)])
+    make_file(destination, b"someone else's")
+
+    assert journal.recover(journal_dir)[sweep.ORGANIZE] == 1
+    assert read(destination) == b"someone else's"
+    recovered = str(tmp_path / "out" / "a_recovered.txt")
+    assert read(recovered) == b"ours"
+    assert not os.path.lexists(source)
+    # The new destination was journaled, so an undo finds the file there
+    run = _run(journal_dir, run_id)
+    assert run.moves[0][2] == recovered
+    assert run.moves[0][3] == "D"
+
+
+def test_foreign_file_next_to_our_partial_copy_is_kept(tmp_path, journal_dir):
+    source = make_file(str(tmp_path / "in" / "a.txt"), b"ours")
+    destination = str(tmp_path / "out" / "a.txt")
+    _crashed_run(journal_dir, [_move(source, destination)])
+    partial = make_file(mover.partial_path(destination), b"ou")
+    make_file(destination, b"someone else's")
+
+    journal.recover(journal_dir)
+    assert not os.path.lexists(partial)
+    assert read(destination) == b"someone else's"
+    assert read(str(tmp_path / "out" / "a_recovered.txt")) == b"ours"
+
+
+def test_identical_copy_at_destination_completes_the_move(tmp_path, journal_dir):
+    source = make_file(str(tmp_path / "in" / "a.txt"), b"contents")
+    destination = make_file(str(tmp_path / "out" / "a.txt"), b"contents")
+    _crashed_run(journal_dir, [_move(source, destination)])
+
+    journal.recover(journal_dir)
+    assert not os.path.lexists(source)
+    assert os.listdir(os.path.dirname(destination)) == ["a.txt"]
+
+
+def test_deletions_are_never_replayed(tmp_path, journal_dir):
+    source = make_file(str(tmp_path / "in" / "a.txt"), b"contents")
+    run_id = _crashed_run(journal_dir, [_move(source, None)])
+
+    assert journal.recover(journal_dir)[sweep.ORGANIZE] == 0
+    assert read(source) == b"contents"
+    assert _run(journal_dir, run_id).moves[0][3] == "F"
+
+
+def test_packed_moves_are_settled_by_their_source(tmp_path, journal_dir):
+    kept = make_file(str(tmp_path / "in" / "kept.txt"), b"kept")
+    packed = make_file(str(tmp_path / "in" / "packed.txt"), b"packed")
+    archive = str(tmp_path / "Archive")
+    moves = [_move(kept, os.path.join(archive, "kept.txt"), sweep.ARCHIVE),
+             _move(packed, os.path.join(archive, "packed.txt"), sweep.ARCHIVE)]
+    run_id = _crashed_run(journal_dir, moves, "bundle")
+    os.unlink(packed)
+
+    assert journal.recover(journal_dir)[sweep.ARCHIVE] == 1
+    assert read(kept) == b"kept"
+    assert not os.path.lexists(archive)
+    run = _run(journal_dir, run_id)
+    assert [run.moves[seq][3] for seq in (0, 1)] == ["F", "D"]
+
+
+def test_live_runs_are_left_alone(tmp_path, journal_dir):
+    source = make_file(str(tmp_path / "in" / "a.txt"), b"contents")
+    run_journal = journal.Journal(journal_dir)
+    run_journal.intent(0, _move(source, str(tmp_path / "out" / "a.txt")))
+    run_journal.commit()
+
+    assert journal.recover(journal_dir)[sweep.ORGANIZE] == 0
+    assert read(source) == b"contents"
+    run_journal.close({sweep.ORGANIZE: 0})
+    assert _run(journal_dir, run_journal.run_id).moves[0][3] is None
+
+
+def test_recovery_runs_once(tmp_path, journal_dir):
+    source = make_file(str(tmp_path / "in" / "a.txt"), b"contents")
+    run_id = _crashed_run(journal_dir, [_move(source, str(tmp_path / "out" / "a.txt"))])
+    journal.recover(journal_dir)
+    log = read(journal.run_path(journal_dir, run_id))
+
+    assert journal.recover(journal_dir)[sweep.ORGANIZE] == 0
+    assert read(journal.run_path(journal_dir, run_id)) == log
+
+
+def test_torn_last_line_is_recovered(tmp_path, journal_dir):
+    source = make_file(str(tmp_path / "in" / "a.txt"), b"contents")
+    destination = str(tmp_path / "out" / "a.txt")
+    run_id = _crashed_run(journal_dir, [_move(source, destination)])
+    with open(journal.run_path(journal_dir, run_id), "a") as log:
+        log.write('["D",')
+
+    journal.recover(journal_dir)
+    assert read(destination) == b"contents"
+
+
+def test_old_finished_logs_are_pruned(tmp_path, journal_dir):
+    source = make_file(str(tmp_path / "in" / "a.txt"), b"contents")
+    old = journal.Journal(journal_dir)
+    old.intent(0, _move(source, None))
+    old.close({sweep.ORGANIZE: 0})
+    then = time.time() - (journal.KEEP_DAYS + 1) * 86400
+    os.utime(old.path, (then, then))
+    recent = journal.Journal(journal_dir)
+    recent.intent(0, _move(source, None))
+    recent.close({sweep.ORGANIZE: 0})
+
+    journal.recover(journal_dir)
+    assert not os.path.lexists(old.path)
+    assert os.path.lexists(recent.path)
+
+
+def test_finished_runs_are_recognised_by_their_last_record(tmp_path, journal_dir):
+    source = make_file(str(tmp_path / "in" / "a.txt"), b"contents")
+    finished = journal.Journal(journal_dir)
+    finished.intent(0, _move(source, str(tmp_path / "out" / "a.txt")))
+    finished.close({sweep.ORGANIZE: 0})
+    undone = journal.Journal(journal_dir)
+    undone.intent(0, _move(source, str(tmp_path / "out" / "a.txt")))
+    undone.close({sweep.ORGANIZE: 0})
+    journal.mark_undone(journal_dir, undone.run_id, journal.new_run_id())
+
+    for run_journal in (finished, undone):
+        fd = os.open(run_journal.path, os.O_RDONLY)
+        try:
+            assert journal._finished(fd)
+        finally:
+            os.close(fd)
+    # Neither is replayed, though its move has no completion record
+    journal.recover(journal_dir)
+    assert read(source) == b"contents"
+
+
+def test_run_ids_sort_in_start_order():
+    run_ids = [journal.new_run_id() for _ in range(1000)]
+    assert sorted(run_ids) == run_ids
+    assert len(set(run_ids)) == len(run_ids)
+
+
+def test_rerouted_intent_is_durable_before_the_move(tmp_path, journal_dir, monkeypatch):
+    source = make_file(str(tmp_path / "in" / "a.txt"), b"ours")
+    destination = str(tmp_path / "out" / "a.txt")
+    run_id = _crashed_run(journal_dir, [_move(source, destination)])
+    make_file(destination, b"someone else's")
+    logged = []
+
+    def crash(*args, **kwargs):
+        with open(journal.run_path(journal_dir, run_id)) as log:
+            logged.extend(json.loads(line) for line in log)
+        raise OSError("crashed")
+    monkeypatch.setattr(mover, "move", crash)
+
+    journal.recover(journal_dir)
+    assert logged[-1][:5] == ["I", 0, sweep.ORGANIZE, source, str(tmp_path / "out" / "a_recovered.txt")]
+    assert read(source) == b"ours"
@@ -0,0 +1,73 @@
+import errno
+import os
+
+import pytest
+
+import mover
+from conftest import make_file, read
+
+
+@pytest.mark.parametrize("same_device", [True, False])
+def test_moves_never_replace_an_existing_file(tmp_path, same_device):
+    source = make_file(str(tmp_path / "in" / "a.txt"), b"ours")
+    target = make_file(str(tmp_path / "out" / "a.txt"), b"theirs")
+
+    with pytest.raises(FileExistsError):
+        mover.move(str(tmp_path / "in"), "a.txt", target, same_device=same_device)
+    assert read(source) == b"ours" and read(target) == b"theirs"
+    assert os.listdir(tmp_path / "out") == ["a.txt"]
+
+
+def test_same_device_move_relative_to_a_directory_descriptor(tmp_path):
+    source = make_file(str(tmp_path / "in" / "a.txt"), b"a")
+    inode = os.stat(source).st_ino
+    target = str(tmp_path / "out.txt")
+    fd = os.open(tmp_path / "in", os.O_RDONLY)
+    try:
+        mover.move(str(tmp_path / "in"), "a.txt", target, dir_fd=fd)
+    finally:
+        os.close(fd)
+    assert not os.path.lexists(source)
+    # A rename: the same inode, no data copied
+    assert os.stat(target).st_ino == inode
+
+
+@pytest.mark.parametrize("kernel_copy", [True, False])
+def test_cross_device_copy_keeps_contents_and_metadata(tmp_path, monkeypatch, kernel_copy):
+    monkeypatch.setattr(mover, "COPY_CHUNK", 1000)
+    if not kernel_copy:
+        monkeypatch.setattr(mover, "_KERNEL_COPIES", [])
+    data = os.urandom(4500)
+    source = make_file(str(tmp_path / "in" / "a.bin"), data)
+    os.chmod(source, 0o640)
+    st = os.stat(source)
+    target = str(tmp_path / "out" / "a.bin")
+    os.mkdir(tmp_path / "out")
+
+    mover.move(str(tmp_path / "in"), "a.bin", target, same_device=False)
+    assert not os.path.lexists(source)
+    assert read(target) == data
+    copied = os.stat(target)
+    assert copied.st_ino != st.st_ino
+    assert copied.st_mtime_ns == st.st_mtime_ns
+    assert copied.st_mode == st.st_mode
+    assert os.listdir(tmp_path / "out") == ["a.bin"]
+
+
+def test_a_wrong_same_device_guess_falls_back_to_copying(tmp_path, monkeypatch):
+    def cross_device(*args):
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+    monkeypatch.setattr(mover, "_rename_noreplace", cross_device)
+    make_file(str(tmp_path / "a.txt"), b"a")
+
+    mover.move(str(tmp_path), "a.txt", str(tmp_path / "b.txt"))
+    assert os.listdir(tmp_path) == ["b.txt"]
+
+
+def test_symlinks_are_moved_as_links(tmp_path):
+    os.symlink("elsewhere.txt", tmp_path / "link.txt")
+    target = str(tmp_path / "moved.txt")
+
+    mover.move(str(tmp_path), "link.txt", target, same_device=False)
+    assert os.readlink(target) == "elsewhere.txt"
+    assert not os.path.lexists(tmp_path / "link.txt")
@@ -0,0 +1,116 @@
+import os
+import time
+
+import bundles
+import chunks
+import journal
+import retention
+import sweep
+import undo
+from conftest import make_file, read
+
+DAY = 86400
+
+
+# Archive files {name: data} from Downloads with config, recorded in its catalog
+def _archive(tmp_path, config, journal_dir, files):
+    downloads = tmp_path / "Downloads"
+    for name, data in files.items():
+        make_file(str(downloads / name), data)
+    archive_catalog = sweep.archive_catalog(config)
+    root = sweep.SweepRoot(str(downloads), organize=False, archive_dir=str(downloads / "Archive"))
+    sweep.run_sweep([root], sweep.Router(config), journal_dir=journal_dir, bundler=sweep.bundler(config),
+                    archive_catalog=archive_catalog)
+    return archive_catalog
+
+
+def test_expired_files_are_deleted_and_journaled(tmp_path, make_config, journal_dir):
+    archive_catalog = _archive(tmp_path, make_config(), journal_dir, {"a.txt": b"a", "b.jpg": b"bb"})
+    archive = tmp_path / "Downloads" / "Archive"
+    (expiring,) = archive_catalog.search(name="a.txt")
+
+    # Documents are kept a day, images a week
+    counts = retention.expire(archive_catalog, {"Documents": 1, "Images": 7}, None, journal_dir,
+                              now=time.time() + 2 * DAY)
+    assert counts[retention.EXPIRE] == 1 and counts["failed"] == 0 and counts["bytes"] == 1
+    assert os.listdir(archive) == ["b.jpg"]
+    assert [entry["name"] for entry in archive_catalog.search()] == ["b.jpg"]
+
+    run = journal.read_run(journal.run_path(journal_dir, counts["run_id"]))
+    assert list(run.moves.values()) == [[retention.EXPIRE, str(archive / "a.txt"), None, "D", 1,
+                                         expiring["mtime_ns"], None]]
+    # An expiry cannot be undone
+    result = undo.undo_run(journal_dir, counts["run_id"])
+    assert result["restored"] == 0
+    assert result["skipped"] == [{"path": str(archive / "a.txt"), "reason": "expired"}]
+
+
+def test_default_days_cover_unlisted_categories(tmp_path, make_config, journal_dir):
+    archive_catalog = _archive(tmp_path, make_config(), journal_dir, {"a.txt": b"a", "b.jpg": b"b"})
+
+    counts = retention.expire(archive_catalog, {"Images": 7}, 1, journal_dir, now=time.time() + 2 * DAY)
+    assert counts[retention.EXPIRE] == 1
+    assert os.listdir(tmp_path / "Downloads" / "Archive") == ["b.jpg"]
+
+
+def test_nothing_expires_before_its_time(tmp_path, make_config, journal_dir):
+    archive_catalog = _archive(tmp_path, make_config(), journal_dir, {"a.txt": b"a"})
+
+    counts = retention.expire(archive_catalog, {"Documents": 1}, None, journal_dir)
+    assert counts[retention.EXPIRE] == 0
+    assert "run_id" not in counts
+    assert read(str(tmp_path / "Downloads" / "Archive" / "a.txt")) == b"a"
+
+
+def test_files_changed_since_they_were_archived_are_kept(tmp_path, make_config, journal_dir):
+    archive_catalog = _archive(tmp_path, make_config(), journal_dir, {"a.txt": b"a"})
+    archived = str(tmp_path / "Downloads" / "Archive" / "a.txt")
+    with open(archived, "ab") as file:
+        file.write(b" edited")
+
+    counts = retention.expire(archive_catalog, {"Documents": 1}, None, journal_dir, now=time.time() + 2 * DAY)
+    assert counts[retention.EXPIRE] == 0 and counts["failed"] == 1
+    assert read(archived) == b"a edited"
+    assert len(archive_catalog.search()) == 1
+
+
+def test_expiry_pages_through_batches(tmp_path, make_config, journal_dir):
+    files = {f"{n}.txt": str(n).encode() for n in range(7)}
+    archive_catalog = _archive(tmp_path, make_config(), journal_dir, files)
+
+    counts = retention.expire(archive_catalog, {"Documents": 1}, None, journal_dir, now=time.time() + 2 * DAY,
+                              batch=3)
+    assert counts[retention.EXPIRE] == 7
+    assert os.listdir(tmp_path / "Downloads" / "Archive") == []
+    assert archive_catalog.search() == []
+
+
+def test_expired_bundle_members_are_dropped(tmp_path, make_config, journal_dir):
+    config = make_config(bundles={"enabled": True, "workers": 1})
+    archive_catalog = _archive(tmp_path, config, journal_dir, {"a.txt": b"a" * 100, "b.jpg": b"b" * 100})
+    (entry,) = archive_catalog.search(name="b.jpg")
+    month_dir = os.path.dirname(entry["location"])
+
+    counts = retention.expire(archive_catalog, {"Documents": 1}, None, journal_dir, now=time.time() + 2 * DAY)
+    assert counts[retention.EXPIRE] == 1
+    assert list(bundles.load_index(month_dir)["members"]) == ["b.jpg"]
+    restored = str(tmp_path / "restored.jpg")
+    bundles.restore(month_dir, "b.jpg", restored)
+    assert read(restored) == b"b" * 100
+
+    retention.expire(archive_catalog, {}, 1, journal_dir, now=time.time() + 2 * DAY)
+    assert not [name for name in os.listdir(month_dir) if name.endswith(".zip")]
+
+
+def test_expired_chunks_are_collected(tmp_path, make_config, journal_dir):
+    config = make_config(chunks={"enabled": True, "workers": 1})
+    archive_catalog = _archive(tmp_path, config, journal_dir, {"a.txt": os.urandom(20000)})
+    archive = str(tmp_path / "Downloads" / "Archive")
+    assert chunks.store_bytes(archive) > 0
+
+    counts = retention.expire(archive_catalog, {"Documents": 1}, None, journal_dir, now=time.time() + 2 * DAY)
+    assert counts[retention.EXPIRE] == 1
+    assert os.listdir(archive) == [chunks.STORE_NAME]
+    # Only the store's lock file is left
+    assert chunks.store_bytes(archive) == 0
+
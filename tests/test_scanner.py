@@ -0,0 +1,64 @@
+import os
+import stat
+
+import scanner
+from conftest import make_file
+
+
+def test_scan_lists_visible_files_and_collects_subdirectories(tmp_path):
+    make_file(str(tmp_path / "a.txt"), b"a")
+    make_file(str(tmp_path / ".hidden"), b"h")
+    make_file(str(tmp_path / "Documents" / "b.txt"), b"b")
+    os.symlink(tmp_path / "a.txt", tmp_path / "link.txt")
+    os.mkdir(tmp_path / ".cache")
+
+    subdirs = []
+    with scanner.open_dir(str(tmp_path)) as dir_fd:
+        entries = scanner.scan_files(str(tmp_path), dir_fd, subdirs=subdirs)
+        assert sorted(entry.name for entry in entries) == ["a.txt", "link.txt"]
+        # Entries listed through dir_fd stat() through it too
+        stats = {entry.name: entry.stat(follow_symlinks=False) for entry in entries}
+    assert subdirs == ["Documents"]
+    assert stats["a.txt"].st_size == 1
+    assert stat.S_ISLNK(stats["link.txt"].st_mode)
+
+    everything = scanner.scan_files(str(tmp_path), skip_hidden=False)
+    assert sorted(entry.name for entry in everything) == [".hidden", "a.txt", "link.txt"]
+
+
+def test_path_entry_behaves_like_a_dir_entry(tmp_path):
+    path = make_file(str(tmp_path / "a.txt"), b"abc")
+    (listed,) = scanner.scan_files(str(tmp_path))
+    entry = scanner.PathEntry(path)
+
+    assert entry.name == listed.name == "a.txt"
+    assert entry.is_file() and not entry.is_dir()
+    assert entry.inode() == listed.inode()
+    assert entry.stat().st_size == listed.stat().st_size == 3
+    # Cached like DirEntry.stat()
+    os.unlink(path)
+    assert entry.stat().st_size == 3
+    assert not scanner.PathEntry(path).is_file()
+
+
+def test_walk_tree_filters_and_never_loops(tmp_path):
+    for path in ("a/b/c/deep.txt", "a/top.txt", "Documents/d.txt", "x/Documents/e.txt", "skip/f.txt",
+                 ".git/g.txt"):
+        make_file(str(tmp_path / path), b"x")
+    os.symlink(tmp_path, tmp_path / "a" / "loop")
+
+    walk = scanner.walk_tree(str(tmp_path), 2, skip_names={"Documents"}, skip_paths=[str(tmp_path / "skip")],
+                             workers=3)
+    found = {os.path.relpath(directory, tmp_path): (sorted(entry.name for entry in files), sorted(subdirs))
+             for directory, dir_stat, files, subdirs in walk}
+    # Generated folders are only skipped directly below the root; depth 3 is out of reach,
+    # and the symlinked directory is listed but not entered
+    assert found == {"a": (["top.txt"], ["b", "loop"]), "a/b": ([], ["c"]), "x": ([], ["Documents"]),
+                     "x/Documents": (["e.txt"], [])}
+    assert scanner.walk_tree(str(tmp_path), 0) == []
+
+    followed = scanner.walk_tree(str(tmp_path), 5, follow_symlinks=True)
+    directories = [directory for directory, dir_stat, files, subdirs in followed]
+    # The symlink leads back to the root, which is never walked twice
+    assert str(tmp_path / "a" / "loop") not in directories
+    assert len(directories) == len({(st.st_dev, st.st_ino) for _, st, _, _ in followed})
@@ -0,0 +1,68 @@
+import os
+from datetime import datetime
+
+import pytest
+
+import shards
+import sweep
+from conftest import make_file, read
+from destinations import DestinationCache
+
+WHEN = datetime(2024, 3, 15)
+
+
+def test_layouts(tmp_path):
+    folder = str(tmp_path / "Documents")
+    cache = DestinationCache()
+    prefixes = shards._prefixes("Report.pdf")
+    assert shards._prefixes("REPORT.PDF") == prefixes
+
+    assert shards.ShardLayout().folder_for(folder, "Report.pdf", WHEN, cache) == folder
+    assert shards.ShardLayout(shards.MONTH).folder_for(folder, "Report.pdf", WHEN, cache) == \
+        os.path.join(folder, "2024", "03")
+    assert shards.ShardLayout(shards.HASH).folder_for(folder, "Report.pdf", WHEN, cache) == \
+        os.path.join(folder, prefixes[0])
+    with pytest.raises(ValueError):
+        shards.ShardLayout("weekly")
+    layout = shards.layout({"shards": {"archive": shards.HASH, "max_entries": 10}}, "archive")
+    assert (layout.kind, layout.max_entries) == (shards.HASH, 10)
+    assert shards.layout({}, "folders").kind == shards.FLAT
+
+
+def test_full_shards_overflow_into_sub_shards(tmp_path):
+    month = tmp_path / "Documents" / "2024" / "03"
+    for name in ("a.txt", "b.txt"):
+        make_file(str(month / name), b"x")
+    layout = shards.ShardLayout(shards.MONTH, max_entries=2)
+    cache = DestinationCache()
+
+    first = layout.folder_for(str(tmp_path / "Documents"), "c.txt", WHEN, cache)
+    assert first == str(month / shards._prefixes("c.txt")[0])
+    # Names reserved by the sweep count too
+    for n in range(2):
+        cache.allocate(first, f"c{n}.txt", "t")
+    name = next(name for name in (f"d{n}.txt" for n in range(1000))
+                if shards._prefixes(name)[0] == shards._prefixes("c.txt")[0])
+    assert layout.folder_for(str(tmp_path / "Documents"), name, WHEN, cache) == \
+        os.path.join(first, shards._prefixes(name)[1])
+
+
+def test_sweeps_file_into_shards(tmp_path, make_config):
+    make_file(str(tmp_path / "one" / "a.txt"), b"a")
+    config = make_config(shards={"folders": shards.MONTH})
+    now = datetime.now()
+
+    assert sweep.run_sweep([sweep.SweepRoot(str(tmp_path / "one"))], sweep.Router(config), now)[sweep.ORGANIZE] == 1
+    assert read(str(tmp_path / "one" / "Documents" / now.strftime("%Y") / now.strftime("%m") / "a.txt")) == b"a"
+
+
+def test_listing_pages_through_files(tmp_path):
+    for name in ("c.txt", "a.txt", "b.txt", ".hidden"):
+        make_file(str(tmp_path / name), b"x")
+    os.mkdir(tmp_path / "2024")
+
+    page = shards.listing(str(tmp_path), limit=2)
+    assert page["folders"] == ["2024"]
+    assert [file["name"] for file in page["files"]] == ["a.txt", "b.txt"] and page["more"]
+    page = shards.listing(str(tmp_path), limit=2, after="b.txt")
+    assert [file["name"] for file in page["files"]] == ["c.txt"] and not page["more"]
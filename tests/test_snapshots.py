@@ -0,0 +1,104 @@
+import os
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import scanner
+import snapshots
+import sweep
+from conftest import AGE, make_file, read
+
+
+# Date directory's mtime AGE seconds back, so a snapshot may trust it
+def _settle(directory):
+    then = time.time() - AGE
+    os.utime(directory, (then, then))
+
+
+@pytest.mark.parametrize("settings", [
+    {"shards": {"folders": "month"}},
+    {"duplicates": {"policy": "skip"}},
+    {"sniff": True},
+    {"content_rules": {"enabled": False, "max_pages": 1}},
+])
+def test_routing_config_changes_the_fingerprint(make_config, settings):
+    assert sweep.Router(make_config(**settings)).fingerprint != sweep.Router(make_config()).fingerprint
+
+
+def test_files_that_could_not_be_planned_are_swept_again(tmp_path, make_config, monkeypatch):
+    make_file(str(tmp_path / "one" / "a.txt"), b"a")
+    _settle(tmp_path / "one")
+    router = sweep.Router(make_config())
+    roots = [sweep.SweepRoot(str(tmp_path / "one"))]
+    snapshot_dir = str(tmp_path / "state" / "snapshots")
+    allocate = sweep.DestinationCache.allocate
+
+    def unlistable(*args):
+        raise PermissionError("target folder cannot be listed")
+    monkeypatch.setattr(sweep.DestinationCache, "allocate", unlistable)
+    assert sweep.run_sweep(roots, router, snapshot_dir=snapshot_dir)[sweep.ORGANIZE] == 0
+
+    # Nothing in the directory changed, but it is listed again
+    monkeypatch.setattr(sweep.DestinationCache, "allocate", allocate)
+    assert sweep.run_sweep(roots, router, snapshot_dir=snapshot_dir)[sweep.ORGANIZE] == 1
+    assert os.listdir(tmp_path / "one" / "Documents") == ["a.txt"]
+
+
+# A Downloads root holding a.txt, which was just read and so is not yet due for the archive
+def _recently_read(tmp_path):
+    downloads = tmp_path / "Downloads"
+    path = make_file(str(downloads / "a.txt"), b"a")
+    os.utime(path, (time.time(), time.time() - AGE))
+    _settle(downloads)
+    return sweep.SweepRoot(str(downloads), organize=False, archive_dir=str(downloads / "Archive"), days_old=30)
+
+
+def test_unchanged_directories_are_skipped_until_a_file_is_due(tmp_path, make_config, monkeypatch):
+    root = _recently_read(tmp_path)
+    router = sweep.Router(make_config())
+    snapshot_dir = str(tmp_path / "state" / "snapshots")
+    assert sweep.run_sweep([root], router, snapshot_dir=snapshot_dir)[sweep.ARCHIVE] == 0
+    scan_files = scanner.scan_files
+
+    def unlisted(*args, **kwargs):
+        raise AssertionError("an unchanged directory was listed")
+    monkeypatch.setattr(scanner, "scan_files", unlisted)
+    assert sweep.run_sweep([root], router, snapshot_dir=snapshot_dir)[sweep.ARCHIVE] == 0
+
+    # A month on the file is due, so its directory is listed again
+    monkeypatch.setattr(scanner, "scan_files", scan_files)
+    later = datetime.now() + timedelta(days=31)
+    assert sweep.run_sweep([root], router, later, snapshot_dir)[sweep.ARCHIVE] == 1
+    assert read(str(tmp_path / "Downloads" / "Archive" / "a.txt")) == b"a"
+
+
+def test_only_new_replaced_or_due_entries_are_decided_again(tmp_path):
+    kept = scanner.PathEntry(make_file(str(tmp_path / "root" / "kept.txt"), b"k"))
+    replaced = make_file(str(tmp_path / "root" / "replaced.txt"), b"r")
+    due = scanner.PathEntry(make_file(str(tmp_path / "root" / "due.txt"), b"d"))
+    directory = str(tmp_path / "root")
+    snapshot_dir = str(tmp_path / "snapshots")
+    root = sweep.SweepRoot(directory)
+    now_ts = time.time()
+    _settle(directory)
+
+    snapshot = snapshots.open_snapshot(snapshot_dir, root, "routing")
+    remaining = {"kept.txt": (kept.inode(), None), "replaced.txt": (os.stat(replaced).st_ino, None),
+                 "due.txt": (due.inode(), now_ts + 10)}
+    snapshot.record(directory, os.stat(directory), remaining, [], now_ts)
+    snapshot.save()
+
+    # Renamed over the old file while it still exists, so its inode differs
+    os.replace(make_file(replaced + ".new", b"new r"), replaced)
+    new = scanner.PathEntry(make_file(str(tmp_path / "root" / "new.txt"), b"n"))
+    entries = [kept, due, scanner.PathEntry(replaced), new]
+    snapshot = snapshots.open_snapshot(snapshot_dir, root, "routing")
+    changed, carried = snapshot.changed_entries(directory, entries, now_ts)
+    assert sorted(entry.name for entry in changed) == ["new.txt", "replaced.txt"]
+    assert sorted(carried) == ["due.txt", "kept.txt"]
+    changed, carried = snapshot.changed_entries(directory, entries, now_ts + 10)
+    assert sorted(entry.name for entry in changed) == ["due.txt", "new.txt", "replaced.txt"]
+
+    # Another routing config starts from scratch
+    assert snapshots.open_snapshot(snapshot_dir, root, "other routing").directories() == []
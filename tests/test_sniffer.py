@@ -0,0 +1,82 @@
+import io
+import os
+import struct
+
+import pytest
+from PIL import Image
+
+import sniffer
+import sweep
+from conftest import make_file, read
+
+
+@pytest.mark.parametrize("prefix, extension", [
+    (b"%PDF-1.7\n", ".pdf"),
+    (b"PK\x03\x04" + b"\0" * 26 + b"word/document.xml", ".docx"),
+    (b"PK\x03\x04" + b"\0" * 26 + b"xl/workbook.xml", ".xlsx"),
+    (b"PK\x03\x04" + b"\0" * 26 + b"notes.txt", ".zip"),
+    (b"\0\0\0\x18ftypqt  ", ".mov"),
+    (b"\0\0\0\x18ftypM4A ", ".m4a"),
+    (b"\0\0\0\x18ftypheic", ".heic"),
+    (b"\0\0\0\x18ftypisom", ".mp4"),
+    (b"RIFF\0\0\0\0WAVE", ".wav"),
+    (b"RIFF\0\0\0\0WEBP", ".webp"),
+    (b"RIFF\0\0\0\0CDXA", None),
+    (b"#!/usr/bin/env python3\nimport os\n", ".py"),
+    (b"#!/bin/sh\n", ".sh"),
+    (b"#!/usr/bin/perl\n", None),
+    (b"\0" * 257 + b"ustar\x0000", ".tar"),
+    (b"\xff\xd8\xff\xe0", ".jpg"),
+    (b"plain text", None),
+    (b"", None),
+])
+def test_signatures(prefix, extension):
+    assert sniffer.sniff_bytes(prefix) == extension
+
+
+def test_sniffed_types_are_cached_until_the_file_changes(tmp_path, monkeypatch):
+    pdf = make_file(str(tmp_path / "report"), b"%PDF-1.4 report")
+    text = make_file(str(tmp_path / "notes"), b"just notes")
+    files = [(path, os.stat(path)) for path in (pdf, text, str(tmp_path))]
+    cache_path = str(tmp_path / "types.json")
+    assert sniffer.Sniffer(cache_path).sniff(files) == {pdf: ".pdf"}
+
+    def unread(path):
+        raise AssertionError(f"{path} was read again")
+    with monkeypatch.context() as patch:
+        patch.setattr(sniffer, "sniff_file", unread)
+        # Unknown types are remembered too
+        assert sniffer.Sniffer(cache_path).sniff(files) == {pdf: ".pdf"}
+
+    make_file(text, b"%PDF-1.4 now a pdf")
+    assert sniffer.Sniffer(cache_path).sniff([(text, os.stat(text))]) == {text: ".pdf"}
+
+
+def test_sweeps_route_extensionless_files_by_their_contents(tmp_path, make_config):
+    make_file(str(tmp_path / "one" / "report"), b"%PDF-1.4 report")
+    make_file(str(tmp_path / "one" / "mystery"), b"no magic here")
+    router = sweep.Router(make_config(sniff=True))
+
+    assert sweep.run_sweep([sweep.SweepRoot(str(tmp_path / "one"))], router)[sweep.ORGANIZE] == 2
+    assert read(str(tmp_path / "one" / "Documents" / "report")) == b"%PDF-1.4 report"
+    assert read(str(tmp_path / "one" / router.extensions.default / "mystery")) == b"no magic here"
+
+
+def test_bitmaps_need_a_valid_header():
+    bitmap = io.BytesIO()
+    Image.new("RGB", (4, 4)).save(bitmap, "BMP")
+    assert sniffer.sniff_bytes(bitmap.getvalue()) == ".bmp"
+    assert sniffer.sniff_bytes(b"BMW owners' club newsletter, issue 12\n") is None
+    assert sniffer.sniff_bytes(b"BM") is None
+
+
+def test_executables_need_a_pe_header():
+    executable = bytearray(512)
+    executable[:2] = b"MZ"
+    struct.pack_into("<I", executable, 0x3C, 0x80)
+    executable[0x80:0x84] = b"PE\0\0"
+    assert sniffer.sniff_bytes(bytes(executable)) == ".exe"
+    assert sniffer.sniff_bytes(b"MZ " + b"notes on the project, nothing executable about them " * 4) is None
+    # e_lfanew pointing past the bytes read
+    struct.pack_into("<I", executable, 0x3C, 0xFFFFFFF0)
+    assert sniffer.sniff_bytes(bytes(executable)) is None
@@ -0,0 +1,69 @@
+import os
+import time
+
+import stability
+import sweep
+from conftest import make_file, read
+
+
+# Write data to path, last modified just now
+def _fresh_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as file:
+        file.write(data)
+    return path
+
+
+def test_downloads_in_progress_are_held():
+    st = os.stat(__file__)
+    assert stability.is_partial("report.pdf.crdownload") and stability.is_partial("VIDEO.MP4.PART")
+    assert not stability.is_partial("report.pdf")
+    # Firefox leaves an empty placeholder under the final name
+    assert stability.placeholder_names(["a.pdf", "a.pdf.part", "b.zip.crdownload", "c.app.download"]) == \
+        {"a.pdf", "c.app"}
+
+    assert stability.hold_until("a.pdf.part", st, st.st_mtime + 100, 5) == st.st_mtime + 105
+    assert stability.hold_until("a.pdf", st, st.st_mtime + 100, 5, placeholder=True) == st.st_mtime + 105
+    assert stability.hold_until("a.pdf", st, st.st_mtime + 1, 5) == st.st_mtime + 5
+    assert stability.hold_until("a.pdf", st, st.st_mtime + 100, 5) is None
+
+
+def test_a_file_is_released_once_it_stays_quiet(tmp_path):
+    path = _fresh_file(str(tmp_path / "a.pdf"), b"a")
+    tracker = stability.StabilityTracker(quiet_seconds=1, tick_seconds=0.25)
+    now = time.time()
+    assert not tracker.observe(path, now)
+    assert len(tracker) == 1
+    assert tracker.due(now + 0.5) == []
+
+    # Still growing: it waits a full quiet period from the new sample
+    with open(path, "ab") as file:
+        file.write(b" more")
+    assert not tracker.observe(path, now + 0.75)
+    assert tracker.due(now + 1.5) == []
+    assert tracker.due(now + 2.5) == [path]
+    assert len(tracker) == 0
+
+
+def test_temporary_and_vanished_files_are_never_released(tmp_path):
+    tracker = stability.StabilityTracker(quiet_seconds=0)
+    partial = make_file(str(tmp_path / "a.pdf.part"), b"a")
+    placeholder = make_file(str(tmp_path / "a.pdf"), b"")
+    assert not tracker.observe(partial)
+    assert not tracker.observe(placeholder)
+    assert not tracker.observe(str(tmp_path / "gone.pdf"))
+    assert tracker.observe(make_file(str(tmp_path / "b.pdf"), b"b"))
+    assert len(tracker) == 0
+
+
+def test_sweeps_leave_files_being_written(tmp_path, make_config):
+    downloads = tmp_path / "Downloads"
+    _fresh_file(str(downloads / "growing.pdf"), b"g")
+    make_file(str(downloads / "b.pdf.crdownload"), b"b")
+    make_file(str(downloads / "done.pdf"), b"d")
+    router = sweep.Router(make_config(stability={"quiet_seconds": 60}))
+
+    counts = sweep.run_sweep([sweep.SweepRoot(str(downloads))], router)
+    assert counts[sweep.ORGANIZE] == 1
+    assert read(str(downloads / "Documents" / "done.pdf")) == b"d"
+    assert sorted(os.listdir(downloads)) == ["Documents", "b.pdf.crdownload", "growing.pdf"]
@@ -0,0 +1,99 @@
+import os
+from datetime import datetime
+
+import scanner
+import sweep
+from conftest import make_file, read
+
+
+def _fresh_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as file:
+        file.write(data)
+    return path
+
+
+def test_one_sweep_organizes_archives_and_files_screenshots(tmp_path, make_config):
+    desktop, downloads = tmp_path / "Desktop", tmp_path / "Downloads"
+    make_file(str(desktop / "Screenshot of the team meeting.png"), b"shot")
+    make_file(str(desktop / "notes.txt"), b"notes")
+    make_file(str(downloads / "old.pdf"), b"old")
+    _fresh_file(str(downloads / "new.txt"), b"new")
+    config = make_config(days_old_for_archive=30)
+
+    counts = sweep.run_sweep(sweep.default_roots(config), sweep.Router(config))
+    assert (counts[sweep.ORGANIZE], counts[sweep.ARCHIVE], counts[sweep.SCREENSHOT]) == (2, 1, 1)
+    assert read(str(desktop / "Screenshots" / "Meeting" / "Screenshot of the team meeting.png")) == b"shot"
+    assert read(str(desktop / "Documents" / "notes.txt")) == b"notes"
+    assert read(str(downloads / "Archive" / "old.pdf")) == b"old"
+    assert read(str(downloads / "Documents" / "new.txt")) == b"new"
+
+
+def test_decisions_follow_the_root(tmp_path, make_config):
+    router = sweep.Router(make_config())
+    now = datetime.now()
+    shot = scanner.PathEntry(make_file(str(tmp_path / "Screenshot 1.png"), b"s"))
+
+    # Screenshots are only filed from screenshot roots; elsewhere they are images
+    move = router.decide(sweep.SweepRoot(str(tmp_path), screenshots=True), shot, now)
+    assert move.kind == sweep.SCREENSHOT and move.target_folder.endswith(now.strftime("%B_%Y"))
+    move = router.decide(sweep.SweepRoot(str(tmp_path)), shot, now)
+    assert move.kind == sweep.ORGANIZE and move.target_folder == str(tmp_path / "Images")
+    # Archive age comes before organizing; an organize-less root leaves recent files alone
+    archive = sweep.SweepRoot(str(tmp_path), archive_dir=str(tmp_path / "Archive"))
+    assert router.decide(archive, shot, now).kind == sweep.ARCHIVE
+    recent = scanner.PathEntry(_fresh_file(str(tmp_path / "recent.txt"), b"r"))
+    assert router.decide(archive._replace(organize=False), recent, now) is None
+
+
+def test_recursive_sweeps_reach_into_subdirectories(tmp_path, make_config):
+    make_file(str(tmp_path / "project" / "notes.txt"), b"notes")
+    make_file(str(tmp_path / "project" / "deeper" / "too" / "far.txt"), b"far")
+    make_file(str(tmp_path / "Documents" / "filed.txt"), b"filed")
+    router = sweep.Router(make_config())
+
+    assert sweep.run_sweep([sweep.SweepRoot(str(tmp_path))], router)[sweep.ORGANIZE] == 0
+    counts = sweep.run_sweep([sweep.SweepRoot(str(tmp_path), recursive_depth=2)], router)
+    assert counts[sweep.ORGANIZE] == 1
+    assert read(str(tmp_path / "Documents" / "notes.txt")) == b"notes"
+    # Filed files stay put and files below max_depth are out of reach
+    assert read(str(tmp_path / "Documents" / "filed.txt")) == b"filed"
+    assert read(str(tmp_path / "project" / "deeper" / "too" / "far.txt")) == b"far"
+    assert sweep.recursive_depth(make_config(recursive={"enabled": True, "max_depth": 4})) == 4
+    assert sweep.recursive_depth(make_config(), enabled=True) == 3
+
+
+def test_a_plan_is_data_until_it_is_executed(tmp_path, make_config):
+    make_file(str(tmp_path / "one" / "a.txt"), b"a")
+    make_file(str(tmp_path / "two" / "a.txt"), b"aa")
+    make_file(str(tmp_path / "one" / "b.jpg"), b"b")
+    roots = [sweep.SweepRoot(str(tmp_path / "one")), sweep.SweepRoot(str(tmp_path / "two"))]
+    listed = {root.directory: sorted(os.listdir(root.directory)) for root in roots}
+
+    plan = sweep.plan_sweep(roots, sweep.Router(make_config()))
+    assert {root.directory: sorted(os.listdir(root.directory)) for root in roots} == listed
+    assert isinstance(plan.moves, tuple)
+    summary = sweep.plan_summary(plan)
+    assert summary["files"] == 3 and summary["bytes"] == 4
+    assert sorted((os.path.relpath(move["source"], tmp_path), os.path.relpath(move["destination"], tmp_path))
+                  for move in summary["moves"]) == [("one/a.txt", "one/Documents/a.txt"),
+                                                    ("one/b.jpg", "one/Images/b.jpg"),
+                                                    ("two/a.txt", "two/Documents/a.txt")]
+
+    counts = sweep.execute_plan(plan)
+    assert counts[sweep.ORGANIZE] == 3
+    assert set(counts["timings"]) == {"plan", "execute"}
+    assert read(str(tmp_path / "two" / "Documents" / "a.txt")) == b"aa"
+
+
+def test_planning_named_files(tmp_path, make_config):
+    root = sweep.SweepRoot(str(tmp_path))
+    paths = [make_file(str(tmp_path / "a.txt"), b"a"), make_file(str(tmp_path / ".hidden.txt"), b"h"),
+             make_file(str(tmp_path / "b.pdf.part"), b"b"), str(tmp_path / "gone.txt"),
+             os.path.dirname(make_file(str(tmp_path / "folder" / "c.txt"), b"c"))]
+    held = []
+
+    plan = sweep.plan_files(root, paths, sweep.Router(make_config()), held=held)
+    assert [(move.source, move.destination) for move in plan.moves] == \
+        [(paths[0], str(tmp_path / "Documents" / "a.txt"))]
+    assert held == [paths[2]]
@@ -0,0 +1,100 @@
+import os
+import shutil
+
+import pytest
+from PIL import Image
+
+import duplicates
+import thumbnails
+
+
+@pytest.fixture
+def cache(tmp_path):
+    thumbnail_cache = thumbnails.ThumbnailCache(str(tmp_path / "thumbnails"), duplicates.DuplicateFinder(),
+                                                max_bytes=3 * thumbnails.ENTRY_BYTES, workers=1)
+    yield thumbnail_cache
+    thumbnail_cache.close()
+
+
+def _image(path, color):
+    Image.new("RGB", (64, 48), color).save(path)
+    return str(path)
+
+
+def _cached(cache):
+    return sorted(os.path.basename(path) for path in cache._entries())
+
+
+def test_unreadable_markers_are_evicted_like_thumbnails(tmp_path, cache):
+    broken = tmp_path / "broken.jpg"
+    broken.write_bytes(b"not an image")
+    with pytest.raises(LookupError):
+        cache.get(str(broken))
+    (marker,) = _cached(cache)
+    assert marker.endswith(".none")
+    # Seen again, the marker saves decoding the file
+    with pytest.raises(LookupError):
+        cache.get(str(broken))
+
+    for n, color in enumerate(("red", "green", "blue")):
+        cache.get(_image(tmp_path / f"{n}.png", color))
+    # The marker was the least recently used entry
+    cached = _cached(cache)
+    assert len(cached) == 2 and all(name.endswith(".jpg") for name in cached)
+
+
+def test_thumbnails_fit_the_requested_size(tmp_path):
+    assert [thumbnails.thumbnail_size(size) for size in (1, 128, 200, 4000)] == [128, 128, 256, 512]
+    assert thumbnails.is_image("Photo.JPG") and not thumbnails.is_image("notes.txt")
+
+    photo = tmp_path / "photo.jpg"
+    Image.new("RGB", (2000, 1000), "red").save(photo)
+    target = str(tmp_path / "out" / "photo.jpg")
+    assert thumbnails.render(str(photo), target, 256) == os.path.getsize(target)
+    with Image.open(target) as thumbnail:
+        assert thumbnail.size == (256, 128) and thumbnail.format == "JPEG"
+
+    # Turned upright by its EXIF orientation; palette images are converted
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    Image.new("RGB", (400, 200), "blue").save(photo, exif=exif)
+    Image.new("P", (300, 300)).save(tmp_path / "palette.png")
+    thumbnails.render(str(photo), target, 128)
+    with Image.open(target) as thumbnail:
+        assert thumbnail.size == (64, 128)
+    thumbnails.render(str(tmp_path / "palette.png"), target, 128)
+    with Image.open(target) as thumbnail:
+        assert thumbnail.size == (128, 128)
+
+
+def test_copies_share_a_thumbnail_that_is_rendered_once(tmp_path, cache, monkeypatch):
+    original = _image(tmp_path / "a.png", "red")
+    copy = str(tmp_path / "copy.png")
+    shutil.copy(original, copy)
+    notes = tmp_path / "notes.txt"
+    notes.write_bytes(b"notes")
+    files = [(path, os.stat(path)) for path in (original, copy, str(notes))]
+
+    digests = cache.prepare(files)
+    assert set(digests) == {original, copy} and digests[original] == digests[copy]
+    assert len(_cached(cache)) == 1
+
+    def unrendered():
+        raise AssertionError("a cached thumbnail was rendered again")
+    monkeypatch.setattr(cache, "_executor", unrendered)
+    thumbnail, digest = cache.get(copy)
+    assert digest == digests[original] and os.path.exists(thumbnail)
+    with pytest.raises(LookupError):
+        cache.get(str(tmp_path / "missing.png"))
+
+
+def test_the_least_recently_used_thumbnails_are_evicted(tmp_path, cache):
+    cached = [cache.get(_image(tmp_path / f"{n}.png", color))[0] for n, color in enumerate(("red", "green", "blue"))]
+    for n, path in enumerate(cached):
+        os.utime(path, (n + 1, n + 1))
+    # A hit marks the oldest as just used
+    cache.get(str(tmp_path / "0.png"))
+
+    # Overflowing, the cache is trimmed below its limit, least recently used first
+    newest, _ = cache.get(_image(tmp_path / "3.png", "white"))
+    assert [os.path.exists(path) for path in cached + [newest]] == [True, False, False, True]
@@ -0,0 +1,87 @@
+import os
+import time
+
+import pytest
+
+import bundles
+import catalog
+import chunks
+import sweep
+import tiers
+from conftest import make_file, read
+
+DAY = 86400
+
+
+# Archive files {name: data} from Downloads into the warm tier of config
+def _archive_warm(tmp_path, config, journal_dir, files):
+    downloads = tmp_path / "Downloads"
+    for name, data in files.items():
+        make_file(str(downloads / name), data)
+    archive_catalog = sweep.archive_catalog(config)
+    root = sweep.SweepRoot(str(downloads), organize=False, archive_dir=str(downloads / "Archive"))
+    sweep.run_sweep([root], sweep.Router(config), journal_dir=journal_dir, bundler=sweep.bundler(config),
+                    archive_catalog=archive_catalog)
+    return archive_catalog
+
+
+@pytest.mark.parametrize("backend, archiver", [
+    (catalog.BUNDLED, lambda: bundles.Bundler(workers=1)),
+    (catalog.CHUNKED, lambda: chunks.ChunkArchiver(workers=1)),
+])
+def test_cold_compaction(tmp_path, make_config, journal_dir, backend, archiver):
+    config = make_config(tiers={"enabled": True, "cold_after_days": 1})
+    files = {"a.txt": b"a" * 1000, "b.jpg": b"b" * 1000}
+    archive_catalog = _archive_warm(tmp_path, config, journal_dir, files)
+    archive = tmp_path / "Downloads" / "Archive"
+    # With tiers, sweeps only move
+    assert sorted(os.listdir(archive)) == ["a.txt", "b.jpg"]
+    assert {entry["backend"] for entry in archive_catalog.search()} == {catalog.MOVED}
+
+    cold_after_days, cold_dir = tiers.cold_settings(config)
+    assert cold_dir == str(archive)
+    # Nothing is due yet
+    assert tiers.compact(archive_catalog, archiver(), cold_after_days, cold_dir)["compacted"] == 0
+
+    counts = tiers.compact(archive_catalog, archiver(), cold_after_days, cold_dir, now=time.time() + 2 * DAY, batch=1)
+    assert counts == {"compacted": 2, "failed": 0, "bytes": 2000}
+    assert not os.path.lexists(archive / "a.txt") and not os.path.lexists(archive / "b.jpg")
+    entries = archive_catalog.search()
+    assert {entry["backend"] for entry in entries} == {backend}
+    assert archive_catalog.warm(time.time() + 2 * DAY, 10) == []
+
+    # The catalog still finds each file, and restores it where it came from
+    for entry in entries:
+        restored = archive_catalog.restore(entry["id"]).path
+        assert restored == os.path.join(entry["original_dir"], entry["name"])
+        assert read(restored) == files[entry["name"]]
+    assert archive_catalog.search() == []
+
+
+def test_compaction_stops_between_batches(tmp_path, make_config, journal_dir):
+    config = make_config(tiers={"enabled": True})
+    archive_catalog = _archive_warm(tmp_path, config, journal_dir, {f"{n}.txt": b"x" * n for n in range(1, 5)})
+    batches = []
+
+    def should_stop():
+        batches.append(None)
+        return len(batches) > 2
+
+    counts = tiers.compact(archive_catalog, bundles.Bundler(workers=1), 1, None, now=time.time() + 2 * DAY,
+                           batch=1, should_stop=should_stop)
+    assert counts["compacted"] == 2
+    assert len(archive_catalog.warm(time.time() + 2 * DAY, 10)) == 2
+
+
+def test_changed_warm_files_are_not_compacted(tmp_path, make_config, journal_dir):
+    config = make_config(tiers={"enabled": True})
+    archive_catalog = _archive_warm(tmp_path, config, journal_dir, {"a.txt": b"a"})
+    warm = str(tmp_path / "Downloads" / "Archive" / "a.txt")
+    with open(warm, "ab") as file:
+        file.write(b" edited")
+
+    counts = tiers.compact(archive_catalog, bundles.Bundler(workers=1), 1, None, now=time.time() + 2 * DAY)
+    assert counts["compacted"] == 0 and counts["failed"] == 1
+    assert read(warm) == b"a edited"
+    (entry,) = archive_catalog.search()
+    assert entry["backend"] == catalog.MOVED and entry["location"] == warm
@@ -0,0 +1,100 @@
+import os
+import time
+
+import pytest
+
+import journal
+import sweep
+import undo
+from conftest import make_file, read
+
+
+def _sweep(config, roots, journal_dir, backend=None, archive_catalog=None):
+    return sweep.run_sweep(roots, sweep.Router(config), journal_dir=journal_dir, bundler=backend,
+                           archive_catalog=archive_catalog)
+
+
+def test_undo_of_a_multi_root_sweep(tmp_path, make_config, journal_dir):
+    first = make_file(str(tmp_path / "one" / "a.txt"), b"a")
+    second = make_file(str(tmp_path / "two" / "b.jpg"), b"b")
+    roots = [sweep.SweepRoot(str(tmp_path / "one")), sweep.SweepRoot(str(tmp_path / "two"))]
+    counts = _sweep(make_config(), roots, journal_dir)
+    assert counts[sweep.ORGANIZE] == 2
+    assert read(str(tmp_path / "one" / "Documents" / "a.txt")) == b"a"
+    assert read(str(tmp_path / "two" / "Images" / "b.jpg")) == b"b"
+
+    result = undo.undo_run(journal_dir)
+    assert result["run_id"] == counts["run_id"]
+    assert result["restored"] == 2 and result["failed"] == 0
+    assert read(first) == b"a" and read(second) == b"b"
+    # The category folders the run created are gone again
+    assert sorted(os.listdir(tmp_path / "one")) == ["a.txt"]
+    assert sorted(os.listdir(tmp_path / "two")) == ["b.jpg"]
+    with pytest.raises(LookupError):
+        undo.undo_run(journal_dir, counts["run_id"])
+
+
+def test_undo_leaves_changed_files_alone(tmp_path, make_config, journal_dir):
+    make_file(str(tmp_path / "one" / "a.txt"), b"a")
+    counts = _sweep(make_config(), [sweep.SweepRoot(str(tmp_path / "one"))], journal_dir)
+    moved = str(tmp_path / "one" / "Documents" / "a.txt")
+    with open(moved, "ab") as file:
+        file.write(b" edited")
+
+    result = undo.undo_run(journal_dir, counts["run_id"])
+    assert result["restored"] == 0
+    assert result["skipped"] == [{"path": moved, "reason": "changed since the run"}]
+    assert read(moved) == b"a edited"
+
+
+def test_undo_restores_under_a_tagged_name_when_the_original_is_taken(tmp_path, make_config, journal_dir):
+    make_file(str(tmp_path / "one" / "a.txt"), b"a")
+    _sweep(make_config(), [sweep.SweepRoot(str(tmp_path / "one"))], journal_dir)
+    make_file(str(tmp_path / "one" / "a.txt"), b"new a")
+
+    undo.undo_run(journal_dir)
+    assert read(str(tmp_path / "one" / "a.txt")) == b"new a"
+    assert read(str(tmp_path / "one" / "a_restored.txt")) == b"a"
+
+
+@pytest.mark.parametrize("backend", ["bundles", "chunks"])
+def test_undo_of_a_packed_archive_run(tmp_path, make_config, journal_dir, backend):
+    downloads = tmp_path / "Downloads"
+    files = {name: make_file(str(downloads / name), name.encode() * 100) for name in ("a.txt", "b.jpg")}
+    config = make_config(**{backend: {"enabled": True, "workers": 1}})
+    archive_catalog = sweep.archive_catalog(config)
+    root = sweep.SweepRoot(str(downloads), organize=False, archive_dir=str(downloads / "Archive"))
+    counts = _sweep(config, [root], journal_dir, sweep.bundler(config), archive_catalog)
+
+    assert counts[sweep.ARCHIVE] == 2
+    assert journal.load_stats(journal_dir)[sweep.ARCHIVE] == 2
+    assert len(archive_catalog.search()) == 2
+    assert all(entry["run_id"] == counts["run_id"] for entry in archive_catalog.search())
+
+    result = undo.undo_run(journal_dir, archive_catalog=archive_catalog)
+    assert result["restored"] == 2 and result["failed"] == 0
+    for name, path in files.items():
+        assert read(path) == name.encode() * 100
+        assert os.stat(path).st_atime > time.time() - 60
+    assert archive_catalog.search() == []
+    # The extractions are journaled in the undo run, with the store they came from
+    undo_run = journal.read_run(journal.run_path(journal_dir, result["undo_run_id"]))
+    assert sorted((move[2], move[3], move[6]) for move in undo_run.moves.values()) == \
+        [(files["a.txt"], "D", sweep.bundler(config).backend), (files["b.jpg"], "D", sweep.bundler(config).backend)]
+
+
+def test_undo_of_archive_moves_forgets_them_in_the_catalog(tmp_path, make_config, journal_dir):
+    downloads = tmp_path / "Downloads"
+    source = make_file(str(downloads / "a.txt"), b"a")
+    config = make_config()
+    archive_catalog = sweep.archive_catalog(config)
+    root = sweep.SweepRoot(str(downloads), organize=False, archive_dir=str(downloads / "Archive"))
+    _sweep(config, [root], journal_dir, archive_catalog=archive_catalog)
+    assert [entry["location"] for entry in archive_catalog.search()] == [str(downloads / "Archive" / "a.txt")]
+
+    undo.undo_run(journal_dir, archive_catalog=archive_catalog)
+    assert read(source) == b"a"
+    # Just accessed, so the next sweep does not archive it again
+    assert os.stat(source).st_atime > time.time() - 60
+    assert archive_catalog.search() == []
+    assert len(archive_catalog.search(include_restored=True)) == 1
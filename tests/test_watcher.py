@@ -0,0 +1,123 @@
+import os
+import threading
+import time
+
+from watchdog.events import DirCreatedEvent, FileCreatedEvent, FileDeletedEvent, FileMovedEvent
+
+import sweep
+import watcher
+from conftest import AGE, make_file, read
+
+
+def test_events_are_coalesced_into_one_batch(tmp_path):
+    batcher = watcher.EventBatcher(quiet_seconds=0.05)
+    stop = threading.Event()
+    a, b = str(tmp_path / "a.txt"), str(tmp_path / "b.txt")
+    for _ in range(3):
+        batcher.dispatch(FileCreatedEvent(a))
+    batcher.dispatch(FileMovedEvent(str(tmp_path / "b.txt.crdownload"), b))
+    batcher.dispatch(FileCreatedEvent(str(tmp_path / "gone.txt")))
+    batcher.dispatch(FileDeletedEvent(str(tmp_path / "gone.txt")))
+    batcher.dispatch(DirCreatedEvent(str(tmp_path / "folder")))
+    assert batcher.pending_directories() == {str(tmp_path)}
+
+    assert batcher.next_batch(stop) == {a, b}
+    assert batcher.next_batch(stop, timeout=0.05) == set()
+
+
+def test_a_busy_burst_is_flushed_after_the_max_delay(tmp_path):
+    batcher = watcher.EventBatcher(quiet_seconds=10, max_delay_seconds=0.1)
+    stop = threading.Event()
+    started = time.monotonic()
+    batcher.add(str(tmp_path / "a.txt"))
+    assert batcher.next_batch(stop) == {str(tmp_path / "a.txt")}
+    assert time.monotonic() - started < 5
+
+    batcher.add(str(tmp_path / "b.txt"))
+    stop.set()
+    assert batcher.next_batch(stop) == set()
+
+
+def test_only_paths_a_sweep_would_touch_have_a_root(tmp_path, make_config):
+    config = make_config(recursive={"enabled": True, "max_depth": 1})
+    roots = watcher.watch_roots(config)
+    router = sweep.Router(config)
+    desktop, downloads = roots[0], roots[1]
+    assert watcher.root_for(str(tmp_path / "Desktop" / "a.txt"), roots, router) == desktop
+    assert watcher.root_for(str(tmp_path / "Downloads" / "project" / "a.txt"), roots, router) == downloads
+    # The Screenshots folder is a root of its own, nested in the Desktop
+    assert watcher.root_for(str(tmp_path / "Desktop" / "Screenshots" / "a.png"), roots, router) == roots[2]
+    for path in ("Downloads/project/deeper/a.txt", "Downloads/Documents/a.txt", "Downloads/.cache/a.txt",
+                 "Downloads/Archive/a.txt", "elsewhere/a.txt"):
+        assert watcher.root_for(str(tmp_path / path), roots, router) is None
+
+
+def test_a_batch_is_routed_by_root(tmp_path, make_config, journal_dir):
+    config = make_config()
+    roots = watcher.watch_roots(config)
+    paths = [make_file(str(tmp_path / "Desktop" / "a.txt"), b"a"),
+             make_file(str(tmp_path / "Downloads" / "b.jpg"), b"b"),
+             make_file(str(tmp_path / "Downloads" / "c.pdf.crdownload"), b"c"),
+             make_file(str(tmp_path / "Downloads" / "Documents" / "d.txt"), b"d"),
+             str(tmp_path / "Downloads" / "vanished.txt")]
+    held = []
+
+    counts = watcher.route_batch(paths, roots, sweep.Router(config), held, journal_dir)
+    assert (counts[sweep.ORGANIZE], counts[sweep.ARCHIVE]) == (1, 1)
+    assert read(str(tmp_path / "Desktop" / "Documents" / "a.txt")) == b"a"
+    assert read(str(tmp_path / "Downloads" / "Archive" / "b.jpg")) == b"b"
+    assert held == [paths[2]]
+    assert read(paths[3]) == b"d"
+
+
+# Date directories' mtimes AGE seconds back, so any later change moves them
+def _settle(*directories):
+    then = time.time() - AGE
+    for directory in directories:
+        os.utime(directory, (then, then))
+
+
+def test_lost_events_are_found_and_reconciled(tmp_path, make_config):
+    config = make_config(recursive={"enabled": True, "max_depth": 2})
+    desktop, downloads = tmp_path / "Desktop", tmp_path / "Downloads"
+    os.makedirs(desktop / "project")
+    os.makedirs(downloads)
+    _settle(desktop, desktop / "project", downloads)
+    summary = watcher.TreeSummary(watcher.watch_roots(config), sweep.Router(config))
+    summary.load(None)
+    assert summary.changed() == []
+
+    # Files arrive while no events are seen, one in a new subdirectory
+    make_file(str(desktop / "project" / "a.txt"), b"a")
+    make_file(str(downloads / "new" / "b.jpg"), b"b")
+    make_file(str(downloads / "c.part"), b"c")
+    changed = summary.changed()
+    assert sorted(changed) == [str(desktop / "project"), str(downloads)]
+    assert summary.changed(skip={str(downloads)}) == [str(desktop / "project")]
+
+    held = []
+    counts = summary.reconcile(changed, held)
+    assert (counts[sweep.ORGANIZE], counts[sweep.ARCHIVE]) == (1, 1)
+    assert read(str(desktop / "Documents" / "a.txt")) == b"a"
+    assert read(str(downloads / "Archive" / "b.jpg")) == b"b"
+    assert held == [str(downloads / "c.part")]
+    # The reconciled directories are up to date, and the new subdirectory joined the summary
+    assert not set(summary.changed()) & set(changed)
+    make_file(str(downloads / "new" / "d.txt"), b"d")
+    assert str(downloads / "new") in summary.changed()
+
+
+def test_the_summary_is_seeded_from_sweep_snapshots(tmp_path, make_config):
+    config = make_config()
+    make_file(str(tmp_path / "Desktop" / "a.txt"), b"a")
+    os.makedirs(tmp_path / "Desktop" / "Screenshots")
+    os.makedirs(tmp_path / "Downloads")
+    roots, router = watcher.watch_roots(config), sweep.Router(config)
+    snapshot_dir = sweep.snapshot_dir(config)
+    sweep.run_sweep(roots, router, snapshot_dir=snapshot_dir)
+    _settle(tmp_path / "Desktop")
+
+    summary = watcher.TreeSummary(roots, router)
+    summary.load(snapshot_dir)
+    make_file(str(tmp_path / "Desktop" / "b.txt"), b"b")
+    assert summary.changed() == [str(tmp_path / "Desktop")]
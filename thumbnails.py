@@ -0,0 +1,224 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+import scanner
+
+# Thumbnail previews for the dashboard.
+#
+# Thumbnails are rendered on a process pool. JPEGs are decoded in draft mode,
+# where the decoder itself scales down by 1/2, 1/4 or 1/8 and never builds the
+# full-size bitmap, and other formats are shrunk with Image.reduce() (a box
+# filter by a whole factor) before the final resize, so a 40-megapixel photo
+# costs about as much as a small one.
+#
+# Rendered thumbnails are kept in <state_dir>/thumbnails/<2 hex>/<hash>-<size>.jpg,
+# keyed by the content hash of the image (from the duplicate finder, itself
+# cached by inode and mtime), so revisiting a folder decodes nothing and copies
+# share a thumbnail. The cache is an LRU bounded by size: a hit bumps the file's
+# mtime, and the least recently used thumbnails are deleted once it grows past
+# max_bytes. Files that cannot be previewed get an empty <hash>.none marker, so
+# they are not decoded again either; markers are bumped and evicted like
+# thumbnails, each counted as ENTRY_BYTES, the least any file takes on disk.
+# Thumbnail URLs carry the content hash, so the dashboard serves them as
+# immutable.
+
+# Longer side of a thumbnail in pixels; requests are rounded up to one of these
+SIZES = (128, 256, 512)
+DEFAULT_SIZE = 256
+
+# JPEG quality of thumbnails
+QUALITY = 80
+
+# Disk space the cache may use
+MAX_BYTES = 256 * 1024 * 1024
+
+# Fraction of max_bytes the cache is trimmed to when it overflows
+_TRIM_TO = 0.9
+
+# Bytes a cache entry is counted as at least (a filesystem block)
+ENTRY_BYTES = 4096
+
+# Types Pillow can preview
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".bmp", ".tiff", ".tif", ".webp")
+
+# Modes Image.reduce() handles
+_REDUCIBLE_MODES = ("L", "RGB", "RGBA", "CMYK", "YCbCr")
+
+# EXIF orientation -> transpose bringing the image upright
+_ORIENTATIONS = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+
+def is_image(name):
+    return name.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def thumbnail_size(requested):
+    return next((size for size in SIZES if size >= requested), SIZES[-1])
+
+
+# Render the thumbnail of image path to target, at most size pixels on its
+# longer side, and return its size in bytes (worker side). The image is read
+# without moving its access time (see scanner.open_quietly).
+def render(path, target, size):
+    with scanner.open_quietly(path) as file, Image.open(file) as image:
+        orientation = image.getexif().get(0x0112)
+        if image.format == "JPEG":
+            image.draft("RGB", (size, size))
+        # reduce() only takes 8-bit modes; palette, 1-bit and 16-bit images are
+        # converted first
+        if image.mode not in _REDUCIBLE_MODES:
+            image = image.convert("RGBA" if image.mode in ("P", "PA", "LA") else "RGB")
+        factor = min(image.width // size, image.height // size)
+        thumbnail = image.reduce(factor) if factor >= 2 else image.copy()
+    thumbnail.thumbnail((size, size), Image.Resampling.BICUBIC)
+    if orientation in _ORIENTATIONS:
+        thumbnail = thumbnail.transpose(_ORIENTATIONS[orientation])
+    if thumbnail.mode not in ("RGB", "L"):
+        thumbnail = thumbnail.convert("RGB")
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    temp_path = f"{target}.{os.getpid()}.tmp"
+    thumbnail.save(temp_path, "JPEG", quality=QUALITY)
+    os.replace(temp_path, target)
+    return os.path.getsize(target)
+
+
+def _cost(size):
+    return max(size, ENTRY_BYTES)
+
+
+class ThumbnailCache:
+    def __init__(self, directory, finder, max_bytes=MAX_BYTES, workers=None):
+        self.directory = directory
+        # duplicates.DuplicateFinder supplying content hashes
+        self.finder = finder
+        self.max_bytes = max_bytes
+        self.workers = workers or os.cpu_count() or 1
+        self._lock = threading.Lock()
+        self._pool = None
+        # Bytes in the cache, counted on first use
+        self._bytes = None
+
+    def _path(self, digest, size):
+        return os.path.join(self.directory, digest[:2], f"{digest}-{size}.jpg")
+
+    # Marker of contents that cannot be previewed
+    def _unreadable_path(self, digest):
+        return os.path.join(self.directory, digest[:2], f"{digest}.none")
+
+    # One pool for the life of the dashboard, started on the first miss
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            return self._pool
+
+    # Thumbnails and unreadable markers in the cache
+    def _entries(self):
+        for directory, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith((".jpg", ".none")):
+                    yield os.path.join(directory, name)
+
+    # Add added bytes to the count and delete least recently used thumbnails
+    # and markers while the cache is over max_bytes
+    def _account(self, added):
+        with self._lock:
+            if self._bytes is None:
+                self._bytes = sum(_cost(os.path.getsize(path)) for path in self._entries())
+            else:
+                self._bytes += added
+            if self._bytes <= self.max_bytes:
+                return
+            entries = []
+            for path in self._entries():
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime_ns, _cost(st.st_size), path))
+            entries.sort()
+            self._bytes = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if self._bytes <= self.max_bytes * _TRIM_TO:
+                    break
+                try:
+                    os.unlink(path)
+                except OSError:
+                    continue
+                self._bytes -= size
+
+    # Cached thumbnail of digest (or with size None, its unreadable marker),
+    # marked as just used, or None
+    def _hit(self, digest, size):
+        path = self._path(digest, size) if size is not None else self._unreadable_path(digest)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    # Make sure the images among (path, stat) pairs have thumbnails of size,
+    # rendering the missing ones in parallel; returns {path: content hash} of the
+    # images that have one
+    def prepare(self, files, size=DEFAULT_SIZE):
+        digests = self.finder.full_hashes([(path, st) for path, st in files if is_image(path)])
+        missing = {}
+        unreadable = set()
+        for path, digest in digests.items():
+            if self._hit(digest, None):
+                unreadable.add(digest)
+            elif self._hit(digest, size) is None:
+                missing.setdefault(digest, path)
+        if missing:
+            pool = self._executor()
+            futures = {digest: pool.submit(render, path, self._path(digest, size), size)
+                       for digest, path in missing.items()}
+            added = 0
+            for digest, future in futures.items():
+                try:
+                    added += _cost(future.result())
+                except Exception:
+                    # Not an image Pillow can read after all; remembered as such
+                    unreadable.add(digest)
+                    marker = self._unreadable_path(digest)
+                    os.makedirs(os.path.dirname(marker), exist_ok=True)
+                    with open(marker, "w"):
+                        pass
+                    added += ENTRY_BYTES
+            self._account(added)
+        return {path: digest for path, digest in digests.items() if digest not in unreadable}
+
+    # (thumbnail path, content hash) of image path at size, rendered if needed.
+    # Raises LookupError for files that cannot be previewed.
+    def get(self, path, size=DEFAULT_SIZE):
+        try:
+            st = os.stat(path)
+        except OSError:
+            raise LookupError(f"no file {path}")
+        digest = self.prepare([(path, st)], size).get(path)
+        if digest is None:
+            raise LookupError(f"no preview for {path}")
+        return self._path(digest, size), digest
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+
+
+# Thumbnail cache from config['thumbnails'] in the state directory
+def thumbnail_cache(config, finder):
+    settings = config.get('thumbnails', {})
+    state_dir = os.path.expanduser(config.get('state_dir', '~/.file_automation'))
+    return ThumbnailCache(os.path.join(state_dir, 'thumbnails'), finder,
+                          settings.get('max_bytes', MAX_BYTES), settings.get('workers'))
@@ -0,0 +1,149 @@
+import logging
+import os
+import threading
+import time
+
+import sweep
+
+# Tiered archive: warm first, cold later.
+#
+# With tiers enabled, a sweep archives by moving files into the archive folder
+# as they are: on the same device, a rename, which keeps /archive and the
+# watcher fast. Files that have been warm for cold_after_days are compacted
+# later into cold storage (the configured bundle or chunk backend, bundles by
+# default) in <cold_dir> (default: the archive folder), found through the
+# catalog's index of warm entries by archive date, so a compaction never lists
+# the archive.
+#
+# Compaction runs from `python Automation.py compact` (e.g. a nightly cron job)
+# or, in the watcher, on an IdleCompactor thread that only works while no file
+# events have arrived for idle_seconds and the load average is below max_load,
+# one BATCH at a time, so it yields to real work between batches.
+
+# Warm entries compacted per batch
+BATCH = 200
+
+# Days a file stays warm before it is compacted
+COLD_AFTER_DAYS = 180
+
+# Seconds without file events before the watcher starts compacting
+IDLE_SECONDS = 300.0
+
+# 1-minute load average per CPU above which the machine is not idle
+MAX_LOAD = 0.5
+
+
+def enabled(config):
+    return config.get('tiers', {}).get('enabled', False)
+
+
+# (cold_after_days, cold_dir) from config['tiers']; cold_dir defaults to the
+# archive folder itself, not the shard a warm file is in (see shards.py)
+def cold_settings(config):
+    settings = config.get('tiers', {})
+    cold_dir = settings.get('cold_dir') or config['directories']['archive']
+    return settings.get('cold_after_days', COLD_AFTER_DAYS), os.path.expanduser(cold_dir)
+
+
+# Is the machine idle enough for background compression?
+def is_idle(max_load=MAX_LOAD):
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1) < max_load
+    except OSError:
+        return True
+
+
+# Compact warm entries archived more than cold_after_days ago into cold storage
+# with archiver (bundles.Bundler or chunks.ChunkArchiver), batch by batch until
+# none are left or should_stop() returns True. Returns {"compacted", "failed",
+# "bytes"}.
+def compact(archive_catalog, archiver, cold_after_days=COLD_AFTER_DAYS, cold_dir=None, now=None, batch=BATCH,
+            should_stop=None):
+    now = now or time.time()
+    cutoff = now - cold_after_days * 86400
+    counts = {"compacted": 0, "failed": 0, "bytes": 0}
+    after = (0, 0)
+    while not (should_stop and should_stop()):
+        entries = archive_catalog.warm(cutoff, batch, after)
+        if not entries:
+            break
+        after = (entries[-1]["archived_at"], entries[-1]["id"])
+        by_source = {}
+        moves = []
+        for entry in entries:
+            location = entry["location"]
+            folder = cold_dir or os.path.dirname(location)
+            move = sweep.PlannedMove(location, os.path.join(folder, entry["name"]), "cold storage",
+                                     entry["size"], sweep.ARCHIVE, None, None, None, entry["mtime_ns"])
+            by_source[location] = entry
+            moves.append(move)
+
+        relocated = []
+        for move, error in archiver.archive(moves):
+            entry = by_source[move.source]
+            if error:
+                print(f"Error compacting {move.source}: {error}")
+                counts["failed"] += 1
+                continue
+            relocated.append((entry["id"], move.destination, archiver.backend))
+            counts["compacted"] += 1
+            counts["bytes"] += entry["size"]
+        archive_catalog.relocate(relocated)
+    return counts
+
+
+# Background compaction in the watcher: runs compact() whenever the daemon has
+# seen no events for idle_seconds and the machine is idle, stopping between
+# batches as soon as either changes
+class IdleCompactor(threading.Thread):
+    def __init__(self, archive_catalog, archiver, cold_after_days=COLD_AFTER_DAYS, cold_dir=None,
+                 idle_seconds=IDLE_SECONDS, max_load=MAX_LOAD):
+        super().__init__(name="idle-compactor", daemon=True)
+        self.archive_catalog = archive_catalog
+        self.archiver = archiver
+        self.cold_after_days = cold_after_days
+        self.cold_dir = cold_dir
+        self.idle_seconds = idle_seconds
+        self.max_load = max_load
+        self._last_activity = time.monotonic()
+        self._stop = threading.Event()
+
+    # Called for every batch of file events
+    def activity(self):
+        self._last_activity = time.monotonic()
+
+    def stop(self):
+        self._stop.set()
+
+    def _busy(self):
+        return (self._stop.is_set() or time.monotonic() - self._last_activity < self.idle_seconds
+                or not is_idle(self.max_load))
+
+    def run(self):
+        # Nothing due is re-checked at most every idle period
+        while not self._stop.wait(min(self.idle_seconds, 60)):
+            if self._busy():
+                continue
+            try:
+                counts = compact(self.archive_catalog, self.archiver, self.cold_after_days, self.cold_dir,
+                                 batch=BATCH, should_stop=self._busy)
+            except Exception as e:
+                logging.error(f"Error compacting the archive: {e}")
+                continue
+            if counts["compacted"] or counts["failed"]:
+                logging.info(f"Compacted {counts['compacted']} archived files ({counts['bytes']} bytes) "
+                             f"into cold storage, {counts['failed']} failed.")
+            else:
+                # Nothing is due; look again after the next idle period
+                self._last_activity = time.monotonic()
+
+
+# Background compactor for the watcher from config['tiers'], or None when tiers
+# (or the catalog they rely on) are disabled
+def idle_compactor(config, archive_catalog):
+    if not enabled(config) or archive_catalog is None:
+        return None
+    settings = config['tiers']
+    cold_after_days, cold_dir = cold_settings(config)
+    return IdleCompactor(archive_catalog, sweep.cold_archiver(config), cold_after_days, cold_dir,
+                         settings.get('idle_seconds', IDLE_SECONDS), settings.get('max_load', MAX_LOAD))
@@ -0,0 +1,180 @@
+import os
+import time
+from datetime import datetime
+
+import bundles
+import catalog
+import journal
+import mover
+import retention
+import sweep
+from destinations import DestinationCache
+
+# Bulk undo of a journaled run (`/undo`, `python Automation.py undo`).
+#
+# Every finished move of the run is reversed: the file goes back to the path
+# it was moved from, as one plan executed on the move engine, so undoing
+# thousands of moves runs in parallel on the same per-device pools (rename
+# on one device, kernel copy across devices) as the sweep that made them.
+# A file whose size or mtime differs from what the journal recorded was
+# changed after the run and is left alone, as is one that is gone. If the
+# original path has been taken since, the file comes back under a tagged name.
+# Files the run packed into bundles or chunks are extracted back instead, in
+# parallel, each into a hidden partial file that only takes the original name
+# once complete, after which the member or manifest is dropped from the
+# archive. Files put back are marked as just accessed, so the next sweep does
+# not archive them again for their age.
+# Duplicates the run removed (see duplicates.py) and archived files it expired
+# (see retention.py) are reported as skipped.
+# The undo is itself a journaled run, and the undone run is marked so it is
+# not reversed twice.
+
+# Tag appended to a restored name whose original path is taken
+_RESTORED_TAG = "restored"
+
+
+# Kinds of moves that are not reversed: undo moves themselves and catalog restores
+_IRREVERSIBLE = (sweep.UNDO, catalog.RESTORE)
+
+
+# The newest finished run that moved files and has not been undone
+def last_run(journal_dir):
+    for run in journal.list_runs(journal_dir):
+        if run.undone_by is None and any(kind not in _IRREVERSIBLE and state == "D" and destination is not None
+                                         for kind, _, destination, state, _, _, _ in run.moves.values()):
+            return run
+    return None
+
+
+# Is the bundle member or chunk manifest at location still in the archive?
+def _packed_exists(backend, location):
+    if backend == catalog.BUNDLED:
+        return os.path.basename(location) in bundles.load_index(os.path.dirname(location))["members"]
+    return os.path.lexists(location)
+
+
+# Plan the reversal of run; returns (plan, skipped) where skipped lists
+# {"path", "reason"} for files that cannot be put back. Files packed into a
+# bundle or chunk store are extracted by moves with their backend set.
+def plan_undo(run):
+    started = time.perf_counter()
+    destinations = DestinationCache()
+    moves, skipped = [], []
+    for kind, source, destination, state, size, mtime_ns, backend in run.moves.values():
+        if state != "D" or kind in _IRREVERSIBLE:
+            continue
+        if destination is None:
+            skipped.append({"path": source, "reason": "expired" if kind == retention.EXPIRE else "removed as a duplicate"})
+            continue
+        if backend:
+            try:
+                present = _packed_exists(backend, destination)
+            except (OSError, ValueError):
+                present = False
+            if not present:
+                skipped.append({"path": destination, "reason": "missing"})
+                continue
+            folder, name = os.path.split(source)
+            try:
+                moves.append(sweep.PlannedMove(destination, destinations.allocate(folder, name, _RESTORED_TAG),
+                                               f"undo of run {run.run_id}", size, sweep.UNDO, None, None,
+                                               _RESTORED_TAG, mtime_ns, None, backend))
+            except OSError as e:
+                skipped.append({"path": destination, "reason": str(e)})
+            continue
+        try:
+            current = os.lstat(destination)
+        except FileNotFoundError:
+            skipped.append({"path": destination, "reason": "missing"})
+            continue
+        if (size is not None and current.st_size != size) or (mtime_ns is not None and current.st_mtime_ns != mtime_ns):
+            skipped.append({"path": destination, "reason": "changed since the run"})
+            continue
+        folder, name = os.path.split(source)
+        try:
+            target = destinations.allocate(folder, name, _RESTORED_TAG)
+            target_dev = destinations.device_of(folder)
+        except OSError as e:
+            skipped.append({"path": destination, "reason": str(e)})
+            continue
+        moves.append(sweep.PlannedMove(destination, target, f"undo of run {run.run_id}", current.st_size,
+                                       sweep.UNDO, current.st_dev, target_dev, _RESTORED_TAG,
+                                       current.st_mtime_ns))
+    plan = sweep.SweepPlan(tuple(moves), datetime.now(), time.perf_counter() - started,
+                           destinations, (), ())
+    return plan, skipped
+
+
+# Has move put its file back?
+def _restored(move):
+    if not os.path.lexists(move.destination):
+        return False
+    if move.backend is None:
+        return not os.path.lexists(move.source)
+    try:
+        return not _packed_exists(move.backend, move.source)
+    except (OSError, ValueError):
+        return False
+
+
+# Undo run_id (or the last run) and return {"run_id", "undo_run_id", "restored",
+# "skipped", "failed", "timings"}. Raises LookupError for an unknown or
+# already undone run. Files it had archived are marked restored in archive_catalog.
+def undo_run(journal_dir, run_id=None, archive_catalog=None):
+    if run_id is None:
+        run = last_run(journal_dir)
+        if run is None:
+            raise LookupError("no run to undo")
+    else:
+        try:
+            run = journal.read_run(journal.run_path(journal_dir, run_id))
+        except FileNotFoundError:
+            raise LookupError(f"unknown run {run_id}")
+        if run.counts is None:
+            raise LookupError(f"run {run_id} has not finished")
+        if run.undone_by:
+            raise LookupError(f"run {run_id} was already undone by {run.undone_by}")
+
+    plan, skipped = plan_undo(run)
+    counts = sweep.execute_plan(plan, journal_dir)
+    restored = [move for move in plan.moves if _restored(move)]
+    for move in restored:
+        if move.backend is None:
+            try:
+                mover.mark_accessed(move.destination)
+            except OSError:
+                pass
+    if plan.moves:
+        journal.mark_undone(journal_dir, run.run_id, counts.get("run_id") or journal.new_run_id())
+        if archive_catalog:
+            archive_catalog.forget_run(run.run_id, [move.source for move in restored])
+    # Category and month folders the run created are removed once empty again
+    for folder in {os.path.dirname(move.source) for move in plan.moves if move.backend is None}:
+        try:
+            os.rmdir(folder)
+        except OSError:
+            pass
+
+    return {
+        "run_id": run.run_id,
+        "undo_run_id": counts.get("run_id"),
+        "restored": counts[sweep.UNDO],
+        "failed": len(plan.moves) - counts[sweep.UNDO],
+        "skipped": skipped,
+        "timings": counts["timings"],
+    }
+
+
+# Summaries of the newest finished runs, for choosing one to undo
+def recent_runs(journal_dir, limit=20):
+    runs = []
+    for run in journal.list_runs(journal_dir):
+        runs.append({
+            "run_id": run.run_id,
+            "started": datetime.fromtimestamp(run.started).isoformat(timespec="seconds") if run.started else None,
+            "counts": run.counts,
+            "undone_by": run.undone_by,
+        })
+        if len(runs) >= limit:
+            break
+    return runs
@@ -0,0 +1,342 @@
+import logging
+import os
+import threading
+import time
+
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+
+import journal
+import scanner
+import snapshots
+import stability
+import sweep
+import tiers
+
+# Real-time organizer: `python Automation.py watch`.
+#
+# Desktop, Downloads and the Screenshots folder are watched with watchdog, and
+# new files are routed through the same Router decisions as a sweep. Events are
+# coalesced rather than handled one by one: paths collect in a set until no new
+# event has arrived for quiet_seconds (or max_delay_seconds have passed since
+# the first one), and the whole set is then decided and moved as one batch on
+# the move engine. Unzipping 5,000 files therefore costs a few batches, not
+# 5,000 separate sweeps, and a file written in many chunks is handled once.
+# Paths that are still downloading or being written are parked on a
+# StabilityTracker (stability.py) and join a later batch once they settle.
+#
+# Events can be lost: inotify drops them when its kernel queue overflows (and
+# watchdog does not report it), FSEvents coalesces them, and nothing is seen
+# while the machine sleeps or the process is stopped. The daemon therefore
+# keeps a TreeSummary, the last known mtime of every watched directory, and
+# reconciles it against the disk when
+#   - a heartbeat shows the loop stalled or the machine slept (a jump between
+#     wall clock and monotonic clock, or a late wake-up),
+#   - the observer thread died (it is restarted), or
+#   - every audit_seconds, as a safety net for silent overflows.
+# Reconciling costs one stat() per watched directory; only directories whose
+# mtime moved are listed again, never the whole tree.
+#
+# With a tiered archive, the daemon also compacts old warm archive entries into
+# cold storage on a background thread while it sees no events (see tiers.py).
+
+# Seconds without new events before a batch is flushed
+QUIET_SECONDS = 2.0
+
+# Upper bound on how long a busy burst can hold back a batch
+MAX_DELAY_SECONDS = 30.0
+
+# Seconds between safety-net audits of the watched directories' mtimes
+AUDIT_SECONDS = 60.0
+
+# The main loop wakes at least this often to check for stalls
+HEARTBEAT_SECONDS = 1.0
+
+# A wake-up this much later than expected (or a wall/monotonic clock divergence
+# this large) means events may have been missed
+GAP_SECONDS = 5.0
+
+
+# Collects file event paths and hands them out in debounced batches
+class EventBatcher(FileSystemEventHandler):
+    def __init__(self, quiet_seconds=QUIET_SECONDS, max_delay_seconds=MAX_DELAY_SECONDS):
+        super().__init__()
+        self.quiet_seconds = quiet_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self._paths = set()
+        self._first = None
+        self._last = None
+        self._condition = threading.Condition()
+
+    def on_any_event(self, event):
+        if event.is_directory:
+            return
+        if event.event_type == 'moved':
+            path = event.dest_path
+        elif event.event_type in ('created', 'modified', 'closed'):
+            path = event.src_path
+        elif event.event_type == 'deleted':
+            with self._condition:
+                self._paths.discard(os.fsdecode(event.src_path))
+            return
+        else:
+            return
+        self.add(os.fsdecode(path))
+
+    def add(self, path):
+        with self._condition:
+            now = time.monotonic()
+            if not self._paths:
+                self._first = now
+            self._paths.add(path)
+            self._last = now
+            self._condition.notify()
+
+    # Directories with event paths waiting for the next batch
+    def pending_directories(self):
+        with self._condition:
+            return {os.path.dirname(path) for path in self._paths}
+
+    # Block until a batch is due (returning its paths), or until stop is set or
+    # timeout seconds pass (returning an empty set)
+    def next_batch(self, stop, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while not stop.is_set():
+                if deadline is not None and time.monotonic() >= deadline:
+                    break
+                wake = deadline
+                if self._paths:
+                    due = min(self._last + self.quiet_seconds, self._first + self.max_delay_seconds)
+                    if due <= time.monotonic():
+                        batch, self._paths = self._paths, set()
+                        return batch
+                    wake = due if wake is None else min(wake, due)
+                self._condition.wait(0.5 if wake is None else max(0.0, wake - time.monotonic()))
+            return set()
+
+
+# Roots watched by the daemon: the sweep roots plus the Screenshots folder itself
+def watch_roots(config):
+    roots = sweep.default_roots(config)
+    screenshots_dir = os.path.expanduser(config['directories']['screenshots'])
+    roots.append(sweep.SweepRoot(screenshots_dir, organize=False, screenshots=True))
+    return roots
+
+
+# The watched root whose files directory holds, or None if a sweep would not
+# touch them (hidden, too deep, or inside a folder the organizer itself fills)
+def root_for_directory(directory, roots, router):
+    for root in sorted(roots, key=lambda root: len(root.directory), reverse=True):
+        relative = os.path.relpath(directory, root.directory)
+        if relative == os.curdir:
+            return root
+        if relative.startswith(os.pardir):
+            continue
+        parts = relative.split(os.sep)
+        if len(parts) > root.recursive_depth or parts[0] in router.generated_folders:
+            return None
+        if any(part.startswith('.') for part in parts):
+            return None
+        if any(os.path.commonpath([directory, skip]) == skip
+               for skip in (router.screenshots_dir, root.archive_dir) if skip):
+            return None
+        return root
+    return None
+
+
+def root_for(path, roots, router):
+    return root_for_directory(os.path.dirname(path), roots, router)
+
+
+# Last known mtime of every watched directory, used to find where events were lost
+class TreeSummary:
+    def __init__(self, roots, router, journal_dir=None, bundler=None, archive_catalog=None):
+        self.roots = roots
+        self.router = router
+        self.journal_dir = journal_dir
+        self.bundler = bundler
+        self.archive_catalog = archive_catalog
+        self._mtimes = {}
+
+    # Record the current mtime of directories (missing ones are dropped)
+    def refresh(self, directories):
+        for directory in directories:
+            try:
+                self._mtimes[directory] = os.stat(directory).st_mtime_ns
+            except OSError:
+                self._mtimes.pop(directory, None)
+
+    # Seed from the tree summaries the catch-up sweep left in the snapshots, or
+    # from a walk of the watched roots when incremental sweeps are disabled
+    def load(self, snapshot_dir):
+        directories = []
+        for root in self.roots:
+            recorded = None
+            if snapshot_dir:
+                recorded = snapshots.open_snapshot(snapshot_dir, root, self.router.fingerprint).directories()
+            if not recorded:
+                recorded = [root.directory] + [directory for directory, _, _, _ in scanner.walk_tree(
+                    root.directory, root.recursive_depth, self.router.generated_folders,
+                    [self.router.screenshots_dir] + ([root.archive_dir] if root.archive_dir else []))]
+            directories.extend(recorded)
+        self.refresh(directories)
+
+    # Directories whose mtime moved since they were last recorded, skipping
+    # those in skip (e.g. with events still waiting to be batched)
+    def changed(self, skip=()):
+        changed = []
+        for directory, mtime_ns in list(self._mtimes.items()):
+            if directory in skip:
+                continue
+            try:
+                current = os.stat(directory).st_mtime_ns
+            except OSError:
+                del self._mtimes[directory]
+                continue
+            if current != mtime_ns:
+                changed.append(directory)
+        return changed
+
+    # List changed directories again and route everything in them; new
+    # subdirectories within a root's recursive depth join the summary.
+    # Files not yet complete are appended to held.
+    def reconcile(self, directories, held=None):
+        totals = {sweep.ORGANIZE: 0, sweep.ARCHIVE: 0, sweep.SCREENSHOT: 0}
+        queue = list(directories)
+        seen = set()
+        while queue:
+            directory = queue.pop()
+            root = root_for_directory(directory, self.roots, self.router)
+            if directory in seen or root is None:
+                continue
+            seen.add(directory)
+            subdirs = []
+            try:
+                entries = scanner.scan_files(directory, subdirs=subdirs)
+            except OSError:
+                continue
+            counts = sweep.sweep_files(root, [entry.path for entry in entries], self.router,
+                                       held=held, journal_dir=self.journal_dir, bundler=self.bundler,
+                                       archive_catalog=self.archive_catalog)
+            for kind in totals:
+                totals[kind] += counts[kind]
+            for name in subdirs:
+                subdir = os.path.join(directory, name)
+                if subdir not in self._mtimes:
+                    queue.append(subdir)
+        self.refresh(seen)
+        return totals
+
+
+# Decide and move one batch of event paths, grouped by root; paths of files not
+# yet complete are appended to held
+def route_batch(paths, roots, router, held=None, journal_dir=None, bundler=None, archive_catalog=None):
+    by_root = {}
+    for path in paths:
+        root = root_for(path, roots, router)
+        if root is not None:
+            by_root.setdefault(root, []).append(path)
+
+    totals = {sweep.ORGANIZE: 0, sweep.ARCHIVE: 0, sweep.SCREENSHOT: 0}
+    for root, root_paths in by_root.items():
+        counts = sweep.sweep_files(root, root_paths, router, held=held, journal_dir=journal_dir, bundler=bundler,
+                                   archive_catalog=archive_catalog)
+        for kind in totals:
+            totals[kind] += counts[kind]
+    logging.info(f"Batch of {len(paths)} changed paths: {totals[sweep.ORGANIZE]} organized, "
+                 f"{totals[sweep.ARCHIVE]} archived, {totals[sweep.SCREENSHOT]} screenshots.")
+    return totals
+
+
+def _start_observer(batcher, roots):
+    observer = Observer()
+    for root in roots:
+        observer.schedule(batcher, root.directory, recursive=root.recursive_depth > 0)
+    observer.start()
+    return observer
+
+
+# Run the organizer daemon until stop is set (or Ctrl-C)
+def watch(config, stop=None):
+    stop = stop or threading.Event()
+    settings = config.get('watch', {})
+    audit_seconds = settings.get('audit_seconds', AUDIT_SECONDS)
+    router = sweep.Router(config)
+    roots = [root for root in watch_roots(config) if os.path.isdir(root.directory)]
+    snapshot_dir = sweep.snapshot_dir(config)
+    journal_dir = sweep.journal_dir(config)
+    if journal_dir:
+        journal.recover(journal_dir)
+
+    # Catch up on whatever arrived while the daemon was not running
+    logging.info("Sweeping watched folders before watching...")
+    bundler = sweep.bundler(config)
+    archive_catalog = sweep.archive_catalog(config)
+    sweep.run_sweep(roots, router, snapshot_dir=snapshot_dir, journal_dir=journal_dir, bundler=bundler,
+                    archive_catalog=archive_catalog)
+    summary = TreeSummary(roots, router, journal_dir, bundler, archive_catalog)
+    summary.load(snapshot_dir)
+
+    batcher = EventBatcher(settings.get('quiet_seconds', QUIET_SECONDS),
+                           settings.get('max_delay_seconds', MAX_DELAY_SECONDS))
+    tracker = stability.StabilityTracker(router.quiet_seconds)
+    held = []
+    observer = _start_observer(batcher, roots)
+    compactor = tiers.idle_compactor(config, archive_catalog)
+    if compactor:
+        compactor.start()
+    logging.info(f"Watching {', '.join(root.directory for root in roots)}")
+    last_audit = time.monotonic()
+
+    try:
+        while not stop.is_set():
+            wall, monotonic = time.time(), time.monotonic()
+            batch = batcher.next_batch(stop, HEARTBEAT_SECONDS)
+            late = time.monotonic() - monotonic - HEARTBEAT_SECONDS
+            slept = (time.time() - wall) - (time.monotonic() - monotonic)
+
+            # Held files re-enter through the tracker: events for them re-arm
+            # their timer, and settled ones are routed with this batch. A held
+            # file with a new event is observed (and routed) once.
+            candidates = dict.fromkeys(held + [path for path in batch if root_for(path, roots, router)])
+            held = []
+            ready = list(dict.fromkeys([path for path in candidates if tracker.observe(path)] + tracker.due()))
+            if (batch or ready) and compactor:
+                compactor.activity()
+            if ready:
+                route_batch(ready, roots, router, held, journal_dir, bundler, archive_catalog)
+            if batch:
+                summary.refresh({os.path.dirname(path) for path in batch})
+
+            reason = None
+            if late > GAP_SECONDS:
+                reason = f"loop stalled for {late:.0f}s"
+            elif abs(slept) > GAP_SECONDS:
+                reason = f"clock jumped {slept:.0f}s (sleep or suspend)"
+            elif not observer.is_alive():
+                reason = "observer stopped"
+                observer = _start_observer(batcher, roots)
+            elif time.monotonic() - last_audit >= audit_seconds:
+                reason = "audit"
+
+            if reason:
+                # Audits leave directories with queued events to the next batch;
+                # after a gap everything that moved is listed again
+                skip = batcher.pending_directories() if reason == "audit" else ()
+                changed = summary.changed(skip)
+                last_audit = time.monotonic()
+                if changed:
+                    if reason != "audit" or logging.getLogger().isEnabledFor(logging.DEBUG):
+                        logging.info(f"Possible missed events ({reason}); rescanning {len(changed)} directories")
+                    totals = summary.reconcile(changed, held)
+                    if any(totals.values()):
+                        logging.warning(f"Reconciled missed events ({reason}): {totals[sweep.ORGANIZE]} organized, "
+                                        f"{totals[sweep.ARCHIVE]} archived, {totals[sweep.SCREENSHOT]} screenshots.")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if compactor:
+            compactor.stop()
+        observer.stop()
+        observer.join()